@@ -0,0 +1,2 @@
+"""Modules used by compare_score to match ZooMS peak lists
+against the theoretical peptide m/z values"""
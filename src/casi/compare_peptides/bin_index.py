@@ -0,0 +1,287 @@
+"""
+bin_index.py
+
+Binned species bitmap index for high throughput scoring.
+The m/z axis of the mass range is split into fixed width bins. For each
+bin two packed bitsets of species (one bit per species) are stored:
+    * certain - species with a theoretical m/z value within the threshold
+      of every m/z value in the bin
+    * possible - species with a theoretical m/z value within the threshold
+      of any m/z value in the bin
+A peak in a bin where both bitsets are the same is scored straight from
+the bitset. Only peaks in the few bins where they differ (a theoretical
+m/z value is at the edge of the threshold) are checked exactly with the
+mass index, so the match counts are the same as the other engines.
+
+The index depends on the library, threshold and mass range, so it can
+be saved as a .npz file and loaded again if these are the same. The file
+is written to a temporary file and then renamed, so runs at the same
+time never read half a file. If it cannot be saved (e.g., the folder is
+read only) the index is only used for this run.
+"""
+
+import os
+import sys
+import hashlib
+import tempfile
+import zipfile
+from pathlib import Path
+from collections import namedtuple
+
+import numpy as np
+
+from casi.compare_peptides.mass_index import MassIndex, peak_species_hits
+
+BIN_INDEX_VERSION = 1
+# default bin width in Da
+BIN_WIDTH = 0.01
+# safety margin for float32 rounding at the bin edges
+EDGE_MARGIN = 1e-3
+
+BinIndex = namedtuple(
+    "BinIndex",
+    [
+        "low",  # m/z value at the start of the first bin
+        "width",  # bin width
+        "threshold",
+        "certain",  # packed bitsets (bins x species bytes)
+        "possible",
+        "fingerprint",  # hash of the mass index the bins were built from
+    ]
+)
+
+
+def mass_index_fingerprint(mass_index: MassIndex) -> str:
+    """Creates a hash of the m/z values and species in the mass index"""
+    sha = hashlib.sha1()
+    for array in (mass_index.masses, mass_index.indptr, mass_index.species_ids):
+        sha.update(np.ascontiguousarray(array).tobytes())
+    sha.update(str(mass_index.num_species).encode())
+    return sha.hexdigest()
+
+
+def species_bins(mass_index: MassIndex,
+                 bin_start: np.ndarray,
+                 bin_end: np.ndarray,
+                 num_bins: int) -> np.ndarray:
+    """
+    Marks the bins covered by the m/z values of each species.
+    Each m/z value covers the bins from bin_start to bin_end (inclusive).
+
+    args
+        mass_index (MassIndex): index built by build_mass_index
+        bin_start (np.ndarray): first bin for each unique m/z value
+        bin_end (np.ndarray): last bin for each unique m/z value
+        num_bins (int): total number of bins
+
+    returns
+        bitsets (np.ndarray): packed bitsets of species for every bin
+    """
+    counts = np.diff(mass_index.indptr)
+    pair_start = np.repeat(bin_start, counts)
+    pair_end = np.repeat(bin_end, counts)
+    species_ids = mass_index.species_ids
+
+    # keep ranges that are in at least one bin
+    keep = pair_end >= pair_start
+    keep &= (pair_end >= 0) & (pair_start < num_bins)
+    pair_start = np.clip(pair_start[keep], 0, num_bins)
+    pair_end = np.clip(pair_end[keep], -1, num_bins - 1)
+    species_ids = species_ids[keep]
+
+    # pairs of each species are one slice after sorting by species
+    order = np.argsort(species_ids, kind="stable")
+    pair_start = pair_start[order]
+    pair_end = pair_end[order]
+    bounds = np.searchsorted(species_ids[order], np.arange(mass_index.num_species + 1))
+
+    # the bit of each species is set straight in its packed byte column
+    # (the same bit order as np.packbits), so only one bins x species/8
+    # array is held
+    bitsets = np.zeros((num_bins, (mass_index.num_species + 7) // 8), dtype=np.uint8)
+    for species in range(mass_index.num_species):
+        first, last = bounds[species], bounds[species + 1]
+        if first == last:
+            continue
+        # difference array so overlapping ranges are only counted once
+        diff = np.bincount(pair_start[first:last], minlength=num_bins + 1)
+        diff -= np.bincount(pair_end[first:last] + 1, minlength=num_bins + 1)
+        covered = np.cumsum(diff[:num_bins]) > 0
+        bitsets[:, species // 8] |= covered.astype(np.uint8) << np.uint8(7 - species % 8)
+    return bitsets
+
+
+def build_bin_index(mass_index: MassIndex,
+                    threshold: float,
+                    mass_range: tuple,
+                    width: float = BIN_WIDTH) -> BinIndex:
+    """
+    Builds the binned species bitmap index.
+
+    args
+        mass_index (MassIndex): index built by build_mass_index
+        threshold (float): the tolerance for a match
+        mass_range (tuple): (min, max) m/z values that can be matched
+        width (float): the bin width
+
+    returns
+        bin_index (BinIndex): the certain and possible bitsets for each bin
+    """
+    low = float(mass_range[0])
+    num_bins = int(np.floor((float(mass_range[1]) - low) / width)) + 1
+    masses = mass_index.masses.astype(np.float64)
+
+    # possible: m/z value within threshold of any part of the bin
+    possible_start = np.floor((masses - threshold - EDGE_MARGIN - low) / width)
+    possible_end = np.floor((masses + threshold + EDGE_MARGIN - low) / width)
+    # certain: m/z value within threshold of every part of the bin
+    certain_start = np.ceil((masses - threshold + EDGE_MARGIN - low) / width)
+    certain_end = np.floor((masses + threshold - EDGE_MARGIN - low) / width) - 1
+
+    possible = species_bins(
+        mass_index, possible_start.astype(np.int64), possible_end.astype(np.int64), num_bins
+    )
+    certain = species_bins(
+        mass_index, certain_start.astype(np.int64), certain_end.astype(np.int64), num_bins
+    )
+    bin_index = BinIndex(
+        low, width, threshold, certain, possible, mass_index_fingerprint(mass_index)
+    )
+    return bin_index
+
+
+def save_bin_index(bin_index: BinIndex, index_file: Path) -> None:
+    """Saves the bin index as a .npz file, replacing the file in one step"""
+    index_file = Path(index_file)
+    temp_file = tempfile.NamedTemporaryFile(
+        dir=index_file.parent, prefix=index_file.stem, suffix=".tmp", delete=False
+    )
+    try:
+        with temp_file:
+            np.savez(
+                temp_file,
+                version=np.array(BIN_INDEX_VERSION),
+                low=np.array(bin_index.low),
+                width=np.array(bin_index.width),
+                threshold=np.array(bin_index.threshold),
+                certain=bin_index.certain,
+                possible=bin_index.possible,
+                fingerprint=np.array(bin_index.fingerprint),
+            )
+        os.replace(temp_file.name, index_file)
+    except BaseException:
+        Path(temp_file.name).unlink(missing_ok=True)
+        raise
+
+
+def read_bin_index(index_file: Path) -> BinIndex:
+    """Reads a bin index saved by save_bin_index. Returns None if the
+    file does not exist, cannot be read or is from a different version"""
+    if not index_file.is_file():
+        return None
+    try:
+        with np.load(index_file, allow_pickle=False) as npz:
+            if int(npz["version"]) != BIN_INDEX_VERSION:
+                return None
+            bin_index = BinIndex(
+                float(npz["low"]),
+                float(npz["width"]),
+                float(npz["threshold"]),
+                npz["certain"],
+                npz["possible"],
+                str(npz["fingerprint"]),
+            )
+    except (OSError, EOFError, ValueError, KeyError, zipfile.BadZipFile):
+        return None
+    return bin_index
+
+
+def load_bin_index(mass_index: MassIndex,
+                   threshold: float,
+                   mass_range: tuple,
+                   index_file: Path = None,
+                   width: float = BIN_WIDTH) -> BinIndex:
+    """
+    Loads the bin index from index_file if it was built from the same
+    library, threshold and mass range. Otherwise builds the bin index
+    and saves it to index_file. Without index_file the bin index is
+    only built.
+
+    args
+        mass_index (MassIndex): index built by build_mass_index
+        threshold (float): the tolerance for a match
+        mass_range (tuple): (min, max) m/z values that can be matched
+        index_file (Path): the .npz file for the bin index (optional)
+        width (float): the bin width
+
+    returns
+        bin_index (BinIndex): the certain and possible bitsets for each bin
+    """
+    if index_file is None:
+        print("Building bin index for threshold +- {0}".format(threshold))
+        return build_bin_index(mass_index, threshold, mass_range, width)
+    num_bins = int(np.floor((float(mass_range[1]) - float(mass_range[0])) / width)) + 1
+    bin_index = read_bin_index(index_file)
+    if (
+        bin_index is not None
+        and bin_index.fingerprint == mass_index_fingerprint(mass_index)
+        and bin_index.threshold == threshold
+        and bin_index.low == float(mass_range[0])
+        and bin_index.width == width
+        and len(bin_index.certain) == num_bins
+    ):
+        return bin_index
+
+    print("Building bin index for threshold +- {0}".format(threshold))
+    bin_index = build_bin_index(mass_index, threshold, mass_range, width)
+    try:
+        save_bin_index(bin_index, index_file)
+    except OSError as error:
+        # e.g., a read only folder, the bins are built again next run
+        print("Bin index not saved ({0}), it is only used for this run".format(error))
+        return bin_index
+    print("Bin index saved to {0}".format(index_file))
+    return bin_index
+
+
+def bin_match_counts(bin_index: BinIndex,
+                     mass_index: MassIndex,
+                     exp_mz: np.ndarray) -> np.ndarray:
+    """
+    Counts the matches for every species using the bin bitsets.
+    Peaks in bins where the certain and possible species differ
+    are checked with the mass index. As in compare, experimental
+    peaks with the same m/z value are only counted once.
+
+    args
+        bin_index (BinIndex): index built by build_bin_index
+        mass_index (MassIndex): the mass index the bins were built from
+        exp_mz (np.ndarray): experimental m/z values
+
+    returns
+        match_counts (np.ndarray): number of matches for each species
+    """
+    num_species = mass_index.num_species
+    unique_mz = np.unique(exp_mz)
+    bins = np.floor((unique_mz.astype(np.float64) - bin_index.low) / bin_index.width)
+    bins = bins.astype(np.int64)
+    in_range = (bins >= 0) & (bins < len(bin_index.certain))
+
+    certain = bin_index.certain[bins[in_range]]
+    possible = bin_index.possible[bins[in_range]]
+    exact = (certain == possible).all(axis=1)
+
+    # peaks where the bitset is exact
+    match_counts = np.unpackbits(certain[exact], axis=1, count=num_species).sum(
+        axis=0, dtype=np.int64
+    )
+    # peaks at the edge of a bin (or outside the bins) are checked exactly
+    check_mz = np.concatenate([unique_mz[in_range][~exact], unique_mz[~in_range]])
+    if len(check_mz) > 0:
+        _, species_ids = peak_species_hits(mass_index, check_mz, bin_index.threshold)
+        match_counts += np.bincount(species_ids, minlength=num_species)
+    return match_counts
+
+
+if __name__ == "__main__":
+    sys.exit()
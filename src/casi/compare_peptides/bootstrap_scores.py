@@ -0,0 +1,111 @@
+"""
+bootstrap_scores.py
+
+Tests how stable the top species is by resampling the PMF peaks.
+Each bootstrap replicate draws the same number of peaks from the PMF
+with replacement, so some peaks are counted more than once and others
+are left out. The peaks are only looked up in the mass index once to
+make a peak x species hit matrix, then the match counts of every
+replicate are one matrix product:
+    replicate x peak weights @ peak x species hits
+The fraction of replicates where each species has the highest match
+count is reported. If several species have the same highest count
+the replicate is shared equally between them, so the fractions of all
+species add up to 1.
+"""
+
+import sys
+from collections import namedtuple
+
+import numpy as np
+
+from casi.compare_peptides.mass_index import MassIndex, peak_species_hits
+
+# replicates scored in one matrix product
+REPLICATE_CHUNK = 256
+
+BootstrapSettings = namedtuple(
+    "BootstrapSettings",
+    [
+        "replicates",  # number of bootstrap replicates
+        "seed",  # random seed so the results can be repeated
+    ],
+    defaults=[100, 0],
+)
+
+
+def hit_matrix(mass_index: MassIndex,
+               exp_mz: np.ndarray,
+               threshold: float) -> np.ndarray:
+    """
+    Makes the peak x species matrix with 1 where the peak
+    matches the species.
+
+    args
+        mass_index (MassIndex): index built by build_mass_index
+        exp_mz (np.ndarray): unique experimental m/z values
+        threshold (float): the tolerance for a match
+
+    returns
+        hits (np.ndarray): peak x species matrix of 0 and 1
+    """
+    hits = np.zeros((len(exp_mz), mass_index.num_species), dtype=np.float64)
+    if len(exp_mz) == 0:
+        return hits
+    peak_ids, species_ids = peak_species_hits(mass_index, exp_mz, threshold)
+    hits[peak_ids, species_ids] = 1
+    return hits
+
+
+def top_fraction(match_counts: np.ndarray) -> np.ndarray:
+    """
+    For each species the number of replicates where it has the
+    highest match count, ties shared equally.
+
+    args
+        match_counts (np.ndarray): number of matches (replicates x species)
+
+    returns
+        top (np.ndarray): number of replicates (shared) for each species
+    """
+    is_top = match_counts == match_counts.max(axis=1, keepdims=True)
+    return (is_top / is_top.sum(axis=1, keepdims=True)).sum(axis=0)
+
+
+def bootstrap_top(mass_index: MassIndex,
+                  exp_mz: np.ndarray,
+                  threshold: float,
+                  settings: BootstrapSettings) -> np.ndarray:
+    """
+    Scores the bootstrap replicates of a PMF and finds how often
+    each species has the highest match count.
+
+    args
+        mass_index (MassIndex): index built by build_mass_index
+        exp_mz (np.ndarray): experimental m/z values in the mass range
+        threshold (float): the tolerance for a match
+        settings (BootstrapSettings): number of replicates and random seed
+
+    returns
+        top (np.ndarray): fraction of replicates where each species is top
+    """
+    # as in compare, peaks with the same m/z value are only counted once
+    unique_mz = np.unique(exp_mz)
+    num_peaks = len(unique_mz)
+    top = np.zeros(mass_index.num_species)
+    if num_peaks == 0 or settings.replicates == 0:
+        return top
+    hits = hit_matrix(mass_index, unique_mz, threshold)
+
+    rng = np.random.default_rng(settings.seed)
+    probabilities = np.full(num_peaks, 1 / num_peaks)
+    for start in range(0, settings.replicates, REPLICATE_CHUNK):
+        size = min(REPLICATE_CHUNK, settings.replicates - start)
+        # number of times each peak is drawn in each replicate
+        weights = rng.multinomial(num_peaks, probabilities, size=size).astype(np.float64)
+        top += top_fraction(weights @ hits)
+    return top / settings.replicates
+
+
+if __name__ == "__main__":
+    sys.exit()
@@ -0,0 +1,159 @@
+"""
+decoy_scores.py
+
+Estimates whether the match count of a species is higher than expected
+by chance. Decoy peak lists are made from the PMF, either by shifting
+all the peaks by the same random amount (which keeps the spacing of the
+peaks) or by placing the same number of peaks at random m/z values.
+Every decoy is scored against every species and the match count of
+each species is compared to its counts for the decoys:
+    * z-score - (match count - decoy mean) / decoy standard deviation
+    * p-value - fraction of decoys with at least the same match count
+      (with one added to the top and bottom so it is never 0)
+
+All the decoys are looked up in the mass index together (in chunks to
+limit the memory), rather than scoring each decoy separately.
+"""
+
+import sys
+from collections import namedtuple
+
+import numpy as np
+
+from casi.compare_peptides.mass_index import MassIndex, peak_species_hits
+
+# decoys looked up in the mass index at once
+DECOY_CHUNK = 64
+# smallest shift (Da) for shifted decoys, so peaks do not match
+# the same theoretical peptides as the PMF
+MIN_SHIFT = 10.0
+
+DecoySettings = namedtuple(
+    "DecoySettings",
+    [
+        "number",  # number of decoy peak lists
+        "decoy_type",  # 'shift' or 'random'
+        "mass_range",  # (min, max) m/z values of the decoy peaks
+        "seed",  # random seed so the results can be repeated
+    ],
+    defaults=[100, "shift", (800, 3500), 0],
+)
+
+Significance = namedtuple(
+    "Significance",
+    [
+        "decoy_mean",
+        "decoy_sd",
+        "z_score",
+        "p_value",
+    ]
+)
+
+
+def decoy_peak_lists(exp_mz: np.ndarray, settings: DecoySettings) -> np.ndarray:
+    """
+    Makes the decoy peak lists from the experimental peaks.
+    Shifted peaks that go past the end of the mass range wrap around
+    to the start so every decoy has the same number of peaks.
+
+    args
+        exp_mz (np.ndarray): unique experimental m/z values in the mass range
+        settings (DecoySettings): number, type and mass range of the decoys
+
+    returns
+        decoy_mz (np.ndarray): m/z values of each decoy (decoys x peaks)
+    """
+    rng = np.random.default_rng(settings.seed)
+    low, high = float(settings.mass_range[0]), float(settings.mass_range[1])
+    width = high - low
+    if settings.decoy_type == "random":
+        decoy_mz = rng.uniform(low, high, size=(settings.number, len(exp_mz)))
+    else:
+        shifts = rng.uniform(MIN_SHIFT, width - MIN_SHIFT, size=(settings.number, 1))
+        decoy_mz = low + np.mod(exp_mz.astype(np.float64) - low + shifts, width)
+    return decoy_mz.astype(exp_mz.dtype)
+
+
+def decoy_match_counts(mass_index: MassIndex,
+                       decoy_mz: np.ndarray,
+                       threshold: float) -> np.ndarray:
+    """
+    Counts the matches for every species and every decoy.
+
+    args
+        mass_index (MassIndex): index built by build_mass_index
+        decoy_mz (np.ndarray): m/z values of each decoy (decoys x peaks)
+        threshold (float): the tolerance for a match
+
+    returns
+        match_counts (np.ndarray): number of matches (decoys x species)
+    """
+    num_decoys, num_peaks = decoy_mz.shape
+    num_species = mass_index.num_species
+    match_counts = np.zeros((num_decoys, num_species), dtype=np.int64)
+    if num_peaks == 0:
+        return match_counts
+    for start in range(0, num_decoys, DECOY_CHUNK):
+        chunk = decoy_mz[start: start + DECOY_CHUNK]
+        # all peaks of the chunk in one look up, each peak is counted
+        # once for each species it matches
+        peak_ids, species_ids = peak_species_hits(mass_index, chunk.ravel(), threshold)
+        if len(peak_ids) == 0:
+            # no decoy peak matches any species
+            continue
+        decoy_ids = peak_ids // num_peaks
+        counts = np.bincount(
+            decoy_ids * num_species + species_ids, minlength=len(chunk) * num_species
+        )
+        match_counts[start: start + len(chunk)] = counts.reshape(len(chunk), num_species)
+    return match_counts
+
+
+def significance(match_counts: np.ndarray, decoy_counts: np.ndarray) -> Significance:
+    """
+    Compares the match count of each species to its decoy match counts.
+
+    args
+        match_counts (np.ndarray): number of matches of each species
+        decoy_counts (np.ndarray): number of matches (decoys x species)
+
+    returns
+        significance (Significance): decoy mean and standard deviation,
+        z-score and empirical p-value of each species
+    """
+    decoy_mean = decoy_counts.mean(axis=0)
+    decoy_sd = decoy_counts.std(axis=0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        z_score = np.where(decoy_sd > 0, (match_counts - decoy_mean) / decoy_sd, np.nan)
+    at_least = (decoy_counts >= match_counts).sum(axis=0)
+    p_value = (at_least + 1) / (len(decoy_counts) + 1)
+    return Significance(decoy_mean, decoy_sd, z_score, p_value)
+
+
+def decoy_significance(mass_index: MassIndex,
+                       exp_mz: np.ndarray,
+                       match_counts: np.ndarray,
+                       threshold: float,
+                       settings: DecoySettings) -> Significance:
+    """
+    Scores the decoys of a PMF and compares them to the match counts.
+
+    args
+        mass_index (MassIndex): index built by build_mass_index
+        exp_mz (np.ndarray): experimental m/z values in the mass range
+        match_counts (np.ndarray): number of matches of each species
+        threshold (float): the tolerance for a match
+        settings (DecoySettings): number, type and mass range of the decoys
+
+    returns
+        significance (Significance): decoy mean and standard deviation,
+        z-score and empirical p-value of each species
+    """
+    # as in compare, peaks with the same m/z value are only counted once
+    decoy_mz = decoy_peak_lists(np.unique(exp_mz), settings)
+    decoy_counts = decoy_match_counts(mass_index, decoy_mz, threshold)
+    return significance(np.asarray(match_counts), decoy_counts)
+
+
+if __name__ == "__main__":
+    sys.exit()
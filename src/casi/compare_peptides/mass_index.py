@@ -0,0 +1,130 @@
+"""
+mass_index.py
+
+Inverted index over the theoretical m/z values of every species.
+Collagen is highly conserved so most m/z values are shared by many
+species. The index stores each unique m/z value once with the species
+that contain it (compressed sparse row layout). Each experimental peak
+is then looked up once and its match is added to every species at the
+same time, rather than comparing the peak list to each species in turn.
+"""
+
+import sys
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+from casi.compare_peptides.match_peaks import match_windows
+
+TAXON_COLUMNS = ["species", "genus", "subfamily", "family", "order"]
+
+MassIndex = namedtuple(
+    "MassIndex",
+    [
+        "masses",  # sorted unique m/z values
+        "indptr",  # species of masses[i] are species_ids[indptr[i]:indptr[i + 1]]
+        "species_ids",  # position of the species in the theoretical peptides list
+        "num_species",
+        "taxon_df",  # taxonomic information, one row per species
+    ]
+)
+
+
+def build_mass_index(theor_peaks_list: list) -> MassIndex:
+    """
+    Builds the inverted index from the theoretical peptides of all species.
+
+    args
+        theor_peaks_list (list): a dataframe of theoretical peptides for each species
+
+    returns
+        mass_index (MassIndex): unique m/z values and the species that contain them
+    """
+    num_species = len(theor_peaks_list)
+    all_masses = np.concatenate(
+        [theor_peaks["mass1"].to_numpy() for theor_peaks in theor_peaks_list]
+    )
+    all_species = np.repeat(
+        np.arange(num_species, dtype=np.int32),
+        [len(theor_peaks) for theor_peaks in theor_peaks_list],
+    )
+
+    masses, mass_ids = np.unique(all_masses, return_inverse=True)
+    # each (mass, species) pair only once
+    # sorted by mass then species so the species of a mass are together
+    pairs = np.unique(mass_ids.astype(np.int64) * num_species + all_species)
+    species_ids = (pairs % num_species).astype(np.int32)
+    pair_mass_ids = pairs // num_species
+    indptr = np.searchsorted(pair_mass_ids, np.arange(len(masses) + 1), side="left")
+
+    # taxonomic information in the same format as compare
+    taxon_df = pd.concat(
+        [
+            theor_peaks[TAXON_COLUMNS].iloc[[0]].reset_index(drop=True)
+            for theor_peaks in theor_peaks_list
+        ]
+    )
+
+    mass_index = MassIndex(masses, indptr, species_ids, num_species, taxon_df)
+    return mass_index
+
+
+def peak_species_hits(mass_index: MassIndex,
+                      exp_mz: np.ndarray,
+                      threshold: float) -> tuple:
+    """
+    Finds every (peak, species) pair where the species has a theoretical
+    m/z value within +- threshold of the peak. Each pair is only returned once.
+
+    args
+        mass_index (MassIndex): index built by build_mass_index
+        exp_mz (np.ndarray): experimental m/z values
+        threshold (float): the tolerance for a match
+
+    returns
+        peak_ids, species_ids (np.ndarray, np.ndarray): the matching pairs
+    """
+    lo, hi = match_windows(mass_index.masses, exp_mz, threshold)
+    # masses in a window are next to each other so their species
+    # are one slice of species_ids
+    start = mass_index.indptr[lo]
+    counts = mass_index.indptr[hi] - start
+    total = counts.sum()
+    peak_ids = np.repeat(np.arange(len(exp_mz)), counts)
+    offsets = np.repeat(start - (np.cumsum(counts) - counts), counts)
+    species_ids = mass_index.species_ids[offsets + np.arange(total)]
+
+    # remove pairs where a peak matches a species more than once
+    # (sort and compare neighbours, faster than np.unique for large arrays)
+    pairs = np.sort(peak_ids.astype(np.int64) * mass_index.num_species + species_ids)
+    # no peaks or no peak matches any species
+    if len(pairs) > 0:
+        pairs = pairs[np.concatenate(([True], pairs[1:] != pairs[:-1]))]
+    return pairs // mass_index.num_species, pairs % mass_index.num_species
+
+
+def species_match_counts(mass_index: MassIndex,
+                         exp_mz: np.ndarray,
+                         threshold: float) -> np.ndarray:
+    """
+    Counts the matches for every species in one pass over the peaks.
+    As in compare, experimental peaks with the same m/z value
+    are only counted once.
+
+    args
+        mass_index (MassIndex): index built by build_mass_index
+        exp_mz (np.ndarray): experimental m/z values
+        threshold (float): the tolerance for a match
+
+    returns
+        match_counts (np.ndarray): number of matches for each species
+    """
+    unique_mz = np.unique(exp_mz)
+    _, species_ids = peak_species_hits(mass_index, unique_mz, threshold)
+    match_counts = np.bincount(species_ids, minlength=mass_index.num_species)
+    return match_counts
+
+
+if __name__ == "__main__":
+    sys.exit()
@@ -0,0 +1,160 @@
+"""
+match_export.py
+
+Saves the matching m/z values of the top species of each sample.
+Rows are written to the file as each sample is scored, so in batch mode
+the matches of all samples are never held in memory at once. The file
+is csv, JSON Lines or Parquet (needs pyarrow, written one row group per
+sample). Each row is one experimental peak matched to a theoretical
+peptide of one of the top species:
+    Sample, Rank, taxon columns, Exp MZ, Exp intensity, Theor MZ,
+    peptide sequence, position, missed cleavages and PTM counts
+m/z values and intensities read as float32 are written with the same
+digits as the peak list (e.g., 809.4027 rather than 809.4027099609375).
+"""
+
+import sys
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from casi.compare_peptides.options import EXPORT_FORMATS
+
+# column name and type of each column in the export
+EXPORT_COLUMNS = {
+    "Sample": "string",
+    "Rank": "int",
+    "species": "string",
+    "genus": "string",
+    "subfamily": "string",
+    "family": "string",
+    "order": "string",
+    "Exp MZ": "float",
+    "Exp intensity": "float",
+    "Theor MZ": "float",
+    "pep_seq": "string",
+    "pep_start": "int",
+    "pep_end": "int",
+    "missed_cleaves": "int",
+    "hyd_count": "int",
+    "deam_count": "int",
+}
+PANDAS_TYPES = {"string": "object", "int": "int64", "float": "float64"}
+
+
+def export_path(output: Path, export_format: str) -> Path:
+    """The match file is saved next to the results file, e.g.,
+    results.csv -> results_matches.parquet"""
+    return output.with_name(
+        "{0}_matches{1}".format(output.stem, EXPORT_FORMATS[export_format])
+    )
+
+
+def check_format(export_format: str) -> None:
+    """Raises an error if the format needs a package that is not installed"""
+    if export_format == "parquet":
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            raise Exception("Parquet match files need pyarrow (pip install pyarrow), use csv or jsonl instead")
+
+
+def float32_digits(values: pd.Series) -> pd.Series:
+    """float32 values as the float64 values with the same shortest
+    decimal digits, so widening them does not add digits"""
+    return pd.Series(
+        values.to_numpy(dtype=np.float32).astype(str).astype(np.float64), index=values.index
+    )
+
+
+def match_rows(sample: str, rank: int, matches_df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Formats the matches of one species as export rows.
+
+    args
+        sample (str): the sample name
+        rank (int): rank of the species in the results (1 is the top match)
+        matches_df (pd.DataFrame): matches from compare
+
+    returns
+        rows (pd.DataFrame): the matches with the export columns
+    """
+    rows = matches_df.rename(
+        columns={"MZ": "Exp MZ", "intensity": "Exp intensity", "mass1": "Theor MZ"}
+    )
+    rows.insert(0, "Sample", sample)
+    rows.insert(1, "Rank", rank)
+    rows = rows.reindex(columns=list(EXPORT_COLUMNS))
+    for column, column_type in EXPORT_COLUMNS.items():
+        if column_type == "string":
+            # missing ranks stay missing rather than the text 'nan'
+            rows[column] = rows[column].map(lambda value: None if pd.isna(value) else str(value))
+        elif column_type == "float" and rows[column].dtype == np.float32:
+            rows[column] = float32_digits(rows[column])
+        else:
+            rows[column] = rows[column].astype(PANDAS_TYPES[column_type])
+    return rows
+
+
+class MatchExport:
+    """
+    Writes the matches of the top species of each sample to one file.
+
+    args
+        path (Path): the file to write
+        export_format (str): 'csv', 'jsonl' or 'parquet'
+        top_k (int): number of top species of each sample to write
+    """
+
+    def __init__(self, path: Path, export_format: str, top_k: int):
+        check_format(export_format)
+        self.path = Path(path)
+        self.export_format = export_format
+        self.top_k = top_k
+        self.rows_written = 0
+        self._writer = None
+        if export_format == "parquet":
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+
+            arrow_types = {"string": pa.string(), "int": pa.int64(), "float": pa.float64()}
+            self._schema = pa.schema(
+                [(column, arrow_types[column_type]) for column, column_type in EXPORT_COLUMNS.items()]
+            )
+            self._writer = pq.ParquetWriter(self.path, self._schema)
+        else:
+            self._writer = open(self.path, "w", newline="")
+            if export_format == "csv":
+                self._writer.write(",".join(EXPORT_COLUMNS) + "\n")
+
+    def write(self, rows: pd.DataFrame) -> None:
+        """Appends rows made by match_rows to the file"""
+        if rows.empty:
+            return
+        if self.export_format == "parquet":
+            import pyarrow as pa
+
+            table = pa.Table.from_pandas(rows, schema=self._schema, preserve_index=False)
+            self._writer.write_table(table)
+        elif self.export_format == "csv":
+            rows.to_csv(self._writer, header=False, index=False)
+        else:
+            lines = rows.to_json(orient="records", lines=True)
+            self._writer.write(lines if lines.endswith("\n") else lines + "\n")
+        self.rows_written += len(rows)
+
+    def close(self) -> None:
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+if __name__ == "__main__":
+    sys.exit()
@@ -0,0 +1,141 @@
+"""
+match_peaks.py
+
+Matching engine used by compare_score. Rather than joining every
+experimental peak to every theoretical peptide m/z value, the theoretical
+masses are sorted once and the matches for every peak are found with
+binary search (np.searchsorted) interval lookups.
+"""
+
+import sys
+
+import numpy as np
+import pandas as pd
+
+
+def sort_masses(theor_peaks_df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Sorts the theoretical peptides by m/z value (mass1) so they can be
+    searched with binary search. The sort is stable and the index is kept,
+    so the index still gives the original row order of the csv file.
+
+    args
+        theor_peaks_df (pd.DataFrame): theoretical peptides for one species
+            with a 0 to n-1 index
+
+    returns
+        sorted_df (pd.DataFrame): theoretical peptides sorted by mass1
+    """
+    if theor_peaks_df["mass1"].is_monotonic_increasing:
+        return theor_peaks_df
+    return theor_peaks_df.sort_values(by=["mass1"], kind="stable")
+
+
+def match_windows(theor_masses: np.ndarray,
+                  exp_mz: np.ndarray,
+                  threshold: float) -> tuple:
+    """
+    Finds the interval of sorted theoretical masses that is within
+    +- threshold of each experimental m/z value.
+
+    args
+        theor_masses (np.ndarray): sorted theoretical m/z values
+        exp_mz (np.ndarray): experimental m/z values
+        threshold (float): the tolerance for a match
+
+    returns
+        lo, hi (np.ndarray, np.ndarray): for each experimental peak the
+            matches are theor_masses[lo:hi]. No match if lo == hi.
+    """
+    # allowance is calculated in the same dtype as the peaks
+    # so the boundaries are identical to the old cross join
+    mz_minus = exp_mz - threshold
+    mz_plus = exp_mz + threshold
+    lo = np.searchsorted(theor_masses, mz_minus, side="left")
+    hi = np.searchsorted(theor_masses, mz_plus, side="right")
+    return lo, hi
+
+
+def first_in_window(row_order: np.ndarray,
+                    lo: np.ndarray,
+                    hi: np.ndarray) -> np.ndarray:
+    """
+    For each window [lo, hi) of the sorted masses returns the smallest
+    original row position. This is the theoretical row the cross join
+    would have kept for a peak after dropping duplicates.
+
+    args
+        row_order (np.ndarray): original row position of each sorted mass
+        lo (np.ndarray): start of each window (all windows non-empty)
+        hi (np.ndarray): end of each window
+
+    returns
+        first_rows (np.ndarray): original row position for each window
+    """
+    if len(lo) == 0:
+        return np.empty(0, dtype=row_order.dtype)
+    counts = hi - lo
+    # expand every window into one contiguous array of sorted positions
+    starts = np.cumsum(counts) - counts
+    positions = np.repeat(lo - starts, counts) + np.arange(counts.sum())
+    return np.minimum.reduceat(row_order[positions], starts)
+
+
+def match_peaks(theor_peaks_df: pd.DataFrame,
+                act_peaks_df: pd.DataFrame,
+                threshold: float) -> tuple:
+    """
+    Matches the experimental peaks to the theoretical peptides within
+    +- threshold. If an experimental m/z value matches more than once
+    only the first match is kept.
+
+    args
+        theor_peaks_df (pd.DataFrame): theoretical peptides sorted
+            by mass1 (see sort_masses)
+        act_peaks_df (pd.DataFrame): experimental peaks with MZ column
+        threshold (float): the tolerance for a match
+
+    returns
+        peak_rows (np.ndarray): positions of the matched experimental peaks
+        theor_labels (np.ndarray): index labels of the matching theoretical peptides
+    """
+    exp_mz = act_peaks_df["MZ"].to_numpy()
+    lo, hi = match_windows(theor_peaks_df["mass1"].to_numpy(), exp_mz, threshold)
+
+    # keeps the first peak for each m/z value that has a match
+    peak_rows = np.flatnonzero(hi > lo)
+    _, first = np.unique(exp_mz[peak_rows], return_index=True)
+    peak_rows = peak_rows[np.sort(first)]
+
+    theor_labels = first_in_window(
+        theor_peaks_df.index.to_numpy(), lo[peak_rows], hi[peak_rows]
+    )
+    return peak_rows, theor_labels
+
+
+def matches_frame(theor_peaks_df: pd.DataFrame,
+                  act_peaks_df: pd.DataFrame,
+                  peak_rows: np.ndarray,
+                  theor_labels: np.ndarray) -> pd.DataFrame:
+    """
+    Builds the dataframe of matches with one row per matched
+    experimental peak and the theoretical peptide it matched.
+
+    args
+        theor_peaks_df (pd.DataFrame): theoretical peptides
+        act_peaks_df (pd.DataFrame): experimental peaks
+        peak_rows (np.ndarray): positions of the matched experimental peaks
+        theor_labels (np.ndarray): index labels of the matching theoretical peptides
+
+    returns
+        matches_df (pd.DataFrame): experimental peak columns followed by
+            the theoretical peptide columns
+    """
+    exp_df = act_peaks_df.iloc[peak_rows].reset_index(drop=True)
+    theor_df = theor_peaks_df.loc[theor_labels].reset_index(drop=True)
+    matches_df = pd.concat([exp_df, theor_df], axis=1)
+    return matches_df
+
+
+if __name__ == "__main__":
+    sys.exit()
@@ -0,0 +1,35 @@
+"""
+options.py
+
+Choices and defaults of compare_score options that are also used by the
+modules that do the work (match_export and peak_picking import them from
+here). This module only uses the standard library, so compare_score can
+build its argument parser, and print --help, without importing NumPy or
+pandas.
+"""
+
+import sys
+from collections import namedtuple
+
+# how decoy peak lists are made (see decoy_scores)
+DECOY_TYPES = ["shift", "random"]
+
+# file formats of the exported matches and their suffix (see match_export)
+EXPORT_FORMATS = {"csv": ".csv", "jsonl": ".jsonl", "parquet": ".parquet"}
+
+# settings for picking peaks from profile spectra (see peak_picking)
+PeakSettings = namedtuple(
+    "PeakSettings",
+    [
+        "smooth_points",  # points in the smoothing window (odd)
+        "segment_points",  # points in each baseline and noise segment
+        "snr",  # signal to noise cutoff
+        "isotope_tolerance",  # tolerance (Da) for the isotope spacing
+        "isotope_ratio",  # minimum fraction of the expected monoisotopic intensity
+    ],
+    defaults=[11, 1000, 7.0, 0.05, 0.3],
+)
+
+
+if __name__ == "__main__":
+    sys.exit()
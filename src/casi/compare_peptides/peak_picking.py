@@ -0,0 +1,186 @@
+"""
+peak_picking.py
+
+Picks the peaks from a profile mode ZooMS spectrum so it can be compared
+without using external software first. All the steps are NumPy array
+operations so they are fast enough to run on every spot of a plate:
+    * smoothing - Savitzky-Golay filter
+    * baseline removal - minimum of the smoothed spectrum in segments,
+      interpolated between the segments
+    * noise - median absolute deviation in the same segments
+    * peak detection - local maxima above a signal to noise cutoff,
+      with the m/z value refined by fitting a parabola to the top
+    * deisotoping - peaks that are the isotopes of a lower m/z peak
+      (+1.00335 Da, singly charged) are removed so only the
+      monoisotopic peaks are kept
+"""
+
+import sys
+
+import numpy as np
+
+from casi.compare_peptides.options import PeakSettings
+
+# mass difference between 13C and 12C isotope peaks
+ISOTOPE_SPACING = 1.00335
+
+
+def is_profile(mz: np.ndarray) -> bool:
+    """Tests if a spectrum looks like profile data (many points
+    closely spaced) rather than a peak list"""
+    if len(mz) < 1000:
+        return False
+    return np.median(np.diff(mz)) < 0.1
+
+
+def savgol_coefficients(points: int, order: int = 2) -> np.ndarray:
+    """Coefficients of a Savitzky-Golay smoothing filter"""
+    half = points // 2
+    positions = np.arange(-half, half + 1)
+    vandermonde = np.vander(positions, order + 1, increasing=True)
+    # first row of the pseudo-inverse gives the smoothed value at the centre
+    return np.linalg.pinv(vandermonde)[0]
+
+
+def smooth(intensity: np.ndarray, points: int) -> np.ndarray:
+    """Smooths the intensities with a Savitzky-Golay filter"""
+    if points < 3 or len(intensity) < points:
+        return intensity.astype(np.float64)
+    points = points + 1 - points % 2  # must be odd
+    half = points // 2
+    padded = np.pad(intensity.astype(np.float64), half, mode="edge")
+    return np.convolve(padded, savgol_coefficients(points)[::-1], mode="valid")
+
+
+def segment_values(values: np.ndarray, segment_points: int) -> tuple:
+    """
+    Splits the values into segments of segment_points and calculates
+    the minimum and median absolute deviation of each segment
+
+    returns
+        centres (np.ndarray): position of the middle of each segment
+        minimum (np.ndarray): minimum of each segment
+        mad (np.ndarray): median absolute deviation of each segment
+    """
+    num_segments = max(1, int(np.ceil(len(values) / segment_points)))
+    # pad the last segment with nan so the values reshape into segments
+    padded = np.full(num_segments * segment_points, np.nan)
+    padded[: len(values)] = values
+    segments = padded.reshape(num_segments, segment_points)
+
+    minimum = np.nanmin(segments, axis=1)
+    median = np.nanmedian(segments, axis=1)
+    mad = np.nanmedian(np.abs(segments - median[:, None]), axis=1)
+    counts = np.minimum(segment_points, len(values) - np.arange(num_segments) * segment_points)
+    centres = np.arange(num_segments) * segment_points + (counts - 1) / 2
+    return centres, minimum, mad
+
+
+def remove_baseline(intensity: np.ndarray, segment_points: int) -> tuple:
+    """
+    Removes the baseline and estimates the noise of the spectrum
+
+    returns
+        corrected (np.ndarray): intensity with the baseline removed
+        noise (np.ndarray): noise level at each point
+    """
+    positions = np.arange(len(intensity))
+    centres, minimum, _ = segment_values(intensity, segment_points)
+    baseline = np.interp(positions, centres, minimum)
+    corrected = np.clip(intensity - baseline, 0, None)
+
+    # noise from the baseline corrected spectrum
+    centres, _, mad = segment_values(corrected, segment_points)
+    noise = np.interp(positions, centres, 1.4826 * mad)
+    # avoid dividing by zero in flat regions
+    noise = np.maximum(noise, np.finfo(np.float64).eps)
+    return corrected, noise
+
+
+def local_maxima(mz: np.ndarray,
+                 intensity: np.ndarray,
+                 noise: np.ndarray,
+                 snr: float) -> tuple:
+    """
+    Finds the local maxima above the signal to noise cutoff and refines
+    the m/z value of each peak with a parabola through the top three points
+
+    returns
+        peak_mz (np.ndarray): m/z value of each peak
+        peak_intensity (np.ndarray): intensity of each peak
+    """
+    if len(intensity) < 3:
+        return np.empty(0), np.empty(0)
+    left, centre, right = intensity[:-2], intensity[1:-1], intensity[2:]
+    is_peak = (centre > left) & (centre >= right) & (centre >= snr * noise[1:-1])
+    index = np.flatnonzero(is_peak) + 1
+
+    # parabola vertex (offset in points from the maximum)
+    y0, y1, y2 = intensity[index - 1], intensity[index], intensity[index + 1]
+    denominator = y0 - 2 * y1 + y2
+    with np.errstate(divide="ignore", invalid="ignore"):
+        offset = np.where(denominator != 0, 0.5 * (y0 - y2) / denominator, 0.0)
+    offset = np.clip(offset, -0.5, 0.5)
+    step = np.where(offset < 0, mz[index] - mz[index - 1], mz[index + 1] - mz[index])
+    peak_mz = mz[index] + offset * step
+    return peak_mz, y1
+
+
+def deisotope(peak_mz: np.ndarray,
+              peak_intensity: np.ndarray,
+              tolerance: float,
+              min_ratio: float) -> np.ndarray:
+    """
+    Finds the monoisotopic peaks. A peak is an isotope peak if there is
+    a peak 1.00335 Da lower with an intensity of at least min_ratio of
+    the intensity expected for the lower peak (averagine approximation
+    for singly charged peptides).
+
+    returns
+        monoisotopic (np.ndarray): boolean mask of the monoisotopic peaks
+    """
+    lo = np.searchsorted(peak_mz, peak_mz - ISOTOPE_SPACING - tolerance, side="left")
+    hi = np.searchsorted(peak_mz, peak_mz - ISOTOPE_SPACING + tolerance, side="right")
+    has_lower = hi > lo
+    # most intense peak in the window below each peak
+    lower_intensity = np.zeros(len(peak_mz))
+    if has_lower.any():
+        counts = hi[has_lower] - lo[has_lower]
+        starts = np.cumsum(counts) - counts
+        positions = np.repeat(lo[has_lower] - starts, counts) + np.arange(counts.sum())
+        lower_intensity[has_lower] = np.maximum.reduceat(peak_intensity[positions], starts)
+
+    # expected intensity ratio of the first isotope peak to the monoisotopic peak
+    isotope_ratio = peak_mz * 0.000556
+    expected_lower = peak_intensity / np.maximum(isotope_ratio, 1e-6)
+    is_isotope = has_lower & (lower_intensity >= min_ratio * expected_lower)
+    return ~is_isotope
+
+
+def pick_peaks(mz: np.ndarray,
+               intensity: np.ndarray,
+               settings: PeakSettings = PeakSettings()) -> tuple:
+    """
+    Picks the monoisotopic peaks from a profile spectrum.
+
+    args
+        mz (np.ndarray): m/z values of the profile spectrum (sorted)
+        intensity (np.ndarray): intensities of the profile spectrum
+        settings (PeakSettings): peak picking settings
+
+    returns
+        peak_mz (np.ndarray): m/z value of the monoisotopic peaks
+        peak_intensity (np.ndarray): baseline corrected intensity of the peaks
+    """
+    mz = np.asarray(mz, dtype=np.float64)
+    smoothed = smooth(np.asarray(intensity), settings.smooth_points)
+    corrected, noise = remove_baseline(smoothed, settings.segment_points)
+    peak_mz, peak_intensity = local_maxima(mz, corrected, noise, settings.snr)
+    monoisotopic = deisotope(
+        peak_mz, peak_intensity, settings.isotope_tolerance, settings.isotope_ratio
+    )
+    return peak_mz[monoisotopic], peak_intensity[monoisotopic]
+
+
+if __name__ == "__main__":
+    sys.exit()
@@ -0,0 +1,308 @@
+"""
+read_spectra.py
+
+Reads spectra directly from mzXML and mzML files so they do not need to
+be exported as a peak list text file first. The index at the end of the
+file (indexOffset in mzXML, indexListOffset in indexed mzML) gives the
+byte offset of each scan, so a single scan (e.g., one MALDI spot on a
+plate) is read by seeking to it without parsing the rest of the XML.
+If there is no index the file is scanned once for the scan start tags.
+The base64 (and zlib compressed) peak arrays are decoded straight
+into NumPy arrays.
+"""
+
+import re
+import sys
+import base64
+import zlib
+from pathlib import Path
+from collections import namedtuple
+
+import numpy as np
+
+SPECTRUM_SUFFIXES = {".mzxml": "mzXML", ".mzml": "mzML"}
+# size of each read when searching the file
+CHUNK_SIZE = 1 << 20
+
+Spectrum = namedtuple(
+    "Spectrum",
+    [
+        "scan_id",
+        "mz",
+        "intensity",
+        "centroided",  # True if peak picked, False if profile, None if unknown
+    ]
+)
+
+# the start tag and end of the part of the scan that is read
+SCAN_TAGS = {
+    "mzXML": (b"<scan", b"</peaks>"),
+    "mzML": (b"<spectrum", b"</spectrum>"),
+}
+INDEX_OFFSET_PATTERN = {
+    "mzXML": re.compile(rb"<indexOffset>\s*(\d+)\s*</indexOffset>"),
+    "mzML": re.compile(rb"<indexListOffset>\s*(\d+)\s*</indexListOffset>"),
+}
+INDEX_PATTERN = {
+    "mzXML": re.compile(rb'<index\s+name="scan"\s*>(.*?)</index>', re.S),
+    "mzML": re.compile(rb'<index\s+name="spectrum"\s*>(.*?)</index>', re.S),
+}
+OFFSET_PATTERN = {
+    "mzXML": re.compile(rb'<offset\s+id="([^"]*)"\s*>\s*(\d+)\s*</offset>'),
+    "mzML": re.compile(rb'<offset\s+idRef="([^"]*)"[^>]*>\s*(\d+)\s*</offset>'),
+}
+SCAN_ID_PATTERN = {
+    "mzXML": re.compile(rb'<scan\b[^>]*?\snum="([^"]*)"'),
+    "mzML": re.compile(rb'<spectrum\b[^>]*?\sid="([^"]*)"'),
+}
+ATTRIBUTE_PATTERN = re.compile(rb'([\w:]+)="([^"]*)"')
+
+# mzML controlled vocabulary accessions
+MZML_CV = {
+    "MS:1000521": ("dtype", "<f4"),
+    "MS:1000523": ("dtype", "<f8"),
+    "MS:1000519": ("dtype", "<i4"),
+    "MS:1000522": ("dtype", "<i8"),
+    "MS:1000574": ("zlib", True),
+    "MS:1000576": ("zlib", False),
+    "MS:1000514": ("array", "mz"),
+    "MS:1000515": ("array", "intensity"),
+}
+
+
+def spectrum_format(path: Path) -> str:
+    """Returns 'mzXML' or 'mzML' from the file suffix or None if it
+    is not a spectrum file"""
+    return SPECTRUM_SUFFIXES.get(Path(path).suffix.lower())
+
+
+def is_spectrum_file(path: Path) -> bool:
+    """Tests if the file is a mzXML or mzML file"""
+    return spectrum_format(path) is not None
+
+
+def read_until(file_obj, end_tag: bytes, start: int) -> bytes:
+    """
+    Reads the file from start until the end tag is found
+
+    args
+        file_obj: the file opened in binary mode
+        end_tag (bytes): the tag to read up to (included)
+        start (int): the byte offset to start reading from
+
+    returns
+        fragment (bytes): the file from start to the end of end_tag
+    """
+    file_obj.seek(start)
+    fragment = b""
+    search_from = 0
+    while True:
+        chunk = file_obj.read(CHUNK_SIZE)
+        if not chunk:
+            raise ValueError(f"Could not find {end_tag.decode()} after byte {start}")
+        fragment += chunk
+        end = fragment.find(end_tag, search_from)
+        if end != -1:
+            return fragment[: end + len(end_tag)]
+        search_from = max(0, len(fragment) - len(end_tag))
+
+
+def read_index(file_obj, file_format: str) -> dict:
+    """
+    Reads the scan offsets from the index at the end of the file.
+
+    args
+        file_obj: the file opened in binary mode
+        file_format (str): 'mzXML' or 'mzML'
+
+    returns
+        offsets (dict): scan id as key and byte offset as value.
+        Empty if the file has no index
+    """
+    file_obj.seek(0, 2)
+    file_size = file_obj.tell()
+    file_obj.seek(max(0, file_size - 4096))
+    tail = file_obj.read()
+    index_offset = INDEX_OFFSET_PATTERN[file_format].search(tail)
+    if index_offset is None:
+        return {}
+
+    file_obj.seek(int(index_offset.group(1)))
+    # mzML also indexes chromatograms, only the spectra are needed
+    index = INDEX_PATTERN[file_format].search(file_obj.read())
+    if index is None:
+        return {}
+    offsets = {}
+    for scan_id, offset in OFFSET_PATTERN[file_format].findall(index.group(1)):
+        offsets[scan_id.decode()] = int(offset)
+    return offsets
+
+
+def find_scans(file_obj, file_format: str) -> dict:
+    """
+    Finds the scan offsets by searching the whole file for the scan
+    start tags. Used when the file has no index (or it is wrong).
+
+    args
+        file_obj: the file opened in binary mode
+        file_format (str): 'mzXML' or 'mzML'
+
+    returns
+        offsets (dict): scan id as key and byte offset as value.
+    """
+    start_tag = SCAN_TAGS[file_format][0]
+    offsets = {}
+    file_obj.seek(0)
+    position = 0
+    previous = b""
+    while True:
+        chunk = file_obj.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        # keep the end of the last chunk in case a tag is split
+        data = previous + chunk
+        data_start = position - len(previous)
+        for match in re.finditer(re.escape(start_tag) + rb"[\s>]", data):
+            header = data[match.start(): match.start() + 1024]
+            scan_id = SCAN_ID_PATTERN[file_format].match(header)
+            if scan_id is not None:
+                offsets[scan_id.group(1).decode()] = data_start + match.start()
+        position += len(chunk)
+        previous = data[-(len(start_tag) + 1024):]
+    return dict(sorted(offsets.items(), key=lambda item: item[1]))
+
+
+def scan_offsets(path: Path) -> dict:
+    """
+    Gets the byte offset of every scan in a mzXML or mzML file,
+    from the index if the file has one. Raises an error if the
+    file has no scans.
+
+    args
+        path (Path): the mzXML or mzML file
+
+    returns
+        offsets (dict): scan id as key and byte offset as value
+    """
+    file_format = spectrum_format(path)
+    start_tag = SCAN_TAGS[file_format][0]
+    with open(path, "rb") as file_obj:
+        offsets = read_index(file_obj, file_format)
+        # check the index points at the scans
+        for offset in list(offsets.values())[:1]:
+            file_obj.seek(offset)
+            if not file_obj.read(len(start_tag)) == start_tag:
+                offsets = {}
+        if not offsets:
+            offsets = find_scans(file_obj, file_format)
+    if not offsets:
+        raise Exception("No scans found in {0}".format(path))
+    return offsets
+
+
+def decode_array(encoded: bytes, dtype: str, compressed: bool) -> np.ndarray:
+    """Decodes a base64 (and optionally zlib compressed) binary array"""
+    if not encoded:
+        return np.empty(0, dtype=np.float64)
+    data = base64.b64decode(encoded)
+    if compressed:
+        data = zlib.decompress(data)
+    return np.frombuffer(data, dtype=dtype).astype(np.float64)
+
+
+def file_centroided(path: Path) -> bool:
+    """Reads whether a mzXML file has been centroided from the
+    dataProcessing element in the header of the file"""
+    with open(path, "rb") as file_obj:
+        header = file_obj.read(65536)
+    processing = re.search(rb'<dataProcessing\b[^>]*\scentroided="(\d)"', header)
+    if processing is None:
+        return None
+    return processing.group(1) == b"1"
+
+
+def parse_mzxml_scan(fragment: bytes, path: Path) -> Spectrum:
+    """Decodes the peaks of a mzXML scan"""
+    scan_tag = re.match(rb"<scan\b[^>]*>", fragment).group(0)
+    scan_attrs = dict(ATTRIBUTE_PATTERN.findall(scan_tag))
+    peaks = re.search(rb"<peaks\b([^>]*)>([^<]*)</peaks>", fragment)
+    peak_attrs = dict(ATTRIBUTE_PATTERN.findall(peaks.group(1)))
+
+    precision = peak_attrs.get(b"precision", b"32")
+    dtype = ">f8" if precision == b"64" else ">f4"
+    compressed = peak_attrs.get(b"compressionType", b"none") == b"zlib"
+    values = decode_array(peaks.group(2).strip(), dtype, compressed)
+    pairs = values.reshape(-1, 2)
+
+    if b"centroided" in scan_attrs:
+        centroided = scan_attrs[b"centroided"] == b"1"
+    else:
+        centroided = file_centroided(path)
+    spectrum = Spectrum(
+        scan_attrs[b"num"].decode(), pairs[:, 0], pairs[:, 1], centroided
+    )
+    return spectrum
+
+
+def parse_mzml_spectrum(fragment: bytes) -> Spectrum:
+    """Decodes the m/z and intensity arrays of a mzML spectrum"""
+    spectrum_tag = re.match(rb"<spectrum\b[^>]*>", fragment).group(0)
+    spectrum_attrs = dict(ATTRIBUTE_PATTERN.findall(spectrum_tag))
+    # centroid spectrum (MS:1000127) or profile spectrum (MS:1000128)
+    header = fragment[: fragment.find(b"<binaryDataArrayList")]
+    if b'"MS:1000127"' in header:
+        centroided = True
+    elif b'"MS:1000128"' in header:
+        centroided = False
+    else:
+        centroided = None
+
+    arrays = {}
+    for array in re.finditer(rb"<binaryDataArray\b.*?</binaryDataArray>", fragment, re.S):
+        settings = {"dtype": "<f8", "zlib": False, "array": None}
+        for accession in re.findall(rb'accession="(MS:\d+)"', array.group(0)):
+            setting = MZML_CV.get(accession.decode())
+            if setting is not None:
+                settings[setting[0]] = setting[1]
+        binary = re.search(rb"<binary>([^<]*)</binary>", array.group(0))
+        if settings["array"] is not None and binary is not None:
+            arrays[settings["array"]] = decode_array(
+                binary.group(1).strip(), settings["dtype"], settings["zlib"]
+            )
+
+    empty = np.empty(0, dtype=np.float64)
+    spectrum = Spectrum(
+        spectrum_attrs[b"id"].decode(),
+        arrays.get("mz", empty),
+        arrays.get("intensity", empty),
+        centroided,
+    )
+    return spectrum
+
+
+def read_spectrum(path: Path, offset: int = None) -> Spectrum:
+    """
+    Reads one scan from a mzXML or mzML file.
+
+    args
+        path (Path): the mzXML or mzML file
+        offset (int): byte offset of the scan (from scan_offsets).
+            If None the first scan is read
+
+    returns
+        spectrum (Spectrum): scan id, m/z values, intensities and
+        whether the spectrum is centroided
+    """
+    file_format = spectrum_format(path)
+    if offset is None:
+        offset = next(iter(scan_offsets(path).values()))
+    end_tag = SCAN_TAGS[file_format][1]
+    with open(path, "rb") as file_obj:
+        fragment = read_until(file_obj, end_tag, offset)
+    if file_format == "mzXML":
+        return parse_mzxml_scan(fragment, path)
+    return parse_mzml_spectrum(fragment)
+
+
+if __name__ == "__main__":
+    sys.exit()
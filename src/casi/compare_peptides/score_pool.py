@@ -0,0 +1,84 @@
+"""
+score_pool.py
+
+Runs the species comparisons of compare_score in a pool of processes.
+The theoretical peptides are sent to each worker process once when the
+pool is created, so for each PMF only the experimental peaks are sent.
+Results are returned in the same order as the theoretical peptides list
+so the ranking is identical to running on a single core.
+"""
+
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+# theoretical peptides for each species in the worker process
+_THEOR_PEAKS_LIST = None
+
+
+def _init_worker(theor_peaks_list: list) -> None:
+    """Stores the theoretical peptides in the worker process"""
+    global _THEOR_PEAKS_LIST
+    _THEOR_PEAKS_LIST = theor_peaks_list
+
+
+def _compare_species(index: int, compare_func, act_peaks_df, threshold: float):
+    """Runs the compare function for one species in the worker process"""
+    return compare_func(_THEOR_PEAKS_LIST[index], act_peaks_df, threshold)
+
+
+def create_pool(theor_peaks_list: list, workers: int) -> ProcessPoolExecutor:
+    """
+    Creates the process pool with the theoretical peptides
+    loaded in every worker.
+
+    args
+        theor_peaks_list (list): a dataframe of theoretical peptides for each species
+        workers (int): number of worker processes
+
+    returns
+        pool (ProcessPoolExecutor): the pool of worker processes
+    """
+    pool = ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=_init_worker,
+        initargs=(theor_peaks_list,),
+    )
+    return pool
+
+
+def pool_compare(pool: ProcessPoolExecutor,
+                 workers: int,
+                 compare_func,
+                 num_species: int,
+                 act_peaks_df,
+                 threshold: float) -> list:
+    """
+    Compares the experimental peaks against every species in the pool.
+
+    args
+        pool (ProcessPoolExecutor): pool created by create_pool
+        workers (int): number of worker processes in the pool
+        compare_func (function): the compare function, called as
+            compare_func(theor_peaks, act_peaks_df, threshold)
+        num_species (int): number of species in the theoretical peptides list
+        act_peaks_df (pd.DataFrame): the experimental peaks
+        threshold (float): the tolerance for a match
+
+    returns
+        results (list): compare_func output for each species in order
+    """
+    # a few chunks per worker keeps the work balanced
+    chunksize = max(1, num_species // (workers * 4))
+    species_compare = partial(
+        _compare_species,
+        compare_func=compare_func,
+        act_peaks_df=act_peaks_df,
+        threshold=threshold,
+    )
+    results = list(pool.map(species_compare, range(num_species), chunksize=chunksize))
+    return results
+
+
+if __name__ == "__main__":
+    sys.exit()
@@ -0,0 +1,210 @@
+"""
+score_service.py
+
+A long running scoring service so the theoretical library is only read
+once. Peak lists are sent to a local HTTP endpoint (TCP port or Unix
+socket) and the ranked species table is returned as JSON. Each request
+is handled in its own thread so requests are scored at the same time.
+
+Endpoints:
+    GET /health - the service is running and the number of species
+    POST /score - scores a peak list. The body is either a peak list
+        text file (m/z and intensity separated by a tab, one peak per
+        line) or JSON {"peaks": [[mz, intensity], ...]}.
+        Optional query or JSON parameters: threshold and top
+        (number of species returned, all if not given)
+
+A request that cannot be read gets a 400 response and any other error
+while scoring a 500 response, both with the error as JSON {"error": ...}.
+"""
+
+import os
+import sys
+import json
+import math
+import stat
+import socketserver
+from pathlib import Path
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+import numpy as np
+
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingUnixStreamServer):
+    """HTTP server listening on a Unix socket, one thread per request"""
+
+    daemon_threads = True
+
+
+class ScoreHandler(BaseHTTPRequestHandler):
+    """Handles the scoring requests. The server has the score function
+    (server.score_func) and the number of species (server.num_species)"""
+
+    def address_string(self):
+        # Unix socket clients do not have an address
+        if isinstance(self.client_address, tuple):
+            return self.client_address[0]
+        return "unix socket"
+
+    def send_json(self, status: int, content: dict) -> None:
+        body = json.dumps(content).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if urlparse(self.path).path == "/health":
+            self.send_json(200, {"status": "ok", "species": self.server.num_species})
+        else:
+            self.send_json(404, {"error": "Unknown path {0}".format(self.path)})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path != "/score":
+            self.send_json(404, {"error": "Unknown path {0}".format(self.path)})
+            return
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length)
+        try:
+            mz, intensity, params = parse_request(
+                body, self.headers.get("Content-Type", ""), parse_qs(url.query)
+            )
+        except (ValueError, TypeError, KeyError) as error:
+            self.send_json(400, {"error": str(error)})
+            return
+        try:
+            results_df = self.server.score_func(mz, intensity, params.get("threshold"))
+        except ValueError as error:
+            self.send_json(400, {"error": str(error)})
+            return
+        except Exception as error:
+            # the client gets a response and the service keeps running
+            self.log_error("Scoring failed: %r", error)
+            self.send_json(500, {"error": "Scoring failed: {0}".format(error)})
+            return
+
+        if params.get("top") is not None:
+            results_df = results_df.head(params["top"])
+        self.send_json(200, {
+            "total_peaks": int(results_df["Maximum Possible"].iloc[0]) if len(results_df) else 0,
+            "results": json.loads(results_df.to_json(orient="records")),
+        })
+
+
+class TCPScoreHandler(ScoreHandler):
+    """Sends the headers and body without waiting for the client
+    to acknowledge them (Nagle's algorithm adds ~40 ms otherwise)"""
+
+    disable_nagle_algorithm = True
+
+
+def parse_request(body: bytes, content_type: str, query: dict) -> tuple:
+    """
+    Reads the peak list and parameters from a request
+
+    args
+        body (bytes): the request body
+        content_type (str): the Content-Type header
+        query (dict): the parsed query string
+
+    returns
+        mz (np.ndarray): m/z values of the peaks
+        intensity (np.ndarray): intensities of the peaks
+        params (dict): threshold and top if given
+    """
+    params = {key: values[-1] for key, values in query.items()}
+    if "json" in content_type or body.lstrip().startswith((b"{", b"[")):
+        try:
+            content = json.loads(body)
+        except json.JSONDecodeError as error:
+            raise ValueError("Request is not valid JSON: {0}".format(error))
+        if isinstance(content, dict):
+            params.update({k: content[k] for k in ("threshold", "top") if k in content})
+            content = content.get("peaks", [])
+        try:
+            peaks = np.asarray(content, dtype=np.float64)
+        except (TypeError, ValueError):
+            raise ValueError("Peaks should be pairs of m/z and intensity")
+    else:
+        try:
+            peaks = np.loadtxt(body.decode().splitlines(), delimiter="\t", ndmin=2)
+        except ValueError as error:
+            raise ValueError("Could not read the peak list: {0}".format(error))
+    if peaks.size == 0:
+        peaks = peaks.reshape(0, 2)
+    if peaks.ndim != 2 or peaks.shape[1] < 2:
+        raise ValueError("Peaks should be pairs of m/z and intensity")
+
+    try:
+        if params.get("threshold") is not None:
+            params["threshold"] = float(params["threshold"])
+        if params.get("top") is not None:
+            params["top"] = int(params["top"])
+    except (TypeError, ValueError):
+        raise ValueError("threshold should be a number and top an integer")
+    threshold = params.get("threshold")
+    if threshold is not None and not (math.isfinite(threshold) and threshold >= 0):
+        raise ValueError("threshold should be 0 or more")
+    if params.get("top") is not None and params["top"] < 0:
+        raise ValueError("top should be 0 or more")
+    return peaks[:, 0], peaks[:, 1], params
+
+
+def create_server(score_func,
+                  num_species: int,
+                  host: str = "127.0.0.1",
+                  port: int = 8000,
+                  socket_path: Path = None):
+    """
+    Creates the scoring server on a TCP port or a Unix socket.
+
+    args
+        score_func (function): called as score_func(mz, intensity, threshold)
+            and returns the ranked species dataframe. threshold is None if
+            the request does not give one
+        num_species (int): number of species in the library
+        host (str): address to listen on
+        port (int): TCP port to listen on
+        socket_path (Path): Unix socket to listen on instead of a TCP port
+
+    returns
+        server: the HTTP server (not yet started)
+    """
+    if socket_path is not None:
+        # remove a socket left behind by a previous run,
+        # but never a file that is not a socket
+        if os.path.lexists(socket_path):
+            if not stat.S_ISSOCK(os.lstat(socket_path).st_mode):
+                raise Exception(
+                    "The socket path already exists and is not a socket {0}".format(socket_path)
+                )
+            os.unlink(socket_path)
+        server = ThreadingUnixHTTPServer(str(socket_path), ScoreHandler)
+    else:
+        server = ThreadingHTTPServer((host, port), TCPScoreHandler)
+    server.score_func = score_func
+    server.num_species = num_species
+    return server
+
+
+def run_server(server, socket_path: Path = None) -> None:
+    """Serves requests until interrupted"""
+    if socket_path is not None:
+        print("Scoring service listening on {0}".format(socket_path))
+    else:
+        print("Scoring service listening on http://{0}:{1}".format(*server.server_address[:2]))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\nStopping scoring service")
+    finally:
+        server.server_close()
+        if socket_path is not None and os.path.exists(socket_path):
+            os.unlink(socket_path)
+
+
+if __name__ == "__main__":
+    sys.exit()
@@ -0,0 +1,183 @@
+"""
+synthetic_data.py
+
+Creates synthetic theoretical peptide libraries and PMF peak lists
+to benchmark compare_score with more species or peaks than the
+example data. Libraries are written as csv files with the same columns
+as the filtered_peptides folder, so they are read by the same code.
+
+Species are either copies of template species (e.g., the filtered_peptides
+in data/outputs) with a fraction of the peptide masses moved, as if the
+sequence was different, or made from random peptide masses if there
+are no templates. Peak lists are part of the m/z values of one species
+(with a small error) and random noise peaks.
+"""
+
+import sys
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from casi.compare_peptides.theor_library import THEOR_COLUMNS, read_species_csv
+
+# fraction of the peptide masses moved in each synthetic species
+CHANGED_FRACTION = 0.2
+# largest change (Da) of a moved peptide mass
+MAX_CHANGE = 50.0
+# number of peptides of a random species
+RANDOM_PEPTIDES = 500
+RESIDUES = np.array(list("ACDEFGHIKLMNPQRSTVWY"))
+
+
+def read_templates(template_folder: Path) -> list:
+    """
+    Reads the template species csv files (e.g., data/outputs/filtered_peptides)
+
+    args
+        template_folder (Path): folder of theoretical peptides csv files
+
+    returns
+        templates (list): a dataframe for each species
+    """
+    templates = [read_species_csv(csv) for csv in sorted(template_folder.glob("*.csv"))]
+    if not templates:
+        raise FileNotFoundError(
+            f"No theoretical peptides csv files found in {template_folder}"
+        )
+    return templates
+
+
+def random_species(rng: np.random.Generator, mass_range: tuple) -> pd.DataFrame:
+    """
+    Makes the peptides of a species with random m/z values
+    and sequences
+
+    args
+        rng (np.random.Generator): random number generator
+        mass_range (tuple): (min, max) m/z values of the peptides
+
+    returns
+        species_df (pd.DataFrame): peptides with the csv columns
+        (taxonomy is added by synthetic_species)
+    """
+    lengths = rng.integers(6, 30, size=RANDOM_PEPTIDES)
+    starts = rng.integers(1, 1000, size=RANDOM_PEPTIDES)
+    species_df = pd.DataFrame({
+        "pep_seq": ["".join(rng.choice(RESIDUES, size=length)) for length in lengths],
+        "pep_start": starts,
+        "pep_end": starts + lengths - 1,
+        "missed_cleaves": rng.integers(0, 2, size=RANDOM_PEPTIDES),
+        "mass1": rng.uniform(*mass_range, size=RANDOM_PEPTIDES),
+        "hyd_count": rng.integers(0, 4, size=RANDOM_PEPTIDES),
+        "deam_count": rng.integers(0, 2, size=RANDOM_PEPTIDES),
+    })
+    return species_df
+
+
+def synthetic_species(rng: np.random.Generator,
+                      number: int,
+                      template_df: pd.DataFrame = None,
+                      mass_range: tuple = (800, 3500)) -> pd.DataFrame:
+    """
+    Makes the theoretical peptides of one synthetic species
+
+    args
+        rng (np.random.Generator): random number generator
+        number (int): number of the species, used for its taxonomy
+        template_df (pd.DataFrame): species to copy, random peptides if None
+        mass_range (tuple): (min, max) m/z values of random peptides
+
+    returns
+        species_df (pd.DataFrame): peptides with the csv columns
+    """
+    if template_df is None:
+        species_df = random_species(rng, mass_range)
+    else:
+        species_df = template_df.copy()
+        masses = species_df["mass1"].to_numpy(dtype=np.float64)
+        changed = rng.random(len(masses)) < CHANGED_FRACTION
+        masses[changed] += rng.uniform(-MAX_CHANGE, MAX_CHANGE, size=changed.sum())
+        species_df["mass1"] = masses
+    species_df["species"] = "Synthetic species{0}".format(number)
+    species_df["genus"] = "Genus{0}".format(number // 10)
+    species_df["subfamily"] = "Subfamily{0}".format(number // 50)
+    species_df["family"] = "Family{0}".format(number // 100)
+    species_df["order"] = "Synthetic"
+    return species_df[THEOR_COLUMNS]
+
+
+def synthetic_library(output_folder: Path,
+                      num_species: int,
+                      seed: int = 0,
+                      templates: list = None,
+                      mass_range: tuple = (800, 3500)) -> Path:
+    """
+    Writes a theoretical peptides csv file for each synthetic species.
+    Template species are used in turn if given.
+
+    args
+        output_folder (Path): folder for the csv files (created if needed)
+        num_species (int): number of species
+        seed (int): random seed so the library can be repeated
+        templates (list): template species dataframes from read_templates
+        mass_range (tuple): (min, max) m/z values of random peptides
+
+    returns
+        output_folder (Path): the folder of csv files
+    """
+    output_folder.mkdir(parents=True, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    for number in range(num_species):
+        template_df = None if not templates else templates[number % len(templates)]
+        species_df = synthetic_species(rng, number, template_df, mass_range)
+        species_df.to_csv(
+            output_folder / "Synthetic_species{0}_col1peptides_filt.csv".format(number)
+        )
+    return output_folder
+
+
+def synthetic_peak_list(species_df: pd.DataFrame,
+                        num_peaks: int,
+                        seed: int = 0,
+                        mass_range: tuple = (800, 3500),
+                        true_fraction: float = 0.5,
+                        error: float = 0.05) -> pd.DataFrame:
+    """
+    Makes a PMF peak list from the m/z values of a species and noise peaks
+
+    args
+        species_df (pd.DataFrame): theoretical peptides of the species in the sample
+        num_peaks (int): number of peaks
+        seed (int): random seed so the peak list can be repeated
+        mass_range (tuple): (min, max) m/z values of the peaks
+        true_fraction (float): fraction of the peaks from the species
+        error (float): largest difference (Da) of a peak from the theoretical m/z value
+
+    returns
+        peaks_df (pd.DataFrame): MZ and intensity of each peak, ordered by MZ
+    """
+    rng = np.random.default_rng(seed)
+    masses = species_df["mass1"].to_numpy(dtype=np.float64)
+    masses = masses[(masses >= mass_range[0]) & (masses <= mass_range[1])]
+    num_true = min(int(num_peaks * true_fraction), len(masses))
+    true_mz = rng.choice(masses, size=num_true, replace=False)
+    true_mz += rng.uniform(-error, error, size=num_true)
+    noise_mz = rng.uniform(*mass_range, size=num_peaks - num_true)
+    mz = np.sort(np.concatenate([true_mz, noise_mz]))
+    peaks_df = pd.DataFrame({
+        "MZ": np.round(mz, 4),
+        "intensity": np.round(rng.lognormal(8, 1, size=num_peaks), 2),
+    })
+    return peaks_df
+
+
+def write_peak_list(peaks_df: pd.DataFrame, output_file: Path) -> Path:
+    """Saves a peak list as a tab separated text file
+    without a header (the same as an exported peak list)"""
+    peaks_df.to_csv(output_file, sep="\t", header=False, index=False)
+    return output_file
+
+
+if __name__ == "__main__":
+    sys.exit()
@@ -0,0 +1,266 @@
+"""
+theor_library.py
+
+Reads the theoretical peptide csv files (filtered_peptides folder) and
+compiles them into a single library file so compare_score does not need
+to parse every csv file for each run.
+
+The library is a NumPy .npz file containing:
+    * mass1 - all species m/z values concatenated, each species sorted by mass
+    * row - the row position of each m/z value in the species csv file
+    * offsets - species i is mass1[offsets[i]:offsets[i + 1]]
+    * species, genus, subfamily, family, order - taxonomy (one row per species)
+    * pep_seqs and pep_code - unique peptide sequences and a code for each row
+    * pep_start, pep_end, missed_cleaves, hyd_count, deam_count - peptide information
+"""
+
+import sys
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from casi.compare_peptides.match_peaks import sort_masses
+
+LIBRARY_VERSION = 1
+LIBRARY_SUFFIX = ".npz"
+
+TAXON_COLUMNS = ["species", "genus", "subfamily", "family", "order"]
+PEPTIDE_COLUMNS = [
+    "pep_start",
+    "pep_end",
+    "missed_cleaves",
+    "hyd_count",
+    "deam_count",
+]
+# column order of the csv files
+THEOR_COLUMNS = [
+    "pep_seq",
+    "pep_start",
+    "pep_end",
+    "missed_cleaves",
+    "mass1",
+    "hyd_count",
+    "deam_count",
+    "species",
+    "genus",
+    "subfamily",
+    "family",
+    "order",
+]
+
+
+def is_library(theor_path: Path) -> bool:
+    """Tests if the theoretical peptides input is a compiled library file"""
+    return theor_path.is_file() and theor_path.suffix == LIBRARY_SUFFIX
+
+
+def read_species_csv(csv: Path) -> pd.DataFrame:
+    """
+    Reads the theoretical peptides csv file for one species
+
+    args
+        csv (Path): the theoretical peptides csv file
+
+    returns
+        theor_peaks_df (pd.DataFrame): peptides, m/z values and
+        taxonomic information of the species
+    """
+    dtype = {
+        "mass1": "float32",
+        "GENUS": "category",
+        "SPECIES": "category",
+        "pep_seq": "category",
+    }
+    theor_peaks_df = pd.read_csv(csv, sep=",", dtype=dtype, usecols=THEOR_COLUMNS)
+    return theor_peaks_df
+
+
+def read_theor_folder(input_theor_path: Path, mass_range: tuple) -> list:
+    """
+    Reads in all the theoretical peptide csv files in the folder,
+    filters by the mass range and sorts each by m/z value
+
+    args
+        input_theor_path (Path): folder containing theoretical peptides csv files
+        mass_range (tuple): (min, max) m/z values that can be matched
+
+    returns
+        theor_peaks_df_list (list): a dataframe for each species
+    """
+    # get all csv files
+    csv_files = input_theor_path.glob("*.csv")
+
+    theor_peaks_df_list = []
+    for csv in csv_files:
+        theor_peaks_df = read_species_csv(csv)
+        theor_peaks_df = theor_peaks_df[
+            theor_peaks_df["mass1"].between(*mass_range)
+        ].reset_index(drop=True)
+        # sorted once so matches can be found by binary search
+        theor_peaks_df = sort_masses(theor_peaks_df)
+        theor_peaks_df_list.append(theor_peaks_df)
+    return theor_peaks_df_list
+
+
+def build_library(input_theor_path: Path, output_file: Path) -> Path:
+    """
+    Compiles all the theoretical peptide csv files in a folder
+    into a single .npz library file. No mass range filter is applied,
+    this is done when the library is loaded.
+
+    args
+        input_theor_path (Path): folder containing theoretical peptides csv files
+        output_file (Path): the library file to create
+
+    returns
+        output_file (Path): the library file (with .npz suffix)
+    """
+    output_file = output_file.with_suffix(LIBRARY_SUFFIX)
+    species_df_list = read_theor_folder(input_theor_path, (-np.inf, np.inf))
+    if not species_df_list:
+        raise FileNotFoundError(
+            f"No theoretical peptides csv files found in {input_theor_path}"
+        )
+
+    all_df = pd.concat(species_df_list)
+    # csv row position is kept so the first match is the same as reading the csv
+    row = all_df.index.to_numpy(dtype=np.int32)
+    all_df = all_df.reset_index(drop=True)
+    lengths = [len(df) for df in species_df_list]
+    offsets = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+
+    # taxonomy stored once per species
+    # missing ranks (e.g., no subfamily) are stored as empty strings
+    taxonomy = {}
+    for column in TAXON_COLUMNS:
+        values = [df[column].iloc[0] if len(df) else "" for df in species_df_list]
+        taxonomy[column] = np.array(
+            ["" if pd.isna(value) else str(value) for value in values], dtype=str
+        )
+
+    # sorted so the codes are in the same order as the sequences
+    pep_code, pep_seqs = pd.factorize(all_df["pep_seq"].astype(str), sort=True)
+    peptides = {
+        column: all_df[column].to_numpy(dtype=np.int32) for column in PEPTIDE_COLUMNS
+    }
+
+    np.savez(
+        output_file,
+        version=np.array(LIBRARY_VERSION),
+        mass1=all_df["mass1"].to_numpy(dtype=np.float32),
+        row=row,
+        offsets=offsets,
+        pep_seqs=np.array(pep_seqs, dtype=str),
+        pep_code=pep_code.astype(np.int32),
+        **taxonomy,
+        **peptides,
+    )
+    print(f"Theoretical library of {len(species_df_list)} species saved to {output_file}")
+    return output_file
+
+
+def read_library_arrays(library_file: Path) -> dict:
+    """
+    Loads the arrays of a compiled library file
+
+    args
+        library_file (Path): the .npz library created by build_library
+
+    returns
+        library (dict): array name as key and the array as value
+    """
+    with np.load(library_file, allow_pickle=False) as npz:
+        library = {name: npz[name] for name in npz.files}
+    if int(library.get("version", -1)) != LIBRARY_VERSION:
+        raise ValueError(
+            f"{library_file} is not a theoretical library of version {LIBRARY_VERSION}. "
+            "Rebuild the library with build_library."
+        )
+    return library
+
+
+def species_frame(library: dict, index: int, mass_range: tuple) -> pd.DataFrame:
+    """
+    Creates the theoretical peptides dataframe for one species
+    in the library. Same columns as reading the csv file.
+
+    args
+        library (dict): the library arrays from read_library_arrays
+        index (int): position of the species in the library
+        mass_range (tuple): (min, max) m/z values that can be matched
+
+    returns
+        theor_peaks_df (pd.DataFrame): peptides sorted by m/z value with
+        the csv row position as the index
+    """
+    start, end = library["offsets"][index], library["offsets"][index + 1]
+    masses = library["mass1"][start:end]
+    # masses are sorted so the mass range is a slice
+    lo = start + np.searchsorted(masses, mass_range[0], side="left")
+    hi = start + np.searchsorted(masses, mass_range[1], side="right")
+    rows = slice(lo, hi)
+    num_peps = hi - lo
+
+    # categories are all the species peptides as when reading the csv
+    species_codes = np.unique(library["pep_code"][start:end])
+    pep_seq = pd.Categorical.from_codes(
+        np.searchsorted(species_codes, library["pep_code"][rows]),
+        categories=library["pep_seqs"][species_codes],
+    )
+
+    columns = {}
+    for column in THEOR_COLUMNS:
+        if column == "pep_seq":
+            columns[column] = pep_seq
+        elif column == "mass1":
+            columns[column] = library["mass1"][rows]
+        elif column in PEPTIDE_COLUMNS:
+            columns[column] = library[column][rows].astype(np.int64)
+        else:
+            value = str(library[column][index])
+            columns[column] = [value if value else np.nan] * num_peps
+
+    theor_peaks_df = pd.DataFrame(columns, index=library["row"][rows].astype(np.int64))
+    return theor_peaks_df
+
+
+def load_library(library_file: Path, mass_range: tuple) -> list:
+    """
+    Loads a compiled library and creates the theoretical
+    peptides dataframe for each species.
+
+    args
+        library_file (Path): the .npz library created by build_library
+        mass_range (tuple): (min, max) m/z values that can be matched
+
+    returns
+        theor_peaks_df_list (list): a dataframe for each species
+    """
+    library = read_library_arrays(library_file)
+    num_species = len(library["offsets"]) - 1
+    theor_peaks_df_list = [
+        species_frame(library, index, mass_range) for index in range(num_species)
+    ]
+    return theor_peaks_df_list
+
+
+def read_theor_library(input_theor_path: Path, mass_range: tuple) -> list:
+    """
+    Reads the theoretical peptides from either a folder of
+    csv files or a compiled library file
+
+    args
+        input_theor_path (Path): folder of csv files or .npz library
+        mass_range (tuple): (min, max) m/z values that can be matched
+
+    returns
+        theor_peaks_df_list (list): a dataframe for each species
+    """
+    if is_library(input_theor_path):
+        return load_library(input_theor_path, mass_range)
+    return read_theor_folder(input_theor_path, mass_range)
+
+
+if __name__ == "__main__":
+    sys.exit()
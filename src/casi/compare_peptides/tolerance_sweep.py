@@ -0,0 +1,151 @@
+"""
+tolerance_sweep.py
+
+Scores a PMF at several match tolerances in one pass, to check that an
+identification is stable without running compare_score again for each
+threshold. Tolerances are absolute (Da) or relative to the peak m/z
+value (ppm).
+
+The peaks are looked up once in the mass index with the widest
+tolerance. For every peak and species the nearest theoretical m/z value
+below and above the peak are kept. A peak matches a species at a
+tolerance if either of these is within the tolerance, so the match
+counts for every tolerance come from comparisons of these arrays and
+are the same as scoring each tolerance separately.
+"""
+
+import re
+import sys
+from collections import namedtuple
+
+import numpy as np
+
+from casi.compare_peptides.mass_index import MassIndex
+from casi.compare_peptides.match_peaks import match_windows
+
+Tolerance = namedtuple(
+    "Tolerance",
+    [
+        "value",
+        "unit",  # 'Da' or 'ppm'
+    ]
+)
+
+TOLERANCE_PATTERN = re.compile(r"^\s*([0-9]*\.?[0-9]+)\s*(da|ppm)?\s*$", re.I)
+
+
+def parse_tolerance(text: str) -> Tolerance:
+    """Reads a tolerance such as '0.2', '0.2Da' or '10ppm'"""
+    match = TOLERANCE_PATTERN.match(text)
+    if match is None:
+        raise ValueError("Tolerance should be a number of Da or ppm (e.g., 0.2 or 10ppm)")
+    unit = "ppm" if (match.group(2) or "").lower() == "ppm" else "Da"
+    return Tolerance(float(match.group(1)), unit)
+
+
+def tolerance_label(tolerance: Tolerance) -> str:
+    """The tolerance as text, e.g., '0.2 Da' or '10 ppm'"""
+    return "{0:g} {1}".format(tolerance.value, tolerance.unit)
+
+
+def peak_tolerances(tolerance: Tolerance, exp_mz: np.ndarray) -> np.ndarray:
+    """
+    The tolerance in Da for each peak, in the same dtype as the peaks
+    so the match boundaries are the same as compare_score -t
+
+    args
+        tolerance (Tolerance): the tolerance
+        exp_mz (np.ndarray): experimental m/z values
+
+    returns
+        tolerances (np.ndarray): the tolerance for each peak
+    """
+    if tolerance.unit == "ppm":
+        return exp_mz * exp_mz.dtype.type(tolerance.value * 1e-6)
+    return np.full(len(exp_mz), tolerance.value, dtype=exp_mz.dtype)
+
+
+def nearest_masses(mass_index: MassIndex,
+                   exp_mz: np.ndarray,
+                   max_tolerance: np.ndarray) -> tuple:
+    """
+    For every peak and species with a theoretical m/z value within
+    max_tolerance finds the nearest theoretical m/z value below (or equal to)
+    and above (or equal to) the peak.
+
+    args
+        mass_index (MassIndex): index built by build_mass_index
+        exp_mz (np.ndarray): experimental m/z values
+        max_tolerance (np.ndarray): the widest tolerance for each peak
+
+    returns
+        peak_ids (np.ndarray): peak of each (peak, species) pair
+        species_ids (np.ndarray): species of each pair
+        below (np.ndarray): nearest m/z value below the peak (-inf if none)
+        above (np.ndarray): nearest m/z value above the peak (inf if none)
+    """
+    num_species = mass_index.num_species
+    lo, hi = match_windows(mass_index.masses, exp_mz, max_tolerance)
+    mass_counts = hi - lo
+    # every (peak, m/z value) pair in the windows
+    mass_peaks = np.repeat(np.arange(len(exp_mz)), mass_counts)
+    starts = np.cumsum(mass_counts) - mass_counts
+    mass_ids = np.repeat(lo - starts, mass_counts) + np.arange(mass_counts.sum())
+
+    # then every species of each m/z value
+    species_counts = mass_index.indptr[mass_ids + 1] - mass_index.indptr[mass_ids]
+    species_starts = np.cumsum(species_counts) - species_counts
+    offsets = np.repeat(mass_index.indptr[mass_ids] - species_starts, species_counts)
+    species_ids = mass_index.species_ids[offsets + np.arange(species_counts.sum())]
+    peak_ids = np.repeat(mass_peaks, species_counts)
+    masses = np.repeat(mass_index.masses[mass_ids], species_counts).astype(np.float64)
+
+    pairs, pair_ids = np.unique(
+        peak_ids.astype(np.int64) * num_species + species_ids, return_inverse=True
+    )
+    is_below = masses <= exp_mz[peak_ids]
+    below = np.full(len(pairs), -np.inf)
+    np.maximum.at(below, pair_ids[is_below], masses[is_below])
+    is_above = masses >= exp_mz[peak_ids]
+    above = np.full(len(pairs), np.inf)
+    np.minimum.at(above, pair_ids[is_above], masses[is_above])
+    return pairs // num_species, pairs % num_species, below, above
+
+
+def sweep_match_counts(mass_index: MassIndex,
+                       exp_mz: np.ndarray,
+                       tolerances: list) -> np.ndarray:
+    """
+    Counts the matches for every species at every tolerance.
+    As in compare, experimental peaks with the same m/z value
+    are only counted once.
+
+    args
+        mass_index (MassIndex): index built by build_mass_index
+        exp_mz (np.ndarray): experimental m/z values
+        tolerances (list): Tolerance for each column of the results
+
+    returns
+        match_counts (np.ndarray): number of matches (tolerances x species)
+    """
+    unique_mz = np.unique(exp_mz)
+    tolerance_arrays = [peak_tolerances(tolerance, unique_mz) for tolerance in tolerances]
+    max_tolerance = np.max(tolerance_arrays, axis=0)
+    peak_ids, species_ids, below, above = nearest_masses(
+        mass_index, unique_mz, max_tolerance
+    )
+
+    match_counts = np.zeros((len(tolerances), mass_index.num_species), dtype=np.int64)
+    for row, peak_tolerance in enumerate(tolerance_arrays):
+        # boundaries in the same dtype as the peaks (see match_windows)
+        mz_minus = (unique_mz - peak_tolerance)[peak_ids].astype(np.float64)
+        mz_plus = (unique_mz + peak_tolerance)[peak_ids].astype(np.float64)
+        matched = (below >= mz_minus) | (above <= mz_plus)
+        match_counts[row] = np.bincount(
+            species_ids[matched], minlength=mass_index.num_species
+        )
+    return match_counts
+
+
+if __name__ == "__main__":
+    sys.exit()
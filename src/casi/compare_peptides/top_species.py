@@ -0,0 +1,69 @@
+"""
+top_species.py
+
+Keeps the top k species while the species are scored, so only the
+match count and position of k species are held rather than the matches
+of every species. Species with the same number of matches are ranked
+by their position in the theoretical peptides list, the same order as
+the (stable) sort of the results table, so the top k species are always
+the first k rows of the results.
+"""
+
+import sys
+import heapq
+
+import numpy as np
+
+
+def push_top(heap: list, k: int, match_count: int, position: int) -> None:
+    """
+    Adds a species to the top k heap if it is in the top k.
+    The heap is a min heap so the worst of the top k is first.
+
+    args
+        heap (list): the heap (starts as an empty list)
+        k (int): number of species to keep
+        match_count (int): number of matches of the species
+        position (int): position of the species in the theoretical peptides list
+    """
+    if k <= 0:
+        return
+    # a lower position is better for the same match count
+    item = (match_count, -position)
+    if len(heap) < k:
+        heapq.heappush(heap, item)
+    elif item > heap[0]:
+        heapq.heapreplace(heap, item)
+
+
+def top_positions(heap: list) -> list:
+    """Returns the positions of the species in the heap, best first"""
+    return [-position for _, position in sorted(heap, reverse=True)]
+
+
+def top_count_positions(match_counts: np.ndarray, k: int) -> list:
+    """
+    Returns the positions of the top k species from an array of match counts,
+    ranked the same way as push_top.
+
+    args
+        match_counts (np.ndarray): number of matches for each species
+        k (int): number of species to keep
+
+    returns
+        positions (list): positions of the top k species, best first
+    """
+    heap = []
+    # only species with at least the k-th highest count can be in the top k
+    if len(match_counts) > k > 0:
+        cutoff = np.partition(match_counts, len(match_counts) - k)[len(match_counts) - k]
+        candidates = np.flatnonzero(match_counts >= cutoff)
+    else:
+        candidates = np.arange(len(match_counts))
+    for position in candidates.tolist():
+        push_top(heap, k, int(match_counts[position]), position)
+    return top_positions(heap)
+
+
+if __name__ == "__main__":
+    sys.exit()
@@ -0,0 +1,264 @@
+"""
+run_manifest.py
+
+Writes a machine readable record (manifest) of a theoretical_peps or
+compare_score run, for runs that are not watched (e.g., on a scheduler).
+The JSON manifest has:
+    * the program, arguments, start and finish time and if the run finished
+    * the size and SHA-256 hash of every input file
+    * counters, e.g., sequences left after each cleaning step and the
+      peptides generated and kept for each species
+    * the samples scored with their top match
+    * the wall and CPU time of each stage (from stage_profile)
+    * throughput, e.g., peptides or spectra per second
+The same numbers (except the counts of each species and sample) can also
+be written as a Prometheus textfile to be collected by the node exporter.
+
+Counters are added in the code with add_count, add_species_count and
+add_sample, which do nothing unless a manifest has been started.
+"""
+
+import os
+import sys
+import json
+import time
+import hashlib
+import platform
+import tempfile
+from pathlib import Path
+from datetime import datetime, timezone
+
+from casi import __version__
+
+# the manifest of this run, None if no manifest is written
+_manifest = None
+
+# bytes read at a time when hashing input files
+HASH_BLOCK = 1 << 20
+
+
+def file_hash(path: Path) -> str:
+    """The SHA-256 hash of a file"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(HASH_BLOCK), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class RunManifest:
+    """
+    Counters, inputs and samples of one run.
+
+    args
+        program (str): the script name e.g., 'compare_score'
+        arguments (list): the command line arguments
+    """
+
+    def __init__(self, program: str, arguments: list):
+        self.program = program
+        self.arguments = [str(argument) for argument in arguments]
+        self.started = time.time()
+        self.inputs = []
+        self.counts = {}
+        self.species = {}
+        self.samples = []
+        # rate name as key, (count name, stages) as value
+        self.rates = {}
+
+    def add_input(self, path: Path) -> None:
+        """Adds an input file, or every file in an input folder"""
+        path = Path(path)
+        files = sorted(p for p in path.rglob("*") if p.is_file()) if path.is_dir() else [path]
+        for input_file in files:
+            self.inputs.append({
+                "path": str(input_file),
+                "bytes": input_file.stat().st_size,
+                "sha256": file_hash(input_file),
+            })
+
+    def add_rate(self, name: str, count: str, stages: list) -> None:
+        """Adds a throughput, the count per second of the stages wall time"""
+        self.rates[name] = (count, stages)
+
+    def throughput(self, profile) -> dict:
+        """The rates from the counts and stage times of the profile"""
+        rates = {}
+        for name, (count, stages) in self.rates.items():
+            seconds = 0.0 if profile is None else profile.stage_seconds(stages)
+            if count in self.counts and seconds > 0:
+                rates[name] = self.counts[count] / seconds
+        return rates
+
+    def record(self, profile, success: bool) -> dict:
+        """
+        The manifest as a dictionary for the JSON file
+
+        args
+            profile (StageProfile): times of each stage (or None)
+            success (bool): if the run finished without an error
+
+        returns
+            manifest (dict): the manifest
+        """
+        finished = time.time()
+        return {
+            "program": self.program,
+            "version": __version__,
+            "arguments": self.arguments,
+            "started": datetime.fromtimestamp(self.started, timezone.utc).isoformat(timespec="seconds"),
+            "finished": datetime.fromtimestamp(finished, timezone.utc).isoformat(timespec="seconds"),
+            "seconds": finished - self.started,
+            "success": success,
+            "host": platform.node(),
+            "python": platform.python_version(),
+            "inputs": self.inputs,
+            "counts": self.counts,
+            "species": self.species,
+            "samples": self.samples,
+            "stages": {} if profile is None else profile.stages,
+            "throughput": self.throughput(profile),
+        }
+
+
+def prometheus_text(manifest: dict) -> str:
+    """
+    Formats the manifest as Prometheus metrics (text exposition format)
+
+    args
+        manifest (dict): the manifest from RunManifest.record
+
+    returns
+        text (str): the metrics
+    """
+    program = '{{program="{0}"'.format(manifest["program"])
+    lines = []
+
+    def metric(name, help_text, values):
+        lines.append("# HELP casi_{0} {1}".format(name, help_text))
+        lines.append("# TYPE casi_{0} gauge".format(name))
+        for labels, value in values:
+            lines.append("casi_{0}{1}}} {2}".format(name, program + labels, float(value)))
+
+    metric("run_success", "1 if the run finished without an error", [("", manifest["success"])])
+    metric("run_seconds", "Wall time of the run", [("", manifest["seconds"])])
+    metric(
+        "run_finished_timestamp_seconds",
+        "Time the run finished (Unix time)",
+        [("", datetime.fromisoformat(manifest["finished"]).timestamp())],
+    )
+    metric(
+        "count",
+        "Counters of the run",
+        [(',count="{0}"'.format(name), value) for name, value in manifest["counts"].items()],
+    )
+    for name, key in [("stage_seconds", "wall"), ("stage_cpu_seconds", "cpu")]:
+        metric(
+            name,
+            "{0} time of each stage".format("Wall" if key == "wall" else "CPU"),
+            [(',stage="{0}"'.format(stage), stats[key]) for stage, stats in manifest["stages"].items()],
+        )
+    metric(
+        "throughput",
+        "Items per second",
+        [(',rate="{0}"'.format(name), value) for name, value in manifest["throughput"].items()],
+    )
+    return "\n".join(lines) + "\n"
+
+
+def write_file(path: Path, text: str) -> None:
+    """Writes the whole file at once, so a collector never reads half a file.
+    Each write has its own temporary file, so runs writing the same file
+    at the same time do not replace each other's temporary file"""
+    path = Path(path)
+    temp_file = tempfile.NamedTemporaryFile(
+        "w", encoding="utf-8", dir=path.parent, prefix=path.name, suffix=".tmp", delete=False
+    )
+    try:
+        with temp_file:
+            temp_file.write(text)
+        os.replace(temp_file.name, path)
+    except BaseException:
+        Path(temp_file.name).unlink(missing_ok=True)
+        raise
+
+
+def start_manifest(program: str, arguments: list) -> RunManifest:
+    """Starts recording the manifest of the run"""
+    global _manifest
+    _manifest = RunManifest(program, arguments)
+    return _manifest
+
+
+def add_input(path: Path) -> None:
+    """Records the hash of an input file (or the files in a folder)"""
+    if _manifest is not None:
+        _manifest.add_input(path)
+
+
+def add_count(name: str, value: int) -> None:
+    """Adds to a counter of the run"""
+    if _manifest is not None:
+        _manifest.counts[name] = _manifest.counts.get(name, 0) + int(value)
+
+
+def add_species_count(species: str, name: str, value: int) -> None:
+    """Records a count for one species, which is also added to the run counter"""
+    if _manifest is not None:
+        _manifest.species.setdefault(species, {})[name] = int(value)
+        add_count(name, value)
+
+
+def add_sample(name: str, match_results_df, total_peaks: int, match_column: str = "Match") -> None:
+    """Records the peaks and top two matches of a scored sample"""
+    if _manifest is None:
+        return
+    top = match_results_df.head(2)
+    _manifest.samples.append({
+        "sample": name,
+        "peaks": int(total_peaks),
+        "top_species": None if top.empty else str(top["species"].iloc[0]),
+        "top_match": None if top.empty else int(top[match_column].iloc[0]),
+        "second_match": None if len(top) < 2 else int(top[match_column].iloc[1]),
+    })
+    add_count("samples", 1)
+    add_count("peaks", total_peaks)
+
+
+def add_rate(name: str, count: str, stages: list) -> None:
+    """Records a throughput, count per second of the stages wall time"""
+    if _manifest is not None:
+        _manifest.add_rate(name, count, stages)
+
+
+def finish_manifest(profile, success: bool, manifest_path: Path = None,
+                    prometheus_path: Path = None) -> dict:
+    """
+    Writes the manifest JSON and Prometheus textfile and stops recording.
+    Does nothing if no manifest was started.
+
+    args
+        profile (StageProfile): times of each stage (or None)
+        success (bool): if the run finished without an error
+        manifest_path (Path): the JSON file (optional)
+        prometheus_path (Path): the Prometheus textfile (optional)
+
+    returns
+        manifest (dict): the manifest (None if no manifest was started)
+    """
+    global _manifest
+    if _manifest is None:
+        return None
+    manifest = _manifest.record(profile, success)
+    _manifest = None
+    if manifest_path is not None:
+        write_file(manifest_path, json.dumps(manifest, indent=2))
+        print("Run manifest saved to '{0}'".format(manifest_path))
+    if prometheus_path is not None:
+        write_file(prometheus_path, prometheus_text(manifest))
+        print("Prometheus metrics saved to '{0}'".format(prometheus_path))
+    return manifest
+
+
+if __name__ == "__main__":
+    sys.exit()
@@ -0,0 +1,559 @@
+"""
+benchmark_score.py
+
+Times compare_score on synthetic theoretical peptide libraries and
+peak lists for a range of species counts and peak list sizes.
+For each size the library load (csv folder, build and .npz library),
+the setup of each engine, reading the peak list, matching, ranking and
+the export of the results and matches are timed. The in silico digest
+of theoretical_peps can also be timed for sequences from a fasta file.
+
+The start up time of the compare_score and theoretical_peps scripts
+(python starting to --help printed) is also timed and checked against
+a time budget, as the scripts can be run once for each sample.
+
+The timings are saved as JSON. If a previous JSON file is given as a
+baseline any stage that is slower than the baseline is reported and the
+script exits with 1, so slower code is found before a release.
+"""
+
+import os
+import sys
+import json
+import time
+import subprocess
+import argparse
+import platform
+import tempfile
+import statistics
+from pathlib import Path
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+
+from casi.compare_peptides.theor_library import (
+    build_library,
+    read_species_csv,
+    read_theor_library,
+)
+from casi.compare_peptides.mass_index import build_mass_index
+from casi.compare_peptides.bin_index import load_bin_index
+from casi.compare_peptides.match_export import (
+    EXPORT_FORMATS,
+    MatchExport,
+    check_format,
+    export_path,
+)
+from casi.compare_peptides.synthetic_data import (
+    read_templates,
+    synthetic_library,
+    synthetic_peak_list,
+    write_peak_list,
+)
+from casi.theoretical_peptides.sort_sequences.fasta_col_clean import read_fasta
+from casi.theoretical_peptides.generate_peptides.cleave_mass import cleave_and_mass
+from casi.scripts.compare_score import (
+    Engine,
+    export_matches,
+    index_comparison,
+    read_exp_PMF,
+    search_comparison,
+    sort_results,
+)
+
+BENCHMARK_VERSION = 1
+ENGINES = ["search", "index", "bitmap"]
+# scripts timed from python starting to --help printed
+STARTUP_MODULES = {
+    "compare_score": "casi.scripts.compare_score",
+    "theoretical_peps": "casi.scripts.theoretical_peps",
+}
+# the longest start up time (s) for a script
+STARTUP_BUDGET = 0.2
+
+################
+# FUNCTIONS
+################
+
+
+def directory_test(arg):
+    """Test if the input directory exists"""
+    p = Path(arg)
+    if p.is_dir():
+        return p
+    else:
+        raise Exception("The input directory does not exist {0}".format(p))
+
+
+def file_test(arg):
+    """Tests if the input file exists"""
+    p = Path(arg)
+    if p.is_file():
+        return p
+    else:
+        raise FileNotFoundError(arg)
+
+
+def output_test(arg):
+    """Test if directory of new output file exists"""
+    p = Path(arg)
+    par = p.parent
+    if par.is_dir():
+        return p
+    else:
+        raise Exception(
+            "The directory of the new output file does not exist {0}".format(p)
+        )
+
+
+def sizes_test(arg):
+    """Test the sizes are a comma separated list of integers of 1 or more"""
+    try:
+        sizes = [int(size) for size in arg.split(",")]
+    except ValueError:
+        sizes = []
+    if sizes and all(size >= 1 for size in sizes):
+        return sizes
+    raise Exception("The sizes should be comma separated integers of 1 or more e.g., 10,100,1000")
+
+
+def engines_test(arg):
+    """Test the engines are a comma separated list of compare_score engines"""
+    engines = arg.split(",")
+    if all(engine in ENGINES for engine in engines):
+        return engines
+    raise Exception("The engines should be comma separated from {0}".format(", ".join(ENGINES)))
+
+
+def repeats_test(arg):
+    """Test the number of repeats is at least 1"""
+    arg = int(arg)
+    if arg >= 1:
+        return arg
+    else:
+        raise Exception("The input -r --repeats should be an integer of 1 or more")
+
+
+def parse_args(argv):
+    description = """Benchmarks compare_score on synthetic theoretical peptide libraries
+    and peak lists. The library load, engine setup, reading the peak list, matching,
+    ranking and export are timed for every species count, peak list size and engine.
+    The timings are saved as a JSON file."""
+
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument(
+        "-o",
+        "--output",
+        help="The JSON file for the timings",
+        type=output_test,
+        required=True,
+    )
+    parser.add_argument(
+        "-it",
+        "--inputTheor",
+        help="""A folder of theoretical peptides csv files (e.g., data/outputs/filtered_peptides)
+        used as templates for the synthetic species. If not given the species have random peptides""",
+        type=directory_test,
+    )
+    parser.add_argument(
+        "-s",
+        "--species",
+        help="Comma separated numbers of species in the synthetic libraries. Default is 10,100,1000",
+        default=[10, 100, 1000],
+        type=sizes_test,
+    )
+    parser.add_argument(
+        "-p",
+        "--peaks",
+        help="Comma separated numbers of peaks in the synthetic peak lists. Default is 50,200,1000",
+        default=[50, 200, 1000],
+        type=sizes_test,
+    )
+    parser.add_argument(
+        "-e",
+        "--engines",
+        help="Comma separated engines to benchmark. Default is search,index,bitmap",
+        default=list(ENGINES),
+        type=engines_test,
+    )
+    parser.add_argument(
+        "-r",
+        "--repeats",
+        help="The number of times each stage is timed. Default is 3",
+        default=3,
+        type=repeats_test,
+    )
+    parser.add_argument(
+        "-t",
+        "--threshold",
+        help="The threshold for matches. Default is 0.2 Da",
+        default=0.2,
+        type=float,
+    )
+    parser.add_argument(
+        "-mk",
+        "--matches",
+        help="The number of top species to export the matches for. Default is 5",
+        default=5,
+        type=int,
+    )
+    parser.add_argument(
+        "-mf",
+        "--match_format",
+        help="The file format of the exported matches. Default is 'csv'",
+        default="csv",
+        choices=list(EXPORT_FORMATS),
+    )
+    parser.add_argument(
+        "-sq",
+        "--sequences",
+        help="""A COL1 fasta file (e.g., data/outputs/COL1A1A2_combined_seqs_NCBI.fasta).
+        If given the in silico digest of the first sequences (see -nd) is also timed""",
+        type=file_test,
+    )
+    parser.add_argument(
+        "-nd",
+        "--digest",
+        help="The number of sequences to digest from the fasta file (-sq). Default is 3",
+        default=3,
+        type=repeats_test,
+    )
+    parser.add_argument(
+        "-bl",
+        "--baseline",
+        help="""A previous benchmark JSON file. Stages where the fastest run is slower than
+        the baseline by more than the factor -sf are reported and the exit code is 1""",
+        type=file_test,
+    )
+    parser.add_argument(
+        "-sf",
+        "--slower",
+        help="How many times slower than the baseline a stage can be. Default is 1.5",
+        default=1.5,
+        type=float,
+    )
+    parser.add_argument(
+        "-sb",
+        "--startup_budget",
+        help="""The longest time (s) the scripts can take to start (python starting to --help printed).
+        Scripts that take longer are reported and the exit code is 1. Default is {0}""".format(STARTUP_BUDGET),
+        default=STARTUP_BUDGET,
+        type=float,
+    )
+    parser.add_argument(
+        "-wd",
+        "--workdir",
+        help="""Folder for the synthetic libraries and outputs, which are kept.
+        A temporary folder is used (and removed) if not given""",
+        type=directory_test,
+    )
+    parser.add_argument(
+        "--seed",
+        help="The random seed for the synthetic data. Default is 0",
+        default=0,
+        type=int,
+    )
+    args = parser.parse_args(argv)
+    return args
+
+
+def time_stage(function, repeats):
+    """Runs the function repeats times and returns the result
+    of the last run and the time (seconds) of each run"""
+    seconds = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = function()
+        seconds.append(time.perf_counter() - start)
+    return result, seconds
+
+
+def timing(stage, seconds, species=None, peaks=None, engine=None, **info):
+    """A timing record for the JSON output"""
+    record = {
+        "stage": stage,
+        "species": species,
+        "peaks": peaks,
+        "engine": engine,
+        "median": statistics.median(seconds),
+        "min": min(seconds),
+        "seconds": seconds,
+    }
+    record.update(info)
+    return record
+
+
+def environment():
+    """Versions and computer the benchmark was run on"""
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+    }
+
+
+def setup_engine(name, theor_peaks_list, threshold, mass_range, bin_path):
+    """Builds the engine as compare_score does. The bins of the
+    bitmap engine are removed first so they are built every time"""
+    if name == "search":
+        return Engine()
+    mass_index = build_mass_index(theor_peaks_list)
+    bin_index = None
+    if name == "bitmap":
+        bin_path.unlink(missing_ok=True)
+        bin_index = load_bin_index(mass_index, threshold, mass_range, bin_path)
+    return Engine(name, mass_index=mass_index, bin_index=bin_index)
+
+
+def compare_species(theor_peaks_list, act_peaks_df, threshold, engine, top_k):
+    """The matching step of rank_species for the engine"""
+    if engine.name in ("index", "bitmap"):
+        return index_comparison(theor_peaks_list, act_peaks_df, threshold, engine, top_k)
+    return search_comparison(theor_peaks_list, act_peaks_df, threshold, engine, top_k)
+
+
+def export_results(match_results_df, top_species, theor_peaks_list, act_peaks_df, args, output):
+    """Saves the results csv and the matches of the top species"""
+    match_results_df.to_csv(output)
+    path = export_path(output, args.match_format)
+    with MatchExport(path, args.match_format, args.matches) as match_export:
+        export_matches(
+            match_export, output.stem, top_species, theor_peaks_list, act_peaks_df, args.threshold
+        )
+
+
+def benchmark_library(args, num_species, templates, workdir):
+    """Times the library load and scoring of every peak list size
+    and engine for one synthetic library"""
+    mass_range = (800, 3500)
+    records = []
+    library_folder = synthetic_library(
+        workdir / "species_{0}".format(num_species), num_species, args.seed, templates, mass_range
+    )
+    print("\nLibrary of {0} species".format(num_species))
+
+    _, seconds = time_stage(lambda: read_theor_library(library_folder, mass_range), args.repeats)
+    records.append(timing("load_csv", seconds, num_species))
+    library_file = workdir / "library_{0}.npz".format(num_species)
+    _, seconds = time_stage(lambda: build_library(library_folder, library_file), args.repeats)
+    records.append(timing("build_library", seconds, num_species))
+    theor_peaks_list, seconds = time_stage(
+        lambda: read_theor_library(library_file, mass_range), args.repeats
+    )
+    records.append(timing("load_library", seconds, num_species))
+
+    # peak lists are made from the first species
+    species_df = read_species_csv(sorted(library_folder.glob("*.csv"))[0])
+    for engine_name in args.engines:
+        bin_path = workdir / "bins_{0}.npz".format(num_species)
+        engine, seconds = time_stage(
+            lambda: setup_engine(engine_name, theor_peaks_list, args.threshold, mass_range, bin_path),
+            args.repeats,
+        )
+        records.append(timing("setup", seconds, num_species, engine=engine_name))
+
+        for num_peaks in args.peaks:
+            peak_file = write_peak_list(
+                synthetic_peak_list(species_df, num_peaks, args.seed, mass_range),
+                workdir / "peaks_{0}.txt".format(num_peaks),
+            )
+            sizes = {"species": num_species, "peaks": num_peaks, "engine": engine_name}
+            (act_peaks_df, total_peaks), seconds = time_stage(
+                lambda: read_exp_PMF(peak_file, mass_range), args.repeats
+            )
+            records.append(timing("read_peaks", seconds, **sizes))
+            (match_results_df, top_species), seconds = time_stage(
+                lambda: compare_species(
+                    theor_peaks_list, act_peaks_df, args.threshold, engine, args.matches
+                ),
+                args.repeats,
+            )
+            records.append(timing("match", seconds, **sizes))
+            match_results_df["Maximum Possible"] = total_peaks
+            ranked_df, seconds = time_stage(lambda: sort_results(match_results_df), args.repeats)
+            # the top species is recorded to check the engines agree
+            records.append(timing(
+                "rank",
+                seconds,
+                top_species=ranked_df.loc[0, "species"],
+                top_match=int(ranked_df.loc[0, "Match"]),
+                **sizes,
+            ))
+            output = workdir / "results_{0}_{1}_{2}.csv".format(num_species, num_peaks, engine_name)
+            _, seconds = time_stage(
+                lambda: export_results(
+                    ranked_df, top_species, theor_peaks_list, act_peaks_df, args, output
+                ),
+                args.repeats,
+            )
+            records.append(timing("export", seconds, **sizes))
+            print("{0} peaks {1} engine: match {2:.4f} s".format(
+                num_peaks, engine_name, records[-3]["median"]
+            ))
+    return records
+
+
+def benchmark_digest(args):
+    """Times the in silico digest and mass calculation (theoretical_peps STEP 4)
+    of the first sequences in the fasta file"""
+    sequences = list(read_fasta(args.sequences).values())[: args.digest]
+    records = []
+    for seq in sequences:
+        peptide_df, seconds = time_stage(lambda: cleave_and_mass(seq, "trypsin", 1), args.repeats)
+        records.append(timing(
+            "digest", seconds, residues=len(seq), peptides=len(peptide_df)
+        ))
+    print("\nDigest: {0:.4f} s per sequence".format(
+        statistics.median(record["median"] for record in records)
+    ))
+    return records
+
+
+def benchmark_startup(args):
+    """Times each script from python starting to --help printed,
+    which includes importing the script modules"""
+    records = []
+    for program, module in STARTUP_MODULES.items():
+        command = [sys.executable, "-m", module, "--help"]
+        _, seconds = time_stage(
+            lambda: subprocess.run(command, check=True, stdout=subprocess.DEVNULL), args.repeats
+        )
+        records.append(timing("startup", seconds, program=program, budget=args.startup_budget))
+    return records
+
+
+def over_budget(records):
+    """The scripts where the fastest start up is longer than the budget"""
+    return [
+        record for record in records
+        if record["stage"] == "startup" and record["min"] > record["budget"]
+    ]
+
+
+def record_key(record):
+    """Identifies the same timing in two benchmark files"""
+    return tuple(
+        record.get(key) for key in ("stage", "species", "peaks", "engine", "residues", "program")
+    )
+
+
+def compare_baseline(records, baseline_file, slower):
+    """
+    Compares the timings to a previous benchmark file.
+
+    args
+        records (list): the timing records
+        baseline_file (Path): a previous benchmark JSON file
+        slower (float): how many times slower a stage can be
+
+    returns
+        regressions (pd.DataFrame): the stages slower than allowed
+    """
+    with open(baseline_file) as file:
+        baseline = {record_key(record): record for record in json.load(file)["timings"]}
+    rows = []
+    for record in records:
+        previous = baseline.get(record_key(record))
+        # the fastest run is least affected by other work on the computer
+        if previous is None or previous["min"] <= 0:
+            continue
+        ratio = record["min"] / previous["min"]
+        if ratio > slower:
+            rows.append({
+                "stage": record["stage"],
+                "program": record.get("program"),
+                "species": record["species"],
+                "peaks": record["peaks"],
+                "engine": record["engine"],
+                "baseline (s)": previous["min"],
+                "now (s)": record["min"],
+                "times slower": ratio,
+            })
+    return pd.DataFrame(rows)
+
+
+def run_benchmark(args, workdir):
+    """Runs every benchmark and returns the timing records"""
+    templates = read_templates(args.inputTheor) if args.inputTheor is not None else None
+    records = benchmark_startup(args)
+    for num_species in args.species:
+        records.extend(benchmark_library(args, num_species, templates, workdir))
+    if args.sequences is not None:
+        records.extend(benchmark_digest(args))
+    return records
+
+
+def print_summary(records):
+    """Prints the median time of each stage"""
+    timings_df = pd.DataFrame(records)
+    startup_df = timings_df[timings_df["stage"] == "startup"]
+    print("\nSTART UP TIMES (s):")
+    print(startup_df[["program", "min", "median", "budget"]].to_markdown(index=False))
+    library_df = timings_df[timings_df["stage"].isin(["load_csv", "build_library", "load_library"])]
+    print("\nLIBRARY MEDIAN TIMES (s):")
+    print(library_df.pivot(index="species", columns="stage", values="median").to_markdown())
+    scoring_df = timings_df[timings_df["peaks"].notna()].astype({"species": int, "peaks": int})
+    print("\nSCORING MEDIAN TIMES (s):")
+    print(scoring_df.pivot(
+        index=["species", "peaks", "engine"], columns="stage", values="median"
+    ).to_markdown())
+
+
+def main(argv=sys.argv[1:]):
+    """Main method and logic"""
+    args = parse_args(argv)
+    check_format(args.match_format)
+
+    if args.workdir is not None:
+        records = run_benchmark(args, Path(args.workdir))
+    else:
+        with tempfile.TemporaryDirectory() as workdir:
+            records = run_benchmark(args, Path(workdir))
+
+    benchmark = {
+        "version": BENCHMARK_VERSION,
+        "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "environment": environment(),
+        "settings": {
+            "species": args.species,
+            "peaks": args.peaks,
+            "engines": args.engines,
+            "repeats": args.repeats,
+            "threshold": args.threshold,
+            "matches": args.matches,
+            "match_format": args.match_format,
+            "templates": None if args.inputTheor is None else str(args.inputTheor),
+            "seed": args.seed,
+            "startup_budget": args.startup_budget,
+        },
+        "timings": records,
+    }
+    with open(args.output, "w") as file:
+        json.dump(benchmark, file, indent=2)
+
+    print_summary(records)
+    print("\nTimings saved to '{0}'".format(args.output))
+
+    exit_code = 0
+    for record in over_budget(records):
+        print("\n{0} takes {1:.3f} s to start, the budget is {2} s".format(
+            record["program"], record["min"], record["budget"]
+        ))
+        exit_code = 1
+    if args.baseline is not None:
+        regressions = compare_baseline(records, args.baseline, args.slower)
+        if not regressions.empty:
+            print("\nSLOWER THAN THE BASELINE:")
+            print(regressions.to_markdown(index=False))
+            exit_code = 1
+        else:
+            print("\nNo stage is more than {0} times slower than the baseline".format(args.slower))
+    return exit_code
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
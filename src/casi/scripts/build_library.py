@@ -0,0 +1,69 @@
+"""
+build_library.py
+
+Compiles the theoretical peptide csv files generated by theoretical_peps
+(the filtered_peptides folder) into a single .npz library file.
+The library can be used as the -it input of compare_score and is much
+faster to load than reading all the csv files.
+"""
+
+import sys
+import argparse
+from pathlib import Path
+
+from casi.compare_peptides.theor_library import build_library
+
+
+def directory_test(arg):
+    """Test if the input directory exists"""
+    p = Path(arg)
+    if p.is_dir():
+        return p
+    else:
+        raise Exception("The input directory does not exist {0}".format(p))
+
+
+def output_test(arg):
+    """Test if directory of new output file exists"""
+    p = Path(arg)
+    par = p.parent
+    if par.is_dir():
+        return p
+    else:
+        raise Exception(
+            "The directory of the new output file does not exist {0}".format(p)
+        )
+
+
+def parse_args(argv):
+    description = """Compiles the theoretical peptides csv files for all species
+    into one .npz library file. The library file can be used as the input
+    theoretical peptides (-it) in compare_score instead of the folder."""
+
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument(
+        "-it",
+        "--inputTheor",
+        help="the folder that contains the theoretical peptides csv files (filtered_peptides)",
+        type=directory_test,
+        required=True,
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        help="The file name for the library file. The .npz suffix is added",
+        type=output_test,
+        required=True,
+    )
+    args = parser.parse_args(argv)
+    return args
+
+
+def main(argv=sys.argv[1:]):
+    """Main method and logic"""
+    args = parse_args(argv)
+    build_library(Path(args.inputTheor), Path(args.output))
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
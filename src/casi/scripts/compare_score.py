@@ -11,11 +11,49 @@ Compare_correlation_NCBI.py
  to species in the database
 """
 
+import re
 import sys
 from pathlib import Path
+from collections import namedtuple
 import argparse
 
-import pandas as pd
+# pandas, NumPy and the other compare_peptides modules are imported in the
+# functions that use them, so starting the script (e.g., --help) is fast and
+# each run only imports what it needs (e.g., the service and process pool
+# modules are only imported when used)
+from casi.compare_peptides.options import DECOY_TYPES, EXPORT_FORMATS, PeakSettings
+from casi.stage_profile import enable_profile, profile_stage, report_profile
+from casi.run_manifest import (
+    add_count,
+    add_input,
+    add_rate,
+    add_sample,
+    finish_manifest,
+    start_manifest,
+)
+
+# how the species are compared to the PMF
+# name is the engine ('search', 'index' or 'bitmap'), pool and workers are used
+# by the search engine, mass_index by the index and bitmap engines
+# (and the decoys and bootstrap) and bin_index by the bitmap engine
+Engine = namedtuple(
+    "Engine",
+    ["name", "pool", "workers", "mass_index", "bin_index"],
+    defaults=["search", None, 1, None, None],
+)
+
+# a PMF to score. offset is the byte offset of the scan in
+# a mzXML/mzML file (None for a peak list text file)
+Sample = namedtuple("Sample", ["name", "path", "offset"])
+
+# file types that can be scored in batch mode
+PMF_PATTERNS = ["*.txt", "*.mzXML", "*.mzML"]
+
+# stages that score the samples, used for the spectra per second
+SCORING_STAGES = ["read PMF", "compare", "decoys", "bootstrap", "rank", "export", "export matches"]
+
+# number of species with the matches saved by --top5
+TOP_SPECIES = 5
 
 ################
 # FUNCTIONS
@@ -40,6 +78,33 @@ def directory_test(arg):
         raise Exception("The input directory does not exist {0}".format(p))
 
 
+def theor_test(arg):
+    """Test if the input is a directory or a compiled theoretical library"""
+    from casi.compare_peptides.theor_library import is_library
+
+    p = Path(arg)
+    if p.is_dir() or is_library(p):
+        return p
+    else:
+        raise Exception(
+            "The input is not a directory or a .npz theoretical library {0}".format(p)
+        )
+
+
+def batch_test(arg):
+    """Finds the peak list files for batch mode. The input can be a
+    directory (all .txt, .mzXML and .mzML files) or a glob pattern"""
+    p = Path(arg)
+    if p.is_dir():
+        pmf_files = sorted(pmf for pattern in PMF_PATTERNS for pmf in p.glob(pattern))
+    else:
+        pmf_files = sorted(Path(p.anchor).glob(str(p.relative_to(p.anchor))))
+        pmf_files = [pmf for pmf in pmf_files if pmf.is_file()]
+    if not pmf_files:
+        raise Exception("No peak list files found for the batch input {0}".format(p))
+    return pmf_files
+
+
 def output_test(arg):
     """Test if directory of new output file exists"""
     p = Path(arg)
@@ -70,6 +135,36 @@ def range_test(arg):
         )
 
 
+def workers_test(arg):
+    """Test the number of worker processes is at least 1"""
+    arg = int(arg)
+    if arg >= 1:
+        return arg
+    else:
+        raise Exception("The input -w --workers should be an integer of 1 or more")
+
+
+def decoys_test(arg):
+    """Test the number of decoys (or bootstrap replicates or species) is 0 or more"""
+    arg = int(arg)
+    if arg >= 0:
+        return arg
+    else:
+        raise Exception("The inputs -d --decoys, -b --bootstrap and -mk --matches should be an integer of 0 or more")
+
+
+def tolerances_test(arg):
+    """Test the tolerances are a comma separated list of Da or ppm values"""
+    from casi.compare_peptides.tolerance_sweep import parse_tolerance
+
+    try:
+        return [parse_tolerance(tolerance) for tolerance in arg.split(",")]
+    except ValueError:
+        raise Exception(
+            "The input -ts --tolerances should be comma separated tolerances in Da or ppm e.g., 0.1,0.2,10ppm"
+        )
+
+
 # test if --top5 input is 0 or 1 only
 def test_01(arg):
     arg = int(arg)
@@ -94,8 +189,9 @@ def parse_args(argv):
     parser.add_argument(
         "-it",
         "--inputTheor",
-        help="the folder that contains the theoretical peptides csv files to compare against PMF",
-        type=directory_test,
+        help="""the folder that contains the theoretical peptides csv files to compare against PMF.
+        Can also be a .npz theoretical library compiled with build_library""",
+        type=theor_test,
     )
     # adds where the output file should be saved
     parser.add_argument(
@@ -105,12 +201,25 @@ def parse_args(argv):
         type=output_test,
     )
     # adds where the input peptide mass fingerprint
-    parser.add_argument(
+    # either one PMF or a batch of PMFs
+    input_group = parser.add_mutually_exclusive_group(required=True)
+    input_group.add_argument(
         "-ip",
         "--inputPMF",
-        help="The input Peptide mass fingerprint (PMF) from an unknown organism.",
+        help="""The input Peptide mass fingerprint (PMF) from an unknown organism.
+        Either a peak list text file or a mzXML/mzML file. If the mzXML/mzML file has
+        more than one scan (e.g., a MALDI plate) every scan is scored as in batch mode.""",
         type=file_test,
     )
+    input_group.add_argument(
+        "-ib",
+        "--inputBatch",
+        help="""A folder (all .txt, .mzXML and .mzML files are used) or glob pattern (e.g., 'plate1/*.txt')
+        of PMF peak lists to score in one run. The theoretical peptides are only read once.
+        The results for each PMF are saved next to the output file as '<PMF name>_<output name>'
+        and the output file is a summary of the top match for every PMF. PMF names must be different.""",
+        type=batch_test,
+    )
     parser.add_argument(
         "-t",
         "--threshold",
@@ -130,22 +239,297 @@ def parse_args(argv):
     parser.add_argument(
         "-m5",
         "--top5",
-        help="""If 1 is inputted will provide an excel file of m/z peak matches for the top 5 match counts as an xlsx (excel) file.
+        help="""If 1 is inputted will save the m/z peak matches for the top 5 species (the same as -mk 5).
                         Default is 0""",
         default=0,
         type=test_01,
     )
-    args = parser.parse_args()
+    parser.add_argument(
+        "-mk",
+        "--matches",
+        help="""The number of top species of each PMF to save the m/z peak matches for. The matches are saved
+        next to the output file as '<output name>_matches.csv' (or .jsonl/.parquet, see -mf) with one row for
+        each matched peak. In batch mode the matches of every PMF are added to the same file. Default is 0""",
+        default=0,
+        type=decoys_test,
+    )
+    parser.add_argument(
+        "-mf",
+        "--match_format",
+        help="""The file format for the matches (-mk or -m5). 'csv', 'jsonl' (JSON Lines) or
+        'parquet' (needs pyarrow). Default is 'csv'""",
+        default="csv",
+        choices=list(EXPORT_FORMATS),
+    )
+    parser.add_argument(
+        "-e",
+        "--engine",
+        help="""How the PMF is compared to the species. 'search' compares each species in turn
+        using a binary search of the sorted m/z values. 'index' builds an index of the unique m/z values
+        of all species and looks up each PMF peak once for all species, which is faster for large libraries.
+        'bitmap' splits the mass range into small bins with the species that match each bin, the bins can
+        be saved for the threshold and reused (see -bc).
+        Results are the same. Default is 'search'""",
+        default="search",
+        choices=["search", "index", "bitmap"],
+    )
+    parser.add_argument(
+        "-bc",
+        "--bin_cache",
+        help="""Folder to save the bins of the 'bitmap' engine in, so later runs with the same
+        library, threshold and mass range reuse them. The bins are not saved if not given""",
+        type=directory_test,
+    )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        help="""The number of processes used to compare the PMF against the species.
+        Results are the same as using one process. Default is 1""",
+        default=1,
+        type=workers_test,
+    )
+    parser.add_argument(
+        "-ts",
+        "--tolerances",
+        help="""Scores the PMF at several tolerances in one pass instead of the single threshold (-t).
+        A comma separated list of tolerances in Da or ppm e.g., 0.1,0.2,0.3,0.5,10ppm,20ppm.
+        The output file has the number of matches at each tolerance for every species,
+        ordered by the first tolerance. Cannot be used with -e, -bc, -w, -d, -b, -mk or -m5""",
+        type=tolerances_test,
+    )
+    parser.add_argument(
+        "-d",
+        "--decoys",
+        help="""The number of decoy peak lists used to test if the match counts are higher than chance
+        (e.g., 200). The decoys are the PMF peaks shifted by a random amount (or random peaks, see -dt)
+        and are scored against every species. The results then include the mean and standard deviation of
+        the decoy match counts, a z-score and a p-value for each species. Default is 0 (no decoys)""",
+        default=0,
+        type=decoys_test,
+    )
+    parser.add_argument(
+        "-dt",
+        "--decoy_type",
+        help="""'shift' moves all the PMF peaks by the same random amount, 'random' places the same number
+        of peaks at random m/z values. Default is 'shift'""",
+        default="shift",
+        choices=DECOY_TYPES,
+    )
+    parser.add_argument(
+        "-b",
+        "--bootstrap",
+        help="""The number of bootstrap replicates used to test how stable the top species is (e.g., 1000).
+        Each replicate resamples the PMF peaks with replacement and the results include the fraction of
+        replicates where each species has the highest number of matches. Default is 0 (no bootstrap)""",
+        default=0,
+        type=decoys_test,
+    )
+    parser.add_argument(
+        "--seed",
+        help="The random seed for the decoys and bootstrap so the results can be repeated. Default is 0",
+        default=0,
+        type=int,
+    )
+    parser.add_argument(
+        "-sn",
+        "--snr",
+        help="""The signal to noise cutoff used to pick peaks from profile mzXML/mzML spectra.
+        Only the monoisotopic peaks are kept. Default is 7""",
+        default=PeakSettings().snr,
+        type=float,
+    )
+    parser.add_argument(
+        "--profile",
+        help="""Prints the wall time, CPU time and peak memory of each stage (reading the inputs,
+        comparing, ranking and saving the outputs) when the run finishes. Memory tracing makes the run slower.""",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--profile_dir",
+        help="""Folder to save a cProfile file for each stage ('<stage>.prof').
+        Also turns on --profile.""",
+        type=Path,
+    )
+    parser.add_argument(
+        "--manifest",
+        help="""JSON file to save a record of the run: input file hashes, the number of
+        species, peaks and top matches of each sample, the time of each stage and spectra per second.""",
+        type=output_test,
+    )
+    parser.add_argument(
+        "--prometheus",
+        help="""Prometheus textfile (e.g., casi_compare_score.prom) to save the counts,
+        stage times and throughput of the run for the node exporter.""",
+        type=output_test,
+    )
+    args = parser.parse_args(argv)
+
+    # the tolerance sweep only counts the matches with the mass index
+    if args.tolerances is not None:
+        ignored = [
+            option for option, used in [
+                ("-e", args.engine != "search"),
+                ("-bc", args.bin_cache is not None),
+                ("-w", args.workers > 1),
+                ("-d", args.decoys > 0),
+                ("-b", args.bootstrap > 0),
+                ("-mk", args.matches > 0),
+                ("-m5", args.top5 == 1),
+            ] if used
+        ]
+        if ignored:
+            parser.error("{0} cannot be used with -ts --tolerances".format(", ".join(ignored)))
     return args
 
 
-def read_exp_PMF(input_PMF, mass_range):
-    """reads in the experimental PMF text file with m/z values"""
-    # read in txt file of PMF values from data
-    dtype = {"MZ": "float32", "intensity": "float32"}
-    act_peaks_df = pd.read_table(
-        input_PMF, sep="\t", header=None, names=["MZ", "intensity"], dtype=dtype
+def parse_serve_args(argv):
+    description = """Runs compare_score as a service. The theoretical peptides are read
+    once and peak lists are scored when they are sent to the service (POST /score)
+    on a local port or Unix socket. The ranked species are returned as JSON."""
+
+    parser = argparse.ArgumentParser(prog="compare_score serve", description=description)
+    parser.add_argument(
+        "-it",
+        "--inputTheor",
+        help="""the folder that contains the theoretical peptides csv files to compare against PMF.
+        Can also be a .npz theoretical library compiled with build_library""",
+        type=theor_test,
+        required=True,
     )
+    parser.add_argument(
+        "-t",
+        "--threshold",
+        help="""The default threshold for matches, a request can give a different threshold.
+        Default is 0.2 Da""",
+        default=0.2,
+        type=float,
+    )
+    parser.add_argument(
+        "-mr",
+        "--mass_range",
+        help="""The mass (m/z) range within which a match can occur. Default is (800,3500)""",
+        default=(800, 3500),
+        type=range_test
+    )
+    parser.add_argument(
+        "-e",
+        "--engine",
+        help="""How the PMF is compared to the species (see compare_score -h). Default is 'index'""",
+        default="index",
+        choices=["search", "index", "bitmap"],
+    )
+    parser.add_argument(
+        "-bc",
+        "--bin_cache",
+        help="""Folder to save the bins of the 'bitmap' engine in, so later runs with the same
+        library, threshold and mass range reuse them. The bins are not saved if not given""",
+        type=directory_test,
+    )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        help="""The number of processes used by the 'search' engine. Default is 1""",
+        default=1,
+        type=workers_test,
+    )
+    parser.add_argument(
+        "--host",
+        help="The address the service listens on. Default is 127.0.0.1 (this computer only)",
+        default="127.0.0.1",
+    )
+    parser.add_argument(
+        "--port",
+        help="The port the service listens on. Default is 8000",
+        default=8000,
+        type=int,
+    )
+    parser.add_argument(
+        "--socket",
+        help="A Unix socket file to listen on instead of a port",
+        type=Path,
+    )
+    args = parser.parse_args(argv)
+    return args
+
+
+def pmf_samples(pmf_files):
+    """Lists the samples to score from the PMF files.
+    Each scan in a mzXML or mzML file is a sample.
+    Raises an error if two samples have the same name"""
+    from casi.compare_peptides.read_spectra import is_spectrum_file, scan_offsets
+
+    samples = []
+    for pmf in pmf_files:
+        if not is_spectrum_file(pmf):
+            samples.append(Sample(pmf.stem, pmf, None))
+            continue
+        offsets = scan_offsets(pmf)
+        for scan_id, offset in offsets.items():
+            name = pmf.stem
+            if len(offsets) > 1:
+                name = "{0}_{1}".format(pmf.stem, re.sub(r"\W+", "_", scan_id))
+            samples.append(Sample(name, pmf, offset))
+
+    # the results file and summary row of each sample are named after it
+    names = {}
+    for sample in samples:
+        names.setdefault(sample.name, []).append(str(sample.path))
+    duplicates = [
+        "{0} ({1})".format(name, ", ".join(paths))
+        for name, paths in names.items() if len(paths) > 1
+    ]
+    if duplicates:
+        raise Exception(
+            "More than one PMF has the same name, rename them or score them separately: {0}".format(
+                "; ".join(duplicates)
+            )
+        )
+    return samples
+
+
+def batch_mode(args, samples):
+    """Batch mode (a results file for each sample and a summary) is used
+    for -ib, even if it finds one file, and for a mzXML/mzML file with
+    more than one scan"""
+    return args.inputBatch is not None or len(samples) > 1
+
+
+def read_exp_PMF(input_PMF, mass_range, offset=None, peak_settings=PeakSettings()):
+    """reads in the experimental PMF text file with m/z values.
+    mzXML and mzML files are also read, offset is the byte offset
+    of the scan to read (the first scan if None).
+    Peaks are picked from profile spectra with peak_settings"""
+    import pandas as pd
+    from casi.compare_peptides.read_spectra import is_spectrum_file, read_spectrum
+
+    dtype = {"MZ": "float32", "intensity": "float32"}
+    if is_spectrum_file(input_PMF):
+        from casi.compare_peptides.peak_picking import is_profile, pick_peaks
+
+        spectrum = read_spectrum(input_PMF, offset)
+        mz, intensity = spectrum.mz, spectrum.intensity
+        profile = spectrum.centroided is False
+        if spectrum.centroided is None:
+            profile = is_profile(mz)
+        if profile:
+            mz, intensity = pick_peaks(mz, intensity, peak_settings)
+            print(
+                "Picked {0} peaks from profile scan {1} of {2}".format(
+                    len(mz), spectrum.scan_id, input_PMF.name
+                )
+            )
+        act_peaks_df = pd.DataFrame({"MZ": mz, "intensity": intensity}).astype(dtype)
+    else:
+        # read in txt file of PMF values from data
+        act_peaks_df = pd.read_table(
+            input_PMF, sep="\t", header=None, names=["MZ", "intensity"], dtype=dtype
+        )
+    return filter_mass_range(act_peaks_df, mass_range)
+
+
+def filter_mass_range(act_peaks_df, mass_range):
+    """Keeps the experimental peaks within the mass range
+    and counts the peaks"""
     act_peaks_df = act_peaks_df[
         act_peaks_df["MZ"].between(*mass_range)
         ].reset_index(drop=True)
@@ -153,143 +537,296 @@ def read_exp_PMF(input_PMF, mass_range):
     return act_peaks_df, total_peaks
 
 
-def read_theor_csv(input_theor_path, mass_range):
-    """reads in all the csv files theoretical peptide m/z values
-    and assigns all as dataframes to a list"""
-    # get all csv files
-    csv_files = input_theor_path.glob("*.csv")
-
-    # read in all csvs of theoretical peptide peaks
-    dtype = {
-        "mass1": "float32",
-        "GENUS": "category",
-        "SPECIES": "category",
-        "pep_seq": "category",
-    }
-    usecols = [
-        "mass1",
-        "genus",
-        "species",
-        "subfamily",
-        "family",
-        "order",
-        "pep_seq",
-        "pep_start",
-        "pep_end",
-        "hyd_count",
-        "deam_count",
-        "missed_cleaves",
-    ]
-    theor_peaks_df_list = []
-    for csv in csv_files:
-        theor_peaks_df = pd.read_csv(csv, sep=",", dtype=dtype, usecols=usecols)
-        theor_peaks_df = theor_peaks_df[
-            theor_peaks_df["mass1"].between(*mass_range)
-        ].reset_index(drop=True)
-        theor_peaks_df_list.append(theor_peaks_df)
-    return theor_peaks_df_list
-
-
 def compare(theor_peaks, act_peaks, threshold):
     """Function does the comparison between one set of theoretical peptides
     and the PMF within a certain allowance theor_peaks are the
     theoretical peaks act_peaks are the actual peaks from PMF"""
-    # creates columns that are the same in each
-    # can then be merged
-    act_peaks["join"] = 1
-    theor_peaks["join"] = 1
-
-    # generating allowance for comparison
-    # with theoretical peaks
-    act_peaks["MZ_plus"] = act_peaks["MZ"] + threshold
-    act_peaks["MZ_minus"] = act_peaks["MZ"] - threshold
-
-    # merges the datasets so we have all the data
-    # then filters where there is a MATCH within the tolerance
-    # number of rows left will be number of matches
-    merged_df = act_peaks.merge(theor_peaks, how="outer", on=["join"])
-    merged_df = merged_df.loc[
-        (merged_df["mass1"] >= merged_df["MZ_minus"])
-        & (merged_df["mass1"] <= merged_df["MZ_plus"])
-    ]
+    from casi.compare_peptides.match_peaks import sort_masses, match_peaks, matches_frame
 
-    # remove duplicates if MZ value has matched more than once
-    matches_df = merged_df.drop_duplicates(subset=["MZ"])
+    # theoretical peaks must be sorted by m/z for the binary search
+    theor_peaks = sort_masses(theor_peaks)
+
+    # finds the theoretical peaks within the threshold
+    # of each experimental peak. If an experimental MZ value
+    # matches more than once only the first match is kept
+    peak_rows, theor_labels = match_peaks(theor_peaks, act_peaks, threshold)
+    matches_df = matches_frame(theor_peaks, act_peaks, peak_rows, theor_labels)
 
     # assigns number of matches to count
     match_count = matches_df.shape[0]
+    final_df = taxon_result(theor_peaks, match_count)
+    return (final_df, matches_df, match_count)
+
+
+def count_matches(theor_peaks, act_peaks, threshold):
+    """Same as compare but only counts the matches,
+    the matches df is not created"""
+    from casi.compare_peptides.match_peaks import sort_masses, match_peaks
+
+    theor_peaks = sort_masses(theor_peaks)
+    peak_rows, _ = match_peaks(theor_peaks, act_peaks, threshold)
+    match_count = len(peak_rows)
+    final_df = taxon_result(theor_peaks, match_count)
+    return (final_df, match_count)
+
+
+def taxon_result(theor_peaks, match_count):
+    """Combines the number of matches with the taxon
+    information to identify which species it is"""
+    import pandas as pd
 
     # turns match results to a df
     result_df = pd.DataFrame([match_count], columns=["Match"])
-
-    # combines with the taxon information to identify which species it is
-    taxon_df = theor_peaks.loc[
-        [0], ["species", "genus", "subfamily", "family", "order"]
-    ]
+    taxon_df = theor_peaks[
+        ["species", "genus", "subfamily", "family", "order"]
+    ].iloc[[0]].reset_index(drop=True)
     final_df = pd.concat([taxon_df, result_df], axis=1)
-    return (final_df, matches_df, match_count)
+    return final_df
 
 
-def peaks_comparison(theor_peaks_list, act_peaks_df, thresh, total_peaks, output):
-    """Reads in the theoretical peaks and actual peaks
-    and runs compare function organises correct output"""
+def search_comparison(theor_peaks_list, act_peaks_df, thresh, engine, top_k=TOP_SPECIES):
+    """Runs the count_matches function for each species in turn
+    (or in the process pool) and combines the results.
+    Only the positions of the top_k species are kept"""
+    import pandas as pd
+    from casi.compare_peptides.score_pool import pool_compare
+    from casi.compare_peptides.top_species import push_top, top_positions
+
+    if engine.pool is not None:
+        compare_results = pool_compare(
+            engine.pool, engine.workers, count_matches, len(theor_peaks_list), act_peaks_df, thresh
+        )
+    else:
+        compare_results = (
+            count_matches(theor_peaks, act_peaks_df, thresh) for theor_peaks in theor_peaks_list
+        )
+
     results_list = []
-    matches_dict = {}
-    for theor_peaks in theor_peaks_list:
-        # run the compare function
-        result_df, matches_df, match_count = compare(theor_peaks, act_peaks_df, thresh)
+    top_heap = []
+    # results are in the same order as theor_peaks_list
+    for position, (result_df, match_count) in enumerate(compare_results):
         # add all results to a list
         results_list.append(result_df)
-        # adds all the matches df to a dictionary
-        # match count is key
-        # value is the df of all the matches
-        matches_dict[match_count] = matches_df
+        push_top(top_heap, top_k, match_count, position)
 
     # put all results in one dataframe
     match_results_df = pd.concat(results_list)
+    return match_results_df, top_positions(top_heap)
+
+
+def index_comparison(theor_peaks_list, act_peaks_df, thresh, engine, top_k=TOP_SPECIES):
+    """Counts the matches for all species in one pass over the
+    PMF peaks with the mass index (or bin index).
+    Returns the positions of the top_k species"""
+    from casi.compare_peptides.mass_index import species_match_counts
+    from casi.compare_peptides.bin_index import bin_match_counts
+    from casi.compare_peptides.top_species import top_count_positions
+
+    exp_mz = act_peaks_df["MZ"].to_numpy()
+    if engine.name == "bitmap":
+        match_counts = bin_match_counts(engine.bin_index, engine.mass_index, exp_mz)
+    else:
+        match_counts = species_match_counts(engine.mass_index, exp_mz, thresh)
+    match_results_df = engine.mass_index.taxon_df.copy()
+    match_results_df["Match"] = match_counts
+    return match_results_df, top_count_positions(match_counts, top_k)
+
+
+def rank_species(
+    theor_peaks_list,
+    act_peaks_df,
+    thresh,
+    total_peaks,
+    engine=Engine(),
+    top_k=TOP_SPECIES,
+    decoys=None,
+    bootstrap=None,
+):
+    """Compares the actual peaks to every species and ranks
+    the species by the number of matches. Species with the same
+    number of matches stay in the theoretical peptides list order.
+    engine decides how the species are compared.
+    Also returns the positions of the top_k species in
+    theor_peaks_list (the first top_k rows of the results).
+    If decoys (DecoySettings) is given the significance of the
+    match counts is added and if bootstrap (BootstrapSettings) is
+    given how often each species is top"""
+    with profile_stage("compare"):
+        if engine.name in ("index", "bitmap"):
+            match_results_df, top_species = index_comparison(
+                theor_peaks_list, act_peaks_df, thresh, engine, top_k
+            )
+        else:
+            match_results_df, top_species = search_comparison(
+                theor_peaks_list, act_peaks_df, thresh, engine, top_k
+            )
+
     match_results_df["Maximum Possible"] = total_peaks
-    match_results_df = match_results_df.sort_values(by=["Match"], ascending=False)
-    match_results_df = match_results_df.reset_index(drop=True)
+    if decoys is not None:
+        with profile_stage("decoys"):
+            add_significance(match_results_df, act_peaks_df, thresh, engine, decoys)
+    if bootstrap is not None:
+        from casi.compare_peptides.bootstrap_scores import bootstrap_top
+
+        with profile_stage("bootstrap"):
+            match_results_df["Bootstrap Top"] = bootstrap_top(
+                engine.mass_index, act_peaks_df["MZ"].to_numpy(), thresh, bootstrap
+            )
+    with profile_stage("rank"):
+        match_results_df = sort_results(match_results_df)
+    return match_results_df, top_species
+
+
+def sort_results(match_results_df, match_column="Match"):
+    """Orders the species by the number of matches, species with
+    the same number of matches stay in the same order"""
+    match_results_df = match_results_df.sort_values(
+        by=[match_column], ascending=False, kind="stable"
+    )
+    return match_results_df.reset_index(drop=True)
+
+
+def add_significance(match_results_df, act_peaks_df, thresh, engine, decoys):
+    """Scores the decoy peak lists with the mass index and adds
+    the significance columns to the results (in species order)"""
+    from casi.compare_peptides.decoy_scores import decoy_significance
+
+    significance = decoy_significance(
+        engine.mass_index,
+        act_peaks_df["MZ"].to_numpy(),
+        match_results_df["Match"].to_numpy(),
+        thresh,
+        decoys,
+    )
+    match_results_df["Decoy Mean"] = significance.decoy_mean
+    match_results_df["Decoy SD"] = significance.decoy_sd
+    match_results_df["Z-score"] = significance.z_score
+    match_results_df["p-value"] = significance.p_value
+
+
+def peaks_comparison(
+    theor_peaks_list,
+    act_peaks_df,
+    thresh,
+    total_peaks,
+    output,
+    engine=Engine(),
+    decoys=None,
+    bootstrap=None,
+    top_k=TOP_SPECIES,
+):
+    """Reads in the theoretical peaks and actual peaks
+    and runs compare function organises correct output.
+    engine decides how the species are compared.
+    decoys (DecoySettings) adds the significance of the matches
+    and bootstrap (BootstrapSettings) how often each species is top.
+    Also returns the positions of the top_k species"""
+    match_results_df, top_species = rank_species(
+        theor_peaks_list,
+        act_peaks_df,
+        thresh,
+        total_peaks,
+        engine,
+        top_k,
+        decoys,
+        bootstrap,
+    )
 
     # outputs the top matches results
     # and saves to csv
-    final_output_df = match_results_df.head(10)
-    print("RESULTS:")
-    print(final_output_df.to_markdown())
-    match_results_df.to_csv(output)
-    return matches_dict
-
-
-def top_5(match_dict, option_match, output):
-    """Saves top 5 matches_df as xlxs to same output
-    location as matches if option inputted in command"""
-    if option_match == 1:
-        top_5_match = sorted(match_dict.keys(), reverse=True)[:5]
-        output_parent = output.parent
-        top5_path = output_parent / r"top5_matches.xlsx"
-        writer = pd.ExcelWriter(top5_path, engine="xlsxwriter")
-
-        count = 0
-        for match in top_5_match:
-            count += 1
-            df = match_dict[match]
-            df = df.drop(columns=["join", "MZ_plus", "MZ_minus"])
-            df = df.rename(
-                columns={
-                    "MZ": "Exp MZ",
-                    "intensity": "Exp intensity",
-                    "mass1": "Theor MZ",
-                }
-            )
-            df = df.reset_index(drop=True)
-            df.to_excel(writer, sheet_name="match{0}".format(count))
+    with profile_stage("export"):
+        final_output_df = match_results_df.head(10)
+        print("RESULTS:")
+        print(final_output_df.to_markdown())
+        match_results_df.to_csv(output)
+    return match_results_df, top_species
 
-        writer.close()
-        print("\n")
-        print(
-            "5 species with highest matches m\\z values for all matches have been outputted. File called:"
+
+def batch_summary(sample_results, match_column="Match"):
+    """Combines the top match of each PMF in a batch into one
+    summary dataframe. sample_results is a dictionary with the
+    sample name as key and match results dataframe as value.
+    match_column is the number of matches the results are ordered by"""
+    import pandas as pd
+
+    summary_list = []
+    for sample, match_results_df in sample_results.items():
+        top_df = match_results_df.head(1).copy()
+        # second highest match helps to see if the top match is clear
+        if len(match_results_df) > 1:
+            top_df["Second Match"] = match_results_df.loc[1, match_column]
+        else:
+            top_df["Second Match"] = None
+        top_df.insert(0, "Sample", sample)
+        summary_list.append(top_df)
+    summary_df = pd.concat(summary_list).reset_index(drop=True)
+    return summary_df
+
+
+def score_batch(
+    samples,
+    theor_peaks_list,
+    thresh,
+    mass_range,
+    output,
+    match_export=None,
+    engine=Engine(),
+    peak_settings=PeakSettings(),
+    decoys=None,
+    bootstrap=None,
+):
+    """Scores every PMF sample in the batch against the theoretical peaks
+    that have already been read in. Saves a results file for each
+    PMF and a summary file of the top match for every PMF.
+    Each sample is read when it is scored and its matches
+    are added to match_export (MatchExport) if given"""
+    top_k = 0 if match_export is None else match_export.top_k
+    sample_results = {}
+    for sample in samples:
+        print("\nSample: {0}".format(sample.name))
+        with profile_stage("read PMF"):
+            actual_peaks_df, total_peaks = read_exp_PMF(
+                sample.path, mass_range, sample.offset, peak_settings
+            )
+        sample_output = output.parent / "{0}_{1}".format(sample.name, output.name)
+        match_results_df, top_species = peaks_comparison(
+            theor_peaks_list,
+            actual_peaks_df,
+            thresh,
+            total_peaks,
+            sample_output,
+            engine,
+            decoys,
+            bootstrap,
+            top_k,
         )
-        print("'top5_matches.xlsx'")
+        if match_export is not None:
+            export_matches(
+                match_export, sample.name, top_species, theor_peaks_list, actual_peaks_df, thresh
+            )
+        sample_results[sample.name] = match_results_df
+        add_sample(sample.name, match_results_df, total_peaks)
+
+    summary_df = batch_summary(sample_results)
+    summary_df.to_csv(output)
+    print("\nBATCH SUMMARY:")
+    print(summary_df.to_markdown())
+    return summary_df
+
+
+def export_matches(match_export, sample, top_species, theor_peaks_list, act_peaks_df, thresh):
+    """Finds the matches again for the top species (positions in
+    theor_peaks_list, best first) and appends them to the match file"""
+    import pandas as pd
+    from casi.compare_peptides.match_export import match_rows
+
+    with profile_stage("export matches"):
+        rows = [
+            match_rows(sample, rank, compare(theor_peaks_list[position], act_peaks_df, thresh)[1])
+            for rank, position in enumerate(top_species, 1)
+        ]
+        if rows:
+            match_export.write(pd.concat(rows, ignore_index=True))
 
 
 def main(argv=sys.argv[1:]):
@@ -298,28 +835,330 @@ def main(argv=sys.argv[1:]):
 Program: Compare_NCBI.py
 #####################""")
 
+    # compare_score serve runs the scoring service
+    if argv[:1] == ["serve"]:
+        serve(parse_serve_args(argv[1:]))
+        return
+
     args = parse_args(argv)
 
-    input_PMF = Path(args.inputPMF)
-    # reads in experimental PMF csv
-    actual_peaks_df, total_peaks = read_exp_PMF(input_PMF, args.mass_range)
+    # time and memory of each stage if --profile
+    # the manifest only needs the times
+    profiling = args.profile or args.profile_dir is not None
+    recording = args.manifest is not None or args.prometheus is not None
+    if recording:
+        start_manifest("compare_score", argv)
+        add_input(args.inputTheor)
+        for pmf in args.inputBatch or [args.inputPMF]:
+            add_input(pmf)
+        add_rate("spectra_per_second", "samples", SCORING_STAGES)
+        add_rate("peaks_per_second", "peaks", SCORING_STAGES)
+    if profiling or recording:
+        enable_profile(args.profile_dir, trace_memory=profiling)
+    success = False
+    try:
+        run_compare(args)
+        success = True
+    finally:
+        profile = report_profile(show=profiling)
+        finish_manifest(profile, success, args.manifest, args.prometheus)
+
+
+def run_compare(args):
+    """Reads the theoretical peptides and scores the PMF (or batch)
+    with the engine chosen in the arguments"""
+    from casi.compare_peptides.theor_library import read_theor_library
+    from casi.compare_peptides.mass_index import build_mass_index
+    from casi.compare_peptides.tolerance_sweep import tolerance_label
 
     input_theor_folder = args.inputTheor
-    # reads all csvs for species theoretical PMFs
-    theoretical_peaks_df_list = read_theor_csv(input_theor_folder, args.mass_range)
+    # reads all csvs (or the compiled library) for species theoretical PMFs
+    with profile_stage("read library"):
+        theoretical_peaks_df_list = read_theor_library(input_theor_folder, args.mass_range)
+    add_count("species", len(theoretical_peaks_df_list))
 
     output_path = Path(args.output)
+
+    # the tolerance sweep always uses the mass index
+    if args.tolerances is not None:
+        print("\nTolerances for match are {0}".format(
+            ", ".join(tolerance_label(tolerance) for tolerance in args.tolerances)
+        ))
+        with profile_stage("build index"):
+            mass_index = build_mass_index(theoretical_peaks_df_list)
+        run_sweep(args, mass_index, output_path)
+        return
+    print("\nThreshold for match is +- {0}".format(args.threshold))
+
+    if args.engine in ("index", "bitmap"):
+        engine = index_engine(args, theoretical_peaks_df_list)
+        run_scoring(args, theoretical_peaks_df_list, output_path, engine)
+        return
+
+    # the decoys and bootstrap are scored with the mass index
+    mass_index = None
+    if args.decoys > 0 or args.bootstrap > 0:
+        with profile_stage("build index"):
+            mass_index = build_mass_index(theoretical_peaks_df_list)
+    # species are compared in a process pool if more than one worker
+    if args.workers > 1:
+        from casi.compare_peptides.score_pool import create_pool
+
+        print("Comparing with {0} worker processes".format(args.workers))
+        with create_pool(theoretical_peaks_df_list, args.workers) as pool:
+            engine = Engine("search", pool, args.workers, mass_index)
+            run_scoring(args, theoretical_peaks_df_list, output_path, engine)
+    else:
+        engine = Engine("search", mass_index=mass_index)
+        run_scoring(args, theoretical_peaks_df_list, output_path, engine)
+
+
+def serve(args):
+    """Reads the theoretical peaks once and scores the
+    peak lists sent to the service"""
+    import pandas as pd
+    from casi.compare_peptides.theor_library import read_theor_library
+    from casi.compare_peptides.score_pool import create_pool
+    from casi.compare_peptides.score_service import create_server, run_server
+
+    theoretical_peaks_df_list = read_theor_library(args.inputTheor, args.mass_range)
+    dtype = {"MZ": "float32", "intensity": "float32"}
+
+    def score_peaks(mz, intensity, threshold):
+        """Ranks the species for a peak list sent to the service"""
+        if threshold is None:
+            threshold = args.threshold
+        request_engine = engine
+        # the bins are only for the default threshold
+        if engine.name == "bitmap" and threshold != args.threshold:
+            request_engine = Engine("index", mass_index=engine.mass_index)
+        act_peaks_df = pd.DataFrame({"MZ": mz, "intensity": intensity}).astype(dtype)
+        act_peaks_df, total_peaks = filter_mass_range(act_peaks_df, args.mass_range)
+        match_results_df, _ = rank_species(
+            theoretical_peaks_df_list,
+            act_peaks_df,
+            threshold,
+            total_peaks,
+            request_engine,
+        )
+        return match_results_df
+
+    server = create_server(
+        score_peaks, len(theoretical_peaks_df_list), args.host, args.port, args.socket
+    )
+    if args.engine in ("index", "bitmap"):
+        engine = index_engine(args, theoretical_peaks_df_list)
+        run_server(server, args.socket)
+    elif args.workers > 1:
+        with create_pool(theoretical_peaks_df_list, args.workers) as pool:
+            engine = Engine("search", pool, args.workers)
+            run_server(server, args.socket)
+    else:
+        engine = Engine()
+        run_server(server, args.socket)
+
+
+def index_engine(args, theoretical_peaks_df_list):
+    """Builds the index (or bitmap) engine for the theoretical peaks"""
+    from casi.compare_peptides.mass_index import build_mass_index
+    from casi.compare_peptides.bin_index import load_bin_index
+
+    # index of all species m/z values built once
+    with profile_stage("build index"):
+        mass_index = build_mass_index(theoretical_peaks_df_list)
+        bin_index = None
+        if args.engine == "bitmap":
+            # bins are saved for the library and threshold and reused
+            # if a bin cache folder is given
+            bin_index = load_bin_index(
+                mass_index,
+                args.threshold,
+                args.mass_range,
+                bin_index_path(args.bin_cache, args.inputTheor, args.threshold),
+            )
+    engine = Engine(args.engine, mass_index=mass_index, bin_index=bin_index)
+    return engine
+
+
+def bin_index_path(bin_cache, input_theor, threshold):
+    """The bin index file in the bin cache folder, named after the
+    library file or theoretical peptides folder. None (the bins are
+    not saved) if there is no bin cache folder"""
+    if bin_cache is None:
+        return None
+    name = input_theor.name if input_theor.is_dir() else input_theor.stem
+    return bin_cache / "{0}_bins_t{1}.npz".format(name, threshold)
+
+
+def sweep_comparison(mass_index, act_peaks_df, tolerances, total_peaks, output):
+    """Counts the matches for every species at every tolerance
+    in one pass and saves the results ordered by the first tolerance"""
+    from casi.compare_peptides.tolerance_sweep import tolerance_label, sweep_match_counts
+
+    with profile_stage("compare"):
+        match_counts = sweep_match_counts(mass_index, act_peaks_df["MZ"].to_numpy(), tolerances)
+    match_results_df = mass_index.taxon_df.copy()
+    match_columns = []
+    for tolerance, counts in zip(tolerances, match_counts):
+        match_columns.append("Match {0}".format(tolerance_label(tolerance)))
+        match_results_df[match_columns[-1]] = counts
+    match_results_df["Maximum Possible"] = total_peaks
+    with profile_stage("rank"):
+        match_results_df = sort_results(match_results_df, match_columns[0])
+
+    with profile_stage("export"):
+        final_output_df = match_results_df.head(10)
+        print("RESULTS:")
+        print(final_output_df.to_markdown())
+        match_results_df.to_csv(output)
+    return match_results_df, match_columns[0]
+
+
+def run_sweep(args, mass_index, output_path):
+    """Scores the single PMF or batch of PMFs at every tolerance"""
+    peak_settings = PeakSettings(snr=args.snr)
+    if args.inputBatch is not None:
+        samples = pmf_samples(args.inputBatch)
+    else:
+        samples = pmf_samples([Path(args.inputPMF)])
+
+    batch = batch_mode(args, samples)
+    sample_results = {}
+    for sample in samples:
+        sample_output = output_path
+        if batch:
+            print("\nSample: {0}".format(sample.name))
+            sample_output = output_path.parent / "{0}_{1}".format(sample.name, output_path.name)
+        with profile_stage("read PMF"):
+            actual_peaks_df, total_peaks = read_exp_PMF(
+                sample.path, args.mass_range, sample.offset, peak_settings
+            )
+        match_results_df, match_column = sweep_comparison(
+            mass_index, actual_peaks_df, args.tolerances, total_peaks, sample_output
+        )
+        sample_results[sample.name] = match_results_df
+        add_sample(sample.name, match_results_df, total_peaks, match_column)
+
+    if batch:
+        summary_df = batch_summary(sample_results, match_column)
+        summary_df.to_csv(output_path)
+        print("\nBATCH SUMMARY:")
+        print(summary_df.to_markdown())
+
+
+def run_scoring(args, theoretical_peaks_df_list, output_path, engine):
+    """Scores the single PMF or batch of PMFs and saves the outputs"""
+    from casi.compare_peptides.decoy_scores import DecoySettings
+    from casi.compare_peptides.bootstrap_scores import BootstrapSettings
+    from casi.compare_peptides.match_export import MatchExport, export_path
+
     threshold = args.threshold
-    print("\nThreshold for match is +- {0}".format(threshold))
+    peak_settings = PeakSettings(snr=args.snr)
+    decoys = None
+    if args.decoys > 0:
+        decoys = DecoySettings(args.decoys, args.decoy_type, args.mass_range, args.seed)
+        print("Significance from {0} {1} decoys".format(args.decoys, args.decoy_type))
+    bootstrap = None
+    if args.bootstrap > 0:
+        bootstrap = BootstrapSettings(args.bootstrap, args.seed)
+        print("Stability of the top species from {0} bootstrap replicates".format(args.bootstrap))
+
+    # batch mode scores every PMF with the theoretical peaks read once
+    # a mzXML/mzML file with more than one scan is also scored as a batch
+    if args.inputBatch is not None:
+        samples = pmf_samples(args.inputBatch)
+    else:
+        samples = pmf_samples([Path(args.inputPMF)])
+
+    # matches of the top species are written as each PMF is scored
+    top_k = max(args.matches, TOP_SPECIES if args.top5 == 1 else 0)
+    match_export = None
+    if top_k > 0:
+        match_export = MatchExport(
+            export_path(output_path, args.match_format), args.match_format, top_k
+        )
+
+    try:
+        if batch_mode(args, samples):
+            score_batch(
+                samples,
+                theoretical_peaks_df_list,
+                threshold,
+                args.mass_range,
+                output_path,
+                match_export,
+                engine,
+                peak_settings,
+                decoys,
+                bootstrap,
+            )
+        else:
+            score_sample(
+                samples[0],
+                theoretical_peaks_df_list,
+                threshold,
+                args.mass_range,
+                output_path,
+                match_export,
+                engine,
+                peak_settings,
+                decoys,
+                bootstrap,
+            )
+    finally:
+        if match_export is not None:
+            match_export.close()
+
+    if match_export is not None:
+        print("\n")
+        print(
+            "m\\z values of the matches for the top {0} species have been outputted. File called:".format(top_k)
+        )
+        print("'{0}'".format(match_export.path.name))
+
+
+def score_sample(
+    sample,
+    theor_peaks_list,
+    thresh,
+    mass_range,
+    output,
+    match_export=None,
+    engine=Engine(),
+    peak_settings=PeakSettings(),
+    decoys=None,
+    bootstrap=None,
+):
+    """Scores a single PMF sample and saves the results
+    (and the matches of the top species if match_export is given)"""
+    top_k = 0 if match_export is None else match_export.top_k
+    # reads in experimental PMF csv
+    with profile_stage("read PMF"):
+        actual_peaks_df, total_peaks = read_exp_PMF(
+            sample.path, mass_range, sample.offset, peak_settings
+        )
+
     # compares experimental and theoretical PMFs withins a threshold
-    matches_dictionary = peaks_comparison(
-        theoretical_peaks_df_list, actual_peaks_df, threshold, total_peaks, output_path
+    match_results_df, top_species = peaks_comparison(
+        theor_peaks_list,
+        actual_peaks_df,
+        thresh,
+        total_peaks,
+        output,
+        engine,
+        decoys,
+        bootstrap,
+        top_k,
     )
 
-    match_opt = args.top5
     # if required outputs the experimental and theoretical peaks that matches
-    # for the top 5 matches
-    top_5(matches_dictionary, match_opt, output_path)
+    # for the top species
+    if match_export is not None:
+        export_matches(
+            match_export, sample.name, top_species, theor_peaks_list, actual_peaks_df, thresh
+        )
+    add_sample(sample.name, match_results_df, total_peaks)
+    return match_results_df
 
 
 if __name__ == "__main__":
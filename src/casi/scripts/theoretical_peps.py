@@ -16,13 +16,16 @@ import sys
 from pathlib import Path
 from importlib.resources import files
 
-import pandas as pd
+# the modules of each step are imported when the step runs, so --help is
+# fast and pandas, taxopy and tqdm are only loaded by the steps
+# that use them
+from casi.stage_profile import enable_profile, profile_stage, report_profile
+from casi.run_manifest import add_count, add_input, add_rate, finish_manifest, start_manifest
+from casi.stage_cache import StageCache, fingerprint
 
-from casi.theoretical_peptides.sort_sequences.fasta_col_clean import run_clean_col
-from casi.theoretical_peptides.sort_sequences.merge_cola1a2 import col1a1a2_combine
-from casi.theoretical_peptides.generate_peptides.cleave_all_sequences import collagen_peptide_mass
-from casi.theoretical_peptides.filter_peptides.lcmsms_masses import mass_lcsmsms
-from casi.theoretical_peptides.filter_peptides.filter_peptides import integrate
+# the steps that can be resumed at the species where a run stopped
+STEP_4 = "STEP 4 collagen_peptide_mass"
+STEP_6 = "STEP 6 integrate"
 
 
 def file_test(arg):
@@ -41,7 +44,38 @@ def directory_test(arg):
         return p
     else:
         raise Exception("The directory does not exist: {0}".format(p))
-    
+
+
+def output_test(arg):
+    """Test if directory of new output file exists"""
+    p = Path(arg)
+    par = p.parent
+    if par.is_dir():
+        return p
+    else:
+        raise Exception(
+            "The directory of the new output file does not exist {0}".format(p)
+        )
+
+
+def workers_test(arg):
+    """Test the number of worker processes is at least 1"""
+    arg = int(arg)
+    if arg >= 1:
+        return arg
+    else:
+        raise Exception("The input -w --workers should be an integer of 1 or more")
+
+
+def memo_size_test(arg):
+    """Test the peptide memo size is 0 or more"""
+    arg = int(arg)
+    if arg >= 0:
+        return arg
+    else:
+        raise Exception("The input --memo_size should be an integer of 0 or more")
+
+
 def import_lcsmsms(lcmsms_arg):
     """Imports the default Mascot LC-MS/MS output csv files from the package.
     if the user has defined a directory path, this will be used instead
@@ -111,46 +145,238 @@ def parse_args(argv):
         default="mammals",
         choices=["birds", "mammals"]
     )
-    args = parser.parse_args()  # parse arguments
+    parser.add_argument(
+        "-w",
+        "--workers",
+        help="""The number of processes used to digest the species in STEP 4.
+        The output files are the same as using one process. Default is 1""",
+        default=1,
+        type=workers_test
+    )
+    parser.add_argument(
+        "--memo_size",
+        help="""The most peptides kept in memory in STEP 4 so a peptide shared by
+        many species is only expanded into its PTM combinations once (in each process).
+        0 turns the memo off. Default is 100000 peptides""",
+        type=memo_size_test
+    )
+    parser.add_argument(
+        "--digest_cache",
+        help="""Folder to keep the STEP 4 digest of each COL1 sequence between runs.
+        Sequences already in the folder (same sequence and digest settings) are read
+        instead of digested again. The folder can be shared by runs at the same time.""",
+        type=Path
+    )
+    parser.add_argument(
+        "--resume",
+        help="""Continues STEP 4 and STEP 6 of a run that stopped from the species where
+        it stopped, if the inputs and settings are the same. Steps that finished with
+        the same inputs and settings are always skipped.""",
+        action="store_true"
+    )
+    parser.add_argument(
+        "--force",
+        help="""Runs every step, even if its outputs in the output folder are up to
+        date with its inputs and settings (e.g., to get the latest NCBI taxonomy in STEP 3).""",
+        action="store_true"
+    )
+    parser.add_argument(
+        "--profile",
+        help="""Prints the wall time, CPU time and peak memory of each step when the run
+        finishes. Memory tracing makes the run slower.""",
+        action="store_true"
+    )
+    parser.add_argument(
+        "--profile_dir",
+        help="""Folder to save a cProfile file for each step ('<step>.prof').
+        Also turns on --profile.""",
+        type=Path
+    )
+    parser.add_argument(
+        "--manifest",
+        help="""JSON file to save a record of the run: input file hashes, sequences
+        after each cleaning step, peptides generated and kept for each species,
+        the time of each step and peptides per second.""",
+        type=output_test
+    )
+    parser.add_argument(
+        "--prometheus",
+        help="""Prometheus textfile (e.g., casi_theoretical_peps.prom) to save the counts,
+        step times and throughput of the run for the node exporter.""",
+        type=output_test
+    )
+    args = parser.parse_args(argv)  # parse arguments
     return args
 
 
 def main(argv=sys.argv[1:]):
     args = parse_args(argv)
 
+    # time and memory of each step if --profile
+    # the manifest only needs the times
+    profiling = args.profile or args.profile_dir is not None
+    recording = args.manifest is not None or args.prometheus is not None
+    if recording:
+        start_manifest("theoretical_peps", argv)
+        add_input(args.inputa1)
+        add_input(args.inputa2)
+        add_input(import_lcsmsms(args.lcmsms))
+        add_rate("peptides_per_second", "peptides_generated", [STEP_4])
+        add_rate("species_per_second", "species_digested", [STEP_4])
+    if profiling or recording:
+        enable_profile(args.profile_dir, trace_memory=profiling)
+    success = False
+    try:
+        run_steps(args)
+        success = True
+    finally:
+        profile = report_profile(show=profiling)
+        finish_manifest(profile, success, args.manifest, args.prometheus)
+
+
+def run_step(stage_cache: StageCache,
+             stage: str,
+             inputs: list,
+             outputs: list,
+             run,
+             settings=None) -> bool:
+    """
+    Runs a step unless its outputs are up to date with its inputs and settings
+
+    args
+        stage_cache (StageCache): fingerprints of the steps in the output folder
+        stage (str): the step name
+        inputs (list): the input files and folders of the step
+        outputs (list): the output files and folders of the step
+        run (function): runs the step, called with the step fingerprint
+        settings (dict): settings that change the outputs, or a function that
+            returns them (so the modules it imports are part of the step)
+
+    returns
+        ran (bool): False if the step was skipped
+    """
+    with profile_stage(stage):
+        if callable(settings):
+            settings = settings()
+        stage_fingerprint = fingerprint(inputs, settings)
+        if stage_cache.up_to_date(stage, stage_fingerprint):
+            print("{0}: outputs are up to date, skipped".format(stage))
+            add_count("steps_skipped", 1)
+            return False
+        run(stage_fingerprint)
+        stage_cache.record(stage, stage_fingerprint, outputs)
+    return True
+
+
+def run_steps(args):
+    """Runs STEP 1 to STEP 6 of the pipeline, skipping steps that are up to date"""
+    # the import time of each step is part of the step profile
+    output_folder = Path(args.output)
+    stage_cache = StageCache(output_folder, force=args.force)
+    a1_clean = output_folder / "COL1A1_seqs_clean_NCBI.fasta"
+    a2_clean = output_folder / "COL1A2_seqs_clean_NCBI.fasta"
+    combined_fasta = output_folder / "COL1A1A2_combined_seqs_NCBI.fasta"
+    unfiltered_folder = output_folder / "unfiltered_peptides"
+    lcmsms_masses = output_folder / "lcmsms_masses.csv"
+    filtered_folder = output_folder / "filtered_peptides"
+
     # cleans the COL1A1 sequences provided
     print("STEP 1:")
     a1_file = Path(args.inputa1)
-    output_folder = Path(args.output)
-    run_clean_col(a1_file, output_folder, "COL1A1")
+
+    def clean_a1(stage_fingerprint):
+        from casi.theoretical_peptides.sort_sequences.fasta_col_clean import run_clean_col
+
+        run_clean_col(a1_file, output_folder, "COL1A1")
+
+    run_step(stage_cache, "STEP 1 clean COL1A1", [a1_file], [a1_clean], clean_a1)
 
     # cleans the COL1A2 sequences provided
     print("STEP 2:")
     class_input = str(args.species_class)
     a2_file = Path(args.inputa2)
-    run_clean_col(a2_file, output_folder, "COL1A2", class_input)
+
+    def clean_a2(stage_fingerprint):
+        from casi.theoretical_peptides.sort_sequences.fasta_col_clean import run_clean_col
+
+        run_clean_col(a2_file, output_folder, "COL1A2", class_input)
+
+    run_step(
+        stage_cache, "STEP 2 clean COL1A2", [a2_file], [a2_clean], clean_a2,
+        settings={"species_class": class_input},
+    )
 
     # Combines COLA1 and COL1A2 and adds taxonomic information
     # Outputs as Sequences/COL1A1A2_combined_seqs.fasta
     print("STEP 3:")
-    col1a1a2_combined = col1a1a2_combine(output_folder)
+    combined = {}
+
+    def combine(stage_fingerprint):
+        from casi.theoretical_peptides.sort_sequences.merge_cola1a2 import col1a1a2_combine
+
+        combined["sequences"] = col1a1a2_combine(output_folder)
+
+    ran = run_step(
+        stage_cache, "STEP 3 col1a1a2_combine", [a1_clean, a2_clean], [combined_fasta], combine
+    )
+    if not ran:
+        # the taxonomy is read from the combined fasta file of the earlier run
+        from casi.theoretical_peptides.sort_sequences.merge_cola1a2 import read_combined_fasta
+
+        combined["sequences"] = read_combined_fasta(combined_fasta)
 
     # Generates all possible theoretical peptides and their masses
     print("STEP 4:")
-    collagen_peptide_mass(col1a1a2_combined, output_folder)
+
+    def digest(stage_fingerprint):
+        from casi.theoretical_peptides.generate_peptides.cleave_all_sequences import (
+            collagen_peptide_mass,
+        )
+        from casi.theoretical_peptides.generate_peptides.cleave_mass import PEPTIDE_MEMO_SIZE
+
+        memo_size = PEPTIDE_MEMO_SIZE if args.memo_size is None else args.memo_size
+        with stage_cache.journal(STEP_4, stage_fingerprint, args.resume) as journal:
+            collagen_peptide_mass(
+                combined["sequences"], output_folder, args.workers, memo_size,
+                args.digest_cache, journal,
+            )
+
+    def settings():
+        # the digest settings are part of the STEP 4 fingerprint
+        from casi.theoretical_peptides.generate_peptides.digest_cache import digest_settings
+
+        return digest_settings("trypsin", 1)
+
+    run_step(stage_cache, STEP_4, [combined_fasta], [unfiltered_folder], digest, settings)
 
     # formatting possible LCMSMS masses into one document
     # used to then filter theoretical peptides
     print("Step 5:")
     lcmsms_dir = import_lcsmsms(args.lcmsms)
-    mass_lcsmsms(lcmsms_dir, output_folder)
+
+    def lcmsms(stage_fingerprint):
+        from casi.theoretical_peptides.filter_peptides.lcmsms_masses import mass_lcsmsms
+
+        mass_lcsmsms(lcmsms_dir, output_folder)
+
+    # only the csv files in the folder are read
+    lcmsms_files = sorted(lcmsms_dir.glob("*.csv"))
+    run_step(stage_cache, "STEP 5 mass_lcsmsms", lcmsms_files, [lcmsms_masses], lcmsms)
 
     # integrates the theoretical peptides generated
     # with the LCMSMS data
     # to generate final theoretical peptides
     print("STEP 6:")
-    output_folder = args.output
-    integrate(output_folder)
+
+    def filter_peptides(stage_fingerprint):
+        from casi.theoretical_peptides.filter_peptides.filter_peptides import integrate
+
+        with stage_cache.journal(STEP_6, stage_fingerprint, args.resume) as journal:
+            integrate(output_folder, journal)
+
+    run_step(
+        stage_cache, STEP_6, [unfiltered_folder, lcmsms_masses], [filtered_folder], filter_peptides
+    )
 
 
 if __name__ == "__main__":
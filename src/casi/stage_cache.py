@@ -0,0 +1,241 @@
+"""
+stage_cache.py
+
+Lets theoretical_peps skip a step when its outputs are already up to
+date, and resume STEP 4 and STEP 6 at the species where a run stopped.
+
+Each step has a fingerprint, the SHA-256 hash of:
+    * the content of its input files (not their names or times)
+    * its settings (e.g., birds or mammals, enzyme and PTM masses)
+    * the casi version
+When a step finishes its fingerprint and the hash of each output file
+are saved in '.casi_stages.json' in the output folder. The next run
+skips the step if the fingerprint is the same and every output file is
+still there and unchanged. The inputs of a step are the outputs of the
+steps before it, so a step is only run again if its inputs have really
+changed (e.g., a new LC-MS/MS folder only reruns STEP 5 and STEP 6).
+
+While STEP 4 and STEP 6 run, each species that is finished is written
+to a journal ('.casi_stages/<step>.jsonl' in the output folder). With
+--resume a step that did not finish skips the species in its journal,
+if the fingerprint is the same and their output files are unchanged.
+"""
+
+import sys
+import json
+import hashlib
+from pathlib import Path
+
+from casi import __version__
+from casi.run_manifest import file_hash, write_file
+
+STAGE_FILE = ".casi_stages.json"
+JOURNAL_FOLDER = ".casi_stages"
+
+
+def stage_files(paths: list) -> list:
+    """The files of the paths, with the files in each folder sorted"""
+    files = []
+    for path in paths:
+        path = Path(path)
+        if path.is_dir():
+            files.extend(sorted(p for p in path.rglob("*") if p.is_file()))
+        else:
+            files.append(path)
+    return files
+
+
+def fingerprint(inputs: list, settings: dict = None) -> str:
+    """
+    The SHA-256 hash of the content of the input files (or folders)
+    and the settings of a step
+
+    args
+        inputs (list): the input files and folders
+        settings (dict): settings that change the outputs (JSON types)
+
+    returns
+        fingerprint (str): the hash as hex
+    """
+    digest = hashlib.sha256()
+    digest.update(json.dumps(
+        {"version": __version__, "settings": settings or {}}, sort_keys=True
+    ).encode("utf-8"))
+    for path in inputs:
+        path = Path(path)
+        for input_file in stage_files([path]):
+            name = input_file.relative_to(path) if path.is_dir() else ""
+            digest.update("\n{0} {1}".format(name, file_hash(input_file)).encode("utf-8"))
+    return digest.hexdigest()
+
+
+class StageCache:
+    """
+    The fingerprints and outputs of the steps saved in an output folder.
+
+    args
+        output_folder (Path): the theoretical_peps output folder
+        force (bool): run every step even if it is up to date
+    """
+
+    def __init__(self, output_folder: Path, force: bool = False):
+        self.output_folder = Path(output_folder)
+        self.force = force
+        self.path = self.output_folder / STAGE_FILE
+        try:
+            self.stages = json.loads(self.path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            self.stages = {}
+
+    def relative_name(self, path: Path) -> str:
+        """The name of a file in the output folder"""
+        return Path(path).relative_to(self.output_folder).as_posix()
+
+    def outputs_unchanged(self, outputs: dict) -> bool:
+        """If every output file is there with the hash it was saved with"""
+        for name, output_hash in outputs.items():
+            output_file = self.output_folder / name
+            if not output_file.is_file() or file_hash(output_file) != output_hash:
+                return False
+        return True
+
+    def up_to_date(self, stage: str, stage_fingerprint: str) -> bool:
+        """If the step was run with the same fingerprint and its outputs are unchanged"""
+        record = self.stages.get(stage)
+        if self.force or record is None or record["fingerprint"] != stage_fingerprint:
+            return False
+        return self.outputs_unchanged(record["outputs"])
+
+    def record(self, stage: str, stage_fingerprint: str, outputs: list) -> None:
+        """
+        Saves the fingerprint and output hashes of a finished step
+        and removes its journal
+
+        args
+            stage (str): the step name
+            stage_fingerprint (str): the fingerprint from fingerprint
+            outputs (list): the output files and folders of the step
+        """
+        self.stages[stage] = {
+            "fingerprint": stage_fingerprint,
+            "outputs": {
+                self.relative_name(output_file): file_hash(output_file)
+                for output_file in stage_files(outputs)
+            },
+        }
+        write_file(self.path, json.dumps(self.stages, indent=2))
+        self.journal_path(stage).unlink(missing_ok=True)
+
+    def journal_path(self, stage: str) -> Path:
+        """The journal file of a step"""
+        return self.output_folder / JOURNAL_FOLDER / "{0}.jsonl".format(stage.replace(" ", "_"))
+
+    def journal(self, stage: str, stage_fingerprint: str, resume: bool = False):
+        """
+        Opens the journal of the species finished in a step
+
+        args
+            stage (str): the step name
+            stage_fingerprint (str): the fingerprint from fingerprint
+            resume (bool): keep the species of an earlier run with
+                the same fingerprint, otherwise start an empty journal
+
+        returns
+            journal (StageJournal): the journal
+        """
+        return StageJournal(self, self.journal_path(stage), stage_fingerprint, resume)
+
+
+class StageJournal:
+    """
+    The species finished in a step, one JSON line each, written as soon
+    as the species is finished so they are kept if the run stops.
+
+    args
+        cache (StageCache): the stage cache of the output folder
+        path (Path): the journal file
+        stage_fingerprint (str): the fingerprint of the step
+        resume (bool): keep the species of an earlier run with the same fingerprint
+    """
+
+    def __init__(self, cache: StageCache, path: Path, stage_fingerprint: str, resume: bool):
+        self.cache = cache
+        self.path = path
+        self.entries = {}
+        if resume:
+            self.entries = self._read(stage_fingerprint)
+        self.resumed = len(self.entries)
+        path.parent.mkdir(exist_ok=True)
+        # the journal is written again with only the entries kept
+        self._file = open(path, "w", encoding="utf-8")
+        self._write({"fingerprint": stage_fingerprint})
+        for entry in self.entries.values():
+            self._write(entry)
+
+    def _read(self, stage_fingerprint: str) -> dict:
+        """The entries of an earlier run of the same step"""
+        entries = {}
+        try:
+            with open(self.path, encoding="utf-8") as file:
+                lines = file.read().splitlines()
+        except OSError:
+            return entries
+        try:
+            if not lines or json.loads(lines[0]).get("fingerprint") != stage_fingerprint:
+                return entries
+            for line in lines[1:]:
+                entry = json.loads(line)
+                entries[entry["key"]] = entry
+        except ValueError:
+            # the last line was not finished when the run stopped
+            pass
+        return entries
+
+    def _write(self, entry: dict) -> None:
+        self._file.write(json.dumps(entry) + "\n")
+        self._file.flush()
+
+    def done(self, key: str) -> dict:
+        """
+        The entry of a finished species, None if it is not
+        in the journal or its output file has changed
+        """
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        if not self.cache.outputs_unchanged(entry["outputs"]):
+            return None
+        return entry
+
+    def add(self, key: str, outputs: list, **info) -> None:
+        """
+        Adds a finished species to the journal
+
+        args
+            key (str): the species key (e.g., its input file)
+            outputs (list): the output files of the species
+            info: other values to keep e.g., the number of peptides
+        """
+        entry = {
+            "key": key,
+            "outputs": {
+                self.cache.relative_name(output_file): file_hash(output_file)
+                for output_file in outputs
+            },
+            **info,
+        }
+        self.entries[key] = entry
+        self._write(entry)
+
+    def close(self) -> None:
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+if __name__ == "__main__":
+    sys.exit()
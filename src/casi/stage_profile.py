@@ -0,0 +1,180 @@
+"""
+stage_profile.py
+
+Records the wall time, CPU time and peak memory of each stage of
+theoretical_peps and compare_score when they are run with --profile.
+Stages are marked in the code with:
+    with profile_stage("stage name"):
+        ...
+which does nothing unless profiling has been turned on by enable_profile.
+A stage run more than once (e.g., reading each PMF in a batch) is added
+up as one stage. The peak memory is the highest memory allocated through
+Python (including NumPy arrays) while the stage ran, traced with
+tracemalloc. The CPU time is of the main process only, so it does not
+include worker processes. Memory tracing slows the run down, so it can
+be turned off when only the times are needed (e.g., for the run manifest).
+
+If a profile folder is given the functions called in each stage are
+also recorded with cProfile and saved as '<stage>.prof' in the folder,
+which can be read with pstats or snakeviz.
+
+A stage inside another stage is counted as part of the outer stage.
+"""
+
+import re
+import sys
+import time
+import cProfile
+import tracemalloc
+from pathlib import Path
+from contextlib import contextmanager
+
+# the profile of this run, None if profiling is off
+_profile = None
+
+
+class StageProfile:
+    """
+    The wall time, CPU time and peak memory of each stage in a run.
+
+    args
+        profile_dir (Path): folder for the cProfile file of each stage,
+            None to only record the times and memory
+        trace_memory (bool): record the peak memory with tracemalloc
+    """
+
+    def __init__(self, profile_dir: Path = None, trace_memory: bool = True):
+        self.profile_dir = profile_dir
+        self.trace_memory = trace_memory
+        # stage name as key, calls, wall and cpu time (s) and peak memory (bytes) as value
+        self.stages = {}
+        self._profilers = {}
+        self._active = None
+
+    @contextmanager
+    def stage(self, name: str):
+        """Records the stage while the with block runs"""
+        if self._active is not None:
+            yield
+            return
+        self._active = name
+        profiler = None
+        if self.profile_dir is not None:
+            profiler = self._profilers.setdefault(name, cProfile.Profile())
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        if profiler is not None:
+            profiler.enable()
+        try:
+            yield
+        finally:
+            if profiler is not None:
+                profiler.disable()
+            wall = time.perf_counter() - wall_start
+            cpu = time.process_time() - cpu_start
+            self._active = None
+            stats = self.stages.setdefault(
+                name, {"calls": 0, "wall": 0.0, "cpu": 0.0, "peak_memory": None}
+            )
+            stats["calls"] += 1
+            stats["wall"] += wall
+            stats["cpu"] += cpu
+            if self.trace_memory:
+                peak = tracemalloc.get_traced_memory()[1]
+                stats["peak_memory"] = max(stats["peak_memory"] or 0, peak)
+
+    def stage_seconds(self, names: list) -> float:
+        """The total wall time (s) of the stages"""
+        return sum(self.stages[name]["wall"] for name in names if name in self.stages)
+
+    def save_profiles(self) -> list:
+        """Saves the cProfile of each stage, returns the files"""
+        profile_files = []
+        for name, profiler in self._profilers.items():
+            profile_file = self.profile_dir / "{0}.prof".format(re.sub(r"\W+", "_", name))
+            profiler.dump_stats(profile_file)
+            profile_files.append(profile_file)
+        return profile_files
+
+    def table(self) -> str:
+        """The stages as a markdown table"""
+        from tabulate import tabulate
+
+        rows = [
+            [
+                name,
+                stats["calls"],
+                stats["wall"],
+                stats["cpu"],
+                None if stats["peak_memory"] is None else stats["peak_memory"] / 1024 ** 2,
+            ]
+            for name, stats in self.stages.items()
+        ]
+        headers = ["Stage", "Calls", "Wall time (s)", "CPU time (s)", "Peak memory (MB)"]
+        return tabulate(
+            rows, headers=headers, tablefmt="pipe", floatfmt=".3f", missingval="-"
+        )
+
+
+def enable_profile(profile_dir: Path = None, trace_memory: bool = True) -> StageProfile:
+    """
+    Turns profiling on for the rest of the run
+
+    args
+        profile_dir (Path): folder for the cProfile file of each stage (optional)
+        trace_memory (bool): record the peak memory of each stage
+
+    returns
+        profile (StageProfile): the profile the stages are recorded in
+    """
+    global _profile
+    if profile_dir is not None:
+        profile_dir = Path(profile_dir)
+        profile_dir.mkdir(parents=True, exist_ok=True)
+    _profile = StageProfile(profile_dir, trace_memory)
+    if trace_memory:
+        tracemalloc.start()
+    return _profile
+
+
+@contextmanager
+def profile_stage(name: str):
+    """Marks a stage of the run, only recorded if profiling is on"""
+    if _profile is None:
+        yield
+    else:
+        with _profile.stage(name):
+            yield
+
+
+def report_profile(show: bool = True) -> StageProfile:
+    """
+    Prints the time and memory of each stage, saves the cProfile files
+    and turns profiling off. Does nothing if profiling is off.
+
+    args
+        show (bool): print the table of stages
+
+    returns
+        profile (StageProfile): the profile of the run (None if profiling is off)
+    """
+    global _profile
+    profile = _profile
+    if profile is None:
+        return None
+    _profile = None
+    if profile.trace_memory:
+        tracemalloc.stop()
+    if show:
+        print("\nPROFILE:")
+        print(profile.table())
+    if profile.profile_dir is not None:
+        profile.save_profiles()
+        print("cProfile of each stage saved to '{0}'".format(profile.profile_dir))
+    return profile
+
+
+if __name__ == "__main__":
+    sys.exit()
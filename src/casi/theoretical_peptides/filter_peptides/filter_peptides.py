@@ -19,12 +19,24 @@ from pathlib import Path
 
 import pandas as pd
 
+from casi.run_manifest import add_species_count
+
 ##########################
 ## FUNCTIONS
 #########################
 
 
-def integrate(output_path):
+def integrate(output_path, journal=None):
+    """
+    Filters the theoretical peptides of each species in the
+    unfiltered_peptides folder by the LC-MS/MS peptides and saves
+    them in the filtered_peptides folder.
+
+    args
+        output_path (Path): the theoretical_peps output folder
+        journal (StageJournal): the species finished so far (optional),
+            species in it with their file unchanged are not filtered again
+    """
     print("Filter theoretical peptides by LCMSMS data.")
     print("Final Output csv files are in filtered_peptides folder.\n")
 
@@ -35,6 +47,12 @@ def integrate(output_path):
     csv_files = folder_path.glob("*.csv")
 
     for csv in csv_files:
+        # finished by a run that stopped (--resume)
+        entry = None if journal is None else journal.done(csv.name)
+        if entry is not None:
+            add_species_count(entry["species"], "peptides_kept", entry["peptides_kept"])
+            continue
+
         predict_df = pd.read_csv(csv, sep=",")
 
         # changing column name
@@ -120,14 +138,19 @@ def integrate(output_path):
                          )
 
         # naming csv
-        species_name = predict_lc_df.loc[0, "species"]
-        species_name = species_name.replace(" ", "_")
+        species = predict_lc_df.loc[0, "species"]
+        add_species_count(species, "peptides_kept", len(predict_lc_df))
+        species_name = species.replace(" ", "_")
         # output_path is input into function
         output_folder = output_path / "filtered_peptides"
         output_folder.mkdir(exist_ok=True)
         csv_name = f"{species_name}_col1peptides_filt.csv"
         csv_filepath = output_folder / csv_name
         predict_lc_df.to_csv(csv_filepath)
+        if journal is not None:
+            journal.add(
+                csv.name, [csv_filepath], species=species, peptides_kept=len(predict_lc_df)
+            )
     print("######################################")
 
 
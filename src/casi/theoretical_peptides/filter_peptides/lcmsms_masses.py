@@ -15,6 +15,8 @@ from collections import namedtuple
 
 import pandas as pd
 
+from casi.run_manifest import add_count
+
 Positions = namedtuple(
     "Positions",
     [
@@ -324,6 +326,7 @@ Ensure the following directory is created and put the LCMSMS data in it""")
     # save as a csv file
     output_file = output_folder / "lcmsms_masses.csv"
     final_peps_df.to_csv(output_file, sep=",")
+    add_count("lcmsms_peptides", len(final_peps_df))
     print(f"Output: {output_file}")
     print("######################################")
 
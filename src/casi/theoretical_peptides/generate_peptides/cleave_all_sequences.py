@@ -10,17 +10,41 @@ and deamidations
 
 from pathlib import Path
 import sys
-import time
 from collections import namedtuple
+from functools import partial
 
 import pandas as pd
 from tqdm import tqdm
 
 from casi.theoretical_peptides.generate_peptides import cleave_mass
+from casi.theoretical_peptides.generate_peptides.digest_cache import DigestCache
+from casi.run_manifest import add_count, add_species_count
+from casi.stage_cache import StageJournal
+
+# PTM rows of the peptides already digested in this process,
+# shared by all the species (None if the memo is off)
+_PEPTIDE_MEMO = None
+# digests saved on disk by earlier runs (None if there is no cache)
+_DIGEST_CACHE = None
+
+# what digest_species did for one species
+DigestCounts = namedtuple(
+    "DigestCounts", ["peptides", "memo_hits", "memo_misses", "cache_hit"]
+)
+
+
+def _init_worker(memo_size: int, cache_dir: Path = None) -> None:
+    """Starts an empty peptide memo (off if memo_size is 0) and
+    opens the digest cache (if a folder is given) in this process"""
+    global _PEPTIDE_MEMO, _DIGEST_CACHE
+    _PEPTIDE_MEMO = cleave_mass.PeptideMemo(memo_size) if memo_size > 0 else None
+    _DIGEST_CACHE = None if cache_dir is None else DigestCache(cache_dir)
 
 
 def run_cleave_mass(collagen_seq: str,
-                    species_info: namedtuple) -> pd.DataFrame:
+                    species_info: namedtuple,
+                    memo: cleave_mass.PeptideMemo = None,
+                    cache: DigestCache = None) -> pd.DataFrame:
     """
     In silico trypsin digest of the COL1 sequence
     and mass calculation. Includes common
@@ -29,6 +53,8 @@ def run_cleave_mass(collagen_seq: str,
     args
         collagen_seq (str): collagen sequence
         species_info (namedtuple): taxonomic inffromation of the species
+        memo (PeptideMemo): PTM rows of the peptides already seen (optional)
+        cache (DigestCache): digests saved by earlier runs (optional)
 
     returns
         collagen_pep_df (pd.DataFrame): dataframe with peptide sequence, mass,
@@ -36,7 +62,10 @@ def run_cleave_mass(collagen_seq: str,
     """
 
     # cleave and calculate mass
-    collagen_pep_df = cleave_mass.cleave_and_mass(collagen_seq, "trypsin", 1)
+    if cache is None:
+        collagen_pep_df = cleave_mass.cleave_and_mass(collagen_seq, "trypsin", 1, memo)
+    else:
+        collagen_pep_df = cache.cleave_and_mass(collagen_seq, "trypsin", 1, memo)
     # add taxonomic information
     collagen_pep_df["species"] = species_info.species
     collagen_pep_df["genus"] = species_info.genus
@@ -47,15 +76,74 @@ def run_cleave_mass(collagen_seq: str,
     return collagen_pep_df
 
 
-def collagen_peptide_mass(col_dict: dict, output_folder: Path):
+def species_output(output_folder: Path, species_info: namedtuple) -> Path:
+    """The csv file of a species e.g., Canis_lupus_col1_peptides.csv"""
+    species_name = species_info.species.replace(" ", "_")
+    output_name = f"{species_name}_col1_peptides.csv"
+    return output_folder / output_name
+
+
+def digest_species(species_info: namedtuple,
+                   collagen_seq: str,
+                   output_filename: Path,
+                   save: bool = True) -> DigestCounts:
+    """
+    Digests the COL1 sequence of one species and saves the peptides.
+    Runs in the worker processes if there is more than one worker.
+
+    args
+        species_info (namedtuple): taxonomic information of the species
+        collagen_seq (str): collagen sequence
+        output_filename (Path): the csv file for the peptides
+        save (bool): save the csv file (False if a later species has the same file)
+
+    returns
+        counts (DigestCounts): number of peptides generated, peptides found
+        in and added to the peptide memo and if the digest was in the cache
+    """
+    memo, cache = _PEPTIDE_MEMO, _DIGEST_CACHE
+    hits, misses = (0, 0) if memo is None else (memo.hits, memo.misses)
+    cache_hits = 0 if cache is None else cache.hits
+    # Perform trypsin digest and calculate peptide masses
+    col_pep_df = run_cleave_mass(collagen_seq, species_info, memo, cache)
+    if save:
+        col_pep_df.to_csv(output_filename)
+    if memo is not None:
+        hits, misses = memo.hits - hits, memo.misses - misses
+    cache_hit = cache is not None and cache.hits > cache_hits
+    return DigestCounts(len(col_pep_df), hits, misses, cache_hit)
+
+
+def _digest_task(task: tuple) -> DigestCounts:
+    """Runs digest_species for one (species_info, sequence, file, save) task"""
+    return digest_species(*task)
+
+
+def collagen_peptide_mass(col_dict: dict,
+                          output_folder: Path,
+                          workers: int = 1,
+                          memo_size: int = cleave_mass.PEPTIDE_MEMO_SIZE,
+                          cache_dir: Path = None,
+                          journal: StageJournal = None):
     """
     Processes each collagen sequence in the provided dictionary,
     performing in silico digestion and mass calculation for each peptide.
+    With more than one worker the species are digested in a pool
+    of processes, the files are the same as with one worker.
+    Peptides shared by species are only expanded once in each process
+    (see cleave_mass.PeptideMemo). With a cache folder, sequences digested
+    by an earlier run are read from the cache (see digest_cache).
+    Species in the journal of a stopped run (with their files unchanged)
+    are not digested again.
 
     Args:
         col_dict (dict): Dictionary with species taxonomic information as keys
                          and collagen sequences as values.
         output_folder (Path): Path to the folder where the output files will be saved.
+        workers (int): number of processes used to digest the species
+        memo_size (int): the most peptides kept in the peptide memo, 0 for no memo
+        cache_dir (Path): folder of the digest cache (optional)
+        journal (StageJournal): the species finished so far (optional)
 
     Generates:
         CSV files for each species containing the theoretical peptides
@@ -67,22 +155,64 @@ def collagen_peptide_mass(col_dict: dict, output_folder: Path):
     output_folder = output_folder / "unfiltered_peptides"
     output_folder.mkdir(exist_ok=True)
 
-    # Total number of iterations for progress tracking
-    total_iterations = len(col_dict)
-
-    # Iterate through each entry in the collagen dictionary
-    for key, value in tqdm(col_dict.items(), total=total_iterations, desc="Generating Theoretical Peptides"):
-        time.sleep(0.01)
-
-        # Perform trypsin digest and calculate peptide masses
-        col_pep_df = run_cleave_mass(value, key)
+    # a species is only saved if no later species has the same file name,
+    # so the file is the same as when each species overwrites the last
+    output_files = [species_output(output_folder, key) for key in col_dict]
+    last_species = {output_filename: number for number, output_filename in enumerate(output_files)}
+    tasks = [
+        (key, value, output_filename, last_species[output_filename] == number)
+        for number, ((key, value), output_filename) in enumerate(zip(col_dict.items(), output_files))
+    ]
+
+    # species finished by a run that stopped (--resume)
+    finished = {}
+    if journal is not None:
+        for number, task in enumerate(tasks):
+            entry = journal.done(str(number))
+            if entry is not None:
+                finished[number] = entry
+                add_species_count(task[0].species, "peptides_generated", entry["peptides"])
+                add_count("species_resumed", 1)
+    todo = [(number, task) for number, task in enumerate(tasks) if number not in finished]
+    todo_tasks = [task for _, task in todo]
 
-        # Construct the output filename using species name
-        species_name = key.species.replace(" ", "_")
-        output_name = f"{species_name}_col1_peptides.csv"
-        output_filename = output_folder / output_name
-
-        col_pep_df.to_csv(output_filename)
+    # Total number of iterations for progress tracking
+    total_iterations = len(todo_tasks)
+    progress = partial(
+        tqdm, total=len(tasks), initial=len(finished), desc="Generating Theoretical Peptides"
+    )
+
+    pool = None
+    if workers > 1 and total_iterations > 1:
+        from concurrent.futures import ProcessPoolExecutor
+
+        # a few chunks per worker keeps the work balanced,
+        # results come back in the order of the species
+        chunksize = max(1, total_iterations // (workers * 4))
+        pool = ProcessPoolExecutor(
+            max_workers=workers, initializer=_init_worker, initargs=(memo_size, cache_dir)
+        )
+        peptide_counts = pool.map(_digest_task, todo_tasks, chunksize=chunksize)
+    else:
+        _init_worker(memo_size, cache_dir)
+        peptide_counts = map(_digest_task, todo_tasks)
+
+    try:
+        for (number, task), counts in zip(todo, progress(peptide_counts)):
+            add_species_count(task[0].species, "peptides_generated", counts.peptides)
+            add_count("species_digested", 1)
+            add_count("peptide_memo_hits", counts.memo_hits)
+            add_count("peptide_memo_misses", counts.memo_misses)
+            if cache_dir is not None:
+                add_count("digest_cache_hits", counts.cache_hit)
+                add_count("digest_cache_misses", not counts.cache_hit)
+            if journal is not None:
+                saved = [task[2]] if task[3] else []
+                journal.add(str(number), saved, peptides=counts.peptides)
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+        _init_worker(0)
 
 if __name__ == "__main__":
     sys.exit()
@@ -9,9 +9,51 @@ number of missed cleavages
 
 import re
 import time
+from collections import OrderedDict
 
+import numpy as np
 import pandas as pd  # type: ignore
-from pyteomics import mass
+
+# monoisotopic residue masses (Da), the same as pyteomics std_aa_mass
+RESIDUE_MASS = {
+    "G": 57.02146372057,
+    "A": 71.03711378471,
+    "S": 87.03202840427001,
+    "P": 97.05276384885,
+    "V": 99.06841391299,
+    "T": 101.04767846841,
+    "C": 103.00918478471,
+    "L": 113.08406397713001,
+    "I": 113.08406397713001,
+    "J": 113.08406397713001,
+    "N": 114.04292744114001,
+    "D": 115.02694302383001,
+    "Q": 128.05857750527997,
+    "K": 128.09496301399997,
+    "E": 129.04259308796998,
+    "M": 131.04048491299,
+    "H": 137.05891185845002,
+    "F": 147.06841391298997,
+    "U": 150.95363508471,
+    "R": 156.10111102359997,
+    "Y": 163.06332853254997,
+    "W": 186.07931294985997,
+    "O": 237.14772686284996,
+}
+# monoisotopic masses (Da) of hydrogen, oxygen and a proton (from pyteomics nist_mass)
+HYDROGEN_MASS = 1.00782503207
+OXYGEN_MASS = 15.99491461956
+PROTON_MASS = 1.00727646677
+# the N and C termini of a peptide add a water
+WATER_MASS = HYDROGEN_MASS * 2 + OXYGEN_MASS
+# residues that can be hydroxylated or deamidated
+HYD_PATTERN = "[PKM]"
+DEAM_PATTERN = "[NQ]"
+# monoisotopic mass of each PTM from UNIMOD
+HYD_MASS = 15.99415
+DEAM_MASS = 0.984016
+# peptides kept in a PeptideMemo (about 0.5 kB each)
+PEPTIDE_MEMO_SIZE = 100000
 
 
 def position_finder(seq: str,
@@ -42,57 +84,54 @@ def position_finder(seq: str,
     return position_list
 
 
-def peptide_getter(seq: str,
-                   position_list: list,
-                   miss_number: int,
-                   final_peptide_df: pd.DataFrame) -> pd.DataFrame:
+def peptide_windows(position_list: list,
+                    missed_cleavages: int) -> tuple:
     """
-    Cleaves all the peptide fragments from a sequence using the
-    position list. Accounts for a number of missed cleaves.
-    For example, miss_number = 1 would use position 0-2, 1-3
-    rather than 0-1, 1-2.
+    Finds the start and end of every peptide that can be cleaved
+    using the position list, for 0 up to missed_cleavages missed cleaves.
+    For example, 1 missed cleave uses positions 0-2, 1-3 as well as
+    0-1, 1-2. Windows are ordered by the number of missed cleaves
+    then by start position.
 
-    Args:
-        seq (str): the peptide sequence
+    args
         position_list (list): positions where a cleavage can occur
-        miss_number (int): number of missed cleavages allowed
+        missed_cleavages (int): the number of missed cleavages allowed
 
-    Returns:
-        final_peptide_df (pd.Dataframe): a dataframe containg the
-        sequence of a cleaved peptide, the start and end position
-        in the original peptide sequence and the number of missed
-        clevages
+    returns
+        starts (np.ndarray): start of each peptide (0 based)
+        ends (np.ndarray): end of each peptide (not included)
+        missed (np.ndarray): number of missed cleaves of each peptide
     """
-
-    num_cleave_sites = len(position_list)
-    final_start_number = num_cleave_sites - (miss_number + 1)
-
-    for start_number in range(0, num_cleave_sites):
-        if start_number < final_start_number:
-            start_position = position_list[start_number]
-            end_number = start_number + (miss_number + 1)
-            end_position = position_list[end_number]
-            peptide_fragment = seq[start_position:end_position]
-            # don't add any peptides with an unknown residue (X)
-            if "X" not in peptide_fragment:
-                single_peptide_list = [
-                    peptide_fragment,
-                    start_position + 1,
-                    end_position,
-                    miss_number,
-                ]
-                final_peptide_df.loc[len(final_peptide_df)] = single_peptide_list
-
-    return final_peptide_df
+    positions = np.asarray(position_list, dtype=np.int64)
+    # peptides with miss_number missed cleaves skip miss_number positions
+    miss_numbers = [
+        miss_number
+        for miss_number in range(0, missed_cleavages + 1)
+        if len(positions) > miss_number + 1
+    ]
+    if not miss_numbers:
+        empty = np.array([], dtype=np.int64)
+        return empty, empty, empty
+    starts = np.concatenate(
+        [positions[:len(positions) - (miss_number + 1)] for miss_number in miss_numbers]
+    )
+    ends = np.concatenate([positions[miss_number + 1:] for miss_number in miss_numbers])
+    missed = np.concatenate(
+        [
+            np.full(len(positions) - (miss_number + 1), miss_number, dtype=np.int64)
+            for miss_number in miss_numbers
+        ]
+    )
+    return starts, ends, missed
 
 
 def peptide_cleaver(seq: str,
                     position_list: list,
                     missed_cleavages: int) -> pd.DataFrame:
     """
-    Iterates through the potential missed cleavages (0,1,2)
-    Uses peptide_getter to obtain the peptides for the positions
-    of a specific peptide clevage
+    Cleaves all the peptides (0 up to missed_cleavages missed cleaves)
+    from the sequence at once using the positions from position_finder.
+    Peptides with an unknown residue (X) are removed.
 
     args
         seq (str): the COl1 peptide sequence
@@ -105,70 +144,174 @@ def peptide_cleaver(seq: str,
             and their start, end positions and number of missed cleavages.
     """
 
-    final_peptide_df = pd.DataFrame(
-        [], columns=["seq", "seq_start", "seq_end", "missed_cleaves"]
-    )
-    for miss_number in range(0, missed_cleavages + 1):
-        final_peptide_df = peptide_getter(
-            seq, position_list, miss_number, final_peptide_df
-        )
+    starts, ends, missed = peptide_windows(position_list, missed_cleavages)
+    # don't add any peptides with an unknown residue (X),
+    # the number of X before each position tells if a peptide has one
+    residues = np.frombuffer(seq.encode("ascii"), dtype=np.uint8)
+    x_count = np.concatenate([[0], np.cumsum(residues == ord("X"))])
+    keep = x_count[ends] == x_count[starts]
+    starts, ends, missed = starts[keep], ends[keep], missed[keep]
+
+    final_peptide_df = pd.DataFrame({
+        "seq": pd.Series(
+            [seq[start:end] for start, end in zip(starts.tolist(), ends.tolist())], dtype=str
+        ),
+        "seq_start": starts + 1,
+        "seq_end": ends,
+        "missed_cleaves": missed,
+    })
     final_peptide_df = final_peptide_df.sort_values(by=["seq_start"])
 
     return final_peptide_df
 
 
-def mass_calculator(pep_df: pd.DataFrame) -> pd.DataFrame:
+def residue_masses(seq: str) -> np.ndarray:
+    """
+    Encodes the sequence as the mass of each residue,
+    unknown residues (e.g., X) have no mass (NaN)
+
+    args
+        seq (str): the COL1 peptide sequence
+
+    returns
+        residue_mass (np.ndarray): mass (Da) of each residue in the sequence
+    """
+    mass_table = np.full(256, np.nan)
+    for residue, residue_mass in RESIDUE_MASS.items():
+        mass_table[ord(residue)] = residue_mass
+    return mass_table[np.frombuffer(seq.encode("ascii"), dtype=np.uint8)]
+
+
+def window_masses(residue_mass: np.ndarray,
+                  starts: np.ndarray,
+                  ends: np.ndarray) -> np.ndarray:
+    """
+    Calculates the [M+H]+ m/z value of every peptide (window of the sequence)
+    at once. Residues are added in order from the start of each peptide,
+    one position of all the peptides at a time, so the masses are exactly
+    the same as pyteomics mass.fast_mass(seq, ion_type="M", charge=1)
+    (a cumulative sum of the sequence would differ in the last digits).
+
+    args
+        residue_mass (np.ndarray): residue masses from residue_masses
+        starts (np.ndarray): start of each peptide (0 based)
+        ends (np.ndarray): end of each peptide (not included)
+
+    returns
+        masses (np.ndarray): m/z value of each peptide (charge 1)
+    """
+    starts = np.asarray(starts, dtype=np.int64)
+    lengths = np.asarray(ends, dtype=np.int64) - starts
+    masses = np.zeros(len(starts))
+    for offset in range(int(lengths.max(initial=0))):
+        longer = lengths > offset
+        masses[longer] += residue_mass[starts[longer] + offset]
+    masses += WATER_MASS
+    return masses + PROTON_MASS
+
+
+def mass_calculator(seq: str,
+                    pep_df: pd.DataFrame) -> pd.DataFrame:
     """
-    Calculates the intial monoisotopics mass of
-    each peptide in the dataframe. Using pyteomics
-    fast mass function to calculate the mass.
+    Calculates the intial monoisotopics mass ([M+H]+)
+    of each peptide in the dataframe from the residue
+    masses of the sequence it was cleaved from.
+    Gives the same masses as the pyteomics fast_mass function.
     https://pyteomics.readthedocs.io/en/latest/index.html
 
     args
+      seq (str): the COL1 peptide sequence the peptides are from
       pep_df (pd.DataFrame): dataframe of peptides
 
     returns 
       pep_df (pd.DataFrame): dataframe with additonal mass column
     """
 
-    pep_df["mass1"] = pep_df["seq"].apply(
-        lambda seq: mass.fast_mass(sequence=seq, ion_type="M", charge=1)
+    residue_mass = residue_masses(seq)
+    masses = window_masses(
+        residue_mass,
+        pep_df["seq_start"].to_numpy(dtype=np.int64) - 1,
+        pep_df["seq_end"].to_numpy(dtype=np.int64),
     )
+    check_masses(masses, pep_df["seq"].tolist())
+    pep_df["mass1"] = masses
 
     return pep_df
 
 
+def check_masses(masses: np.ndarray, peptides: list) -> None:
+    """Raises an error if a peptide has a residue with no mass"""
+    if np.isnan(masses).any():
+        unknown = {
+            residue
+            for peptide, peptide_mass in zip(peptides, masses)
+            if np.isnan(peptide_mass)
+            for residue in peptide
+            if residue not in RESIDUE_MASS
+        }
+        raise Exception("No mass data for residue: {0}".format(", ".join(sorted(unknown))))
+
+
+def ptm_combinations(max_hyd: np.ndarray, max_deam: np.ndarray) -> tuple:
+    """
+    Every (nhyd, ndeam) pair of each peptide from 0 up to the
+    number of residues that can be modified, with nhyd as the
+    outer and ndeam as the inner count.
+
+    args
+        max_hyd (np.ndarray): residues that can be hydroxylated in each peptide
+        max_deam (np.ndarray): residues that can be deamidated in each peptide
+
+    returns
+        repeat_rows (np.ndarray): the peptide of each combination
+        nhyd (np.ndarray): hydroxylations of each combination
+        ndeam (np.ndarray): deamidations of each combination
+    """
+    combinations = (max_hyd + 1) * (max_deam + 1)
+    # repeat each peptide once per combination, the offset of each
+    # row within its peptide gives the (nhyd, ndeam) pair
+    repeat_rows = np.repeat(np.arange(len(combinations)), combinations)
+    first_rows = np.cumsum(combinations) - combinations
+    offsets = np.arange(combinations.sum()) - first_rows[repeat_rows]
+    deam_options = max_deam[repeat_rows] + 1
+    return repeat_rows, offsets // deam_options, offsets % deam_options
+
+
+def ptm_masses(masses, nhyd, ndeam):
+    """The masses (arrays or columns) with the PTM masses added"""
+    return masses + (nhyd * HYD_MASS) + (ndeam * DEAM_MASS)
+
+
 def possible_ptms(pep_df: pd.DataFrame,
-                  ptm_pattern: str,
-                  column_name : str) -> pd.DataFrame:
+                  hyd_pattern: str = HYD_PATTERN,
+                  deam_pattern: str = DEAM_PATTERN) -> pd.DataFrame:
     """
     Calculates the possible hydroxylations and deamidations
-    and creates a row for each possible combination
+    and creates a row for each possible combination. Each peptide
+    is repeated once for every (nhyd, ndeam) pair from 0 up to the
+    number of residues that can be modified, with nhyd as the
+    outer and ndeam as the inner count.
 
     args
       pep_df (pd.DataFrame): dataframe of peptides
-      ptm_pattern (str): pattern for hydroxylations or deamidations
-      column_name (str): eithr nhyd (hydroxylations) or ndeam (deamidations)
+      hyd_pattern (str): residues that can be hydroxylated
+      deam_pattern (str): residues that can be deamidated
 
     returns
-      alt_hyd_pep_df (pd.DataFrame): same as pep_df but with news rows 
-      in the peptide dataframe for each possible PTM combination and the 
-      new mass for that combination.
+      ptm_pep_df (pd.DataFrame): same as pep_df but with a row
+      for each possible PTM combination and the nhyd and ndeam columns
     """
 
-    # count total possible ptm modification (e.g., hydroxylations or deamidations)
-    pep_df[column_name] = pep_df["seq"].str.count(ptm_pattern)
+    # count total possible ptm modifications of each peptide
+    max_hyd = pep_df["seq"].str.count(hyd_pattern).to_numpy(dtype=np.int64)
+    max_deam = pep_df["seq"].str.count(deam_pattern).to_numpy(dtype=np.int64)
 
-    # create df with all possible PTMS
-    alt_hyd_pep_df = pd.DataFrame(columns=pep_df.columns)
-    for index, row in pep_df.iterrows():
-        num_hydroxylations = int(row[column_name])
-        for number in range(0, num_hydroxylations + 1):
-            row[column_name] = number
-            alt_hyd_pep_df.loc[len(alt_hyd_pep_df)] = row
+    repeat_rows, nhyd, ndeam = ptm_combinations(max_hyd, max_deam)
+    ptm_pep_df = pep_df.iloc[repeat_rows].reset_index(drop=True)
+    ptm_pep_df["nhyd"] = nhyd
+    ptm_pep_df["ndeam"] = ndeam
 
-    del pep_df
-    return alt_hyd_pep_df
+    return ptm_pep_df
 
 
 def ptm_mass(pep_df: pd.DataFrame) -> pd.DataFrame:
@@ -186,18 +329,120 @@ def ptm_mass(pep_df: pd.DataFrame) -> pd.DataFrame:
         number of deamidations
     """
 
-    pep_df["mass1"] = pep_df.apply(
-        lambda pep_row: pep_row["mass1"]
-        + (pep_row["nhyd"] * 15.99415)
-        + (pep_row["ndeam"] * 0.984016),
-        axis=1,
-    )
+    pep_df["mass1"] = ptm_masses(pep_df["mass1"], pep_df["nhyd"], pep_df["ndeam"])
     return pep_df
 
 
+class PeptideMemo:
+    """
+    The PTM rows (mass1, nhyd, ndeam) of each peptide sequence, so a
+    peptide found in many species (most collagen peptides) is only
+    expanded once. The masses only depend on the peptide sequence, so the
+    rows are the same as calculating them again. When the memo is full
+    the peptide used least recently is removed.
+
+    args
+        max_peptides (int): the most peptides kept in the memo
+    """
+
+    def __init__(self, max_peptides: int = PEPTIDE_MEMO_SIZE):
+        self.max_peptides = max_peptides
+        # peptide sequence as key, (mass1, nhyd, ndeam) arrays as value
+        self._peptides = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._peptides)
+
+    def _expand_missing(self, seq: str, starts: np.ndarray, ends: np.ndarray, missing: list) -> dict:
+        """
+        Calculates the PTM rows of the peptides not in the memo,
+        the same as mass_calculator, possible_ptms and ptm_mass
+        but without a dataframe as there are only a few each time
+
+        args
+            seq (str): the COL1 peptide sequence the peptides are from
+            starts (np.ndarray): start of each missing peptide (0 based)
+            ends (np.ndarray): end of each missing peptide (not included)
+            missing (list): the missing peptide sequences
+
+        returns
+            new_rows (dict): (mass1, nhyd, ndeam) arrays of each peptide
+        """
+        masses = window_masses(residue_masses(seq), starts, ends)
+        check_masses(masses, missing)
+        max_hyd = np.array([len(re.findall(HYD_PATTERN, peptide)) for peptide in missing])
+        max_deam = np.array([len(re.findall(DEAM_PATTERN, peptide)) for peptide in missing])
+        repeat_rows, nhyd, ndeam = ptm_combinations(max_hyd, max_deam)
+        ptm_mass1 = ptm_masses(masses[repeat_rows], nhyd, ndeam)
+        # the rows of each peptide are next to each other
+        splits = np.cumsum((max_hyd + 1) * (max_deam + 1))[:-1]
+        return dict(zip(
+            missing,
+            zip(np.split(ptm_mass1, splits), np.split(nhyd, splits), np.split(ndeam, splits)),
+        ))
+
+    def expand(self, seq: str, pep_df: pd.DataFrame) -> pd.DataFrame:
+        """
+        Adds the mass and PTM combinations to the cleaved peptides,
+        the same as mass_calculator, possible_ptms and ptm_mass
+
+        args
+            seq (str): the COL1 peptide sequence the peptides are from
+            pep_df (pd.DataFrame): peptides from peptide_cleaver
+
+        returns
+            ptm_pep_df (pd.DataFrame): a row for each PTM combination of each peptide
+        """
+        if pep_df.empty:
+            return ptm_mass(possible_ptms(mass_calculator(seq, pep_df)))
+
+        peptides = pep_df["seq"].tolist()
+        # rows of the peptides in this sequence, kept here
+        # in case they are removed from the memo when it is full
+        rows = {}
+        # the missing peptides and their first row
+        missing = {}
+        for number, peptide in enumerate(peptides):
+            if peptide in rows:
+                continue
+            rows[peptide] = self._peptides.get(peptide)
+            if rows[peptide] is None:
+                missing[peptide] = number
+            else:
+                self._peptides.move_to_end(peptide)
+                self.hits += 1
+        if missing:
+            self.misses += len(missing)
+            first_rows = np.fromiter(missing.values(), dtype=np.int64, count=len(missing))
+            new_rows = self._expand_missing(
+                seq,
+                pep_df["seq_start"].to_numpy(dtype=np.int64)[first_rows] - 1,
+                pep_df["seq_end"].to_numpy(dtype=np.int64)[first_rows],
+                list(missing),
+            )
+            rows.update(new_rows)
+            self._peptides.update(new_rows)
+            while len(self._peptides) > self.max_peptides:
+                self._peptides.popitem(last=False)
+                self.evictions += 1
+
+        # repeat each peptide once per combination and add the memo rows
+        peptide_rows = [rows[peptide] for peptide in peptides]
+        combinations = np.array([len(masses) for masses, _, _ in peptide_rows])
+        repeat_rows = np.repeat(np.arange(len(pep_df)), combinations)
+        columns = {column: pep_df[column].to_numpy()[repeat_rows] for column in pep_df.columns}
+        for number, column in enumerate(["mass1", "nhyd", "ndeam"]):
+            columns[column] = np.concatenate([values[number] for values in peptide_rows])
+        return pd.DataFrame(columns)
+
+
 def cleave_and_mass(seq: str,
                     rule: str="trypsin",
-                    missed_cleavages: int=0) -> pd.DataFrame:
+                    missed_cleavages: int=0,
+                    memo: PeptideMemo = None) -> pd.DataFrame:
     """
     Function takes a polypeptide sequences as an input
     and in silico digests it using an enzyme such as trypsin.
@@ -208,6 +453,8 @@ def cleave_and_mass(seq: str,
         seq (string): collagen peptide sequence 
         rule (string): enzyme to use for cutting e.g., trypsin 
         missed_cleavages (int): number of missed cleavages allowed
+        memo (PeptideMemo): PTM rows of peptides already seen (optional),
+            e.g., shared by all the species in a library
     
     returns 
         peptide_df (pd.DataFrame): dataframe with peptide sequence, mass, 
@@ -220,12 +467,12 @@ def cleave_and_mass(seq: str,
     position_list = position_finder(seq, expasy_rules[rule])
     # generates the potential peptides
     peptide_df = peptide_cleaver(seq, position_list, missed_cleavages)
+    if memo is not None:
+        return memo.expand(seq, peptide_df)
     # calculates the initial mass of the peptides
-    peptide_df = mass_calculator(peptide_df)
-    # hydroxylations
-    peptide_df = possible_ptms(peptide_df, "[PKM]", "nhyd")
-    # deamidations
-    peptide_df = possible_ptms(peptide_df, "[NQ]", "ndeam")
+    peptide_df = mass_calculator(seq, peptide_df)
+    # all combinations of hydroxylations and deamidations
+    peptide_df = possible_ptms(peptide_df)
     # change masses to account for PTMs
     peptide_df = ptm_mass(peptide_df)
     
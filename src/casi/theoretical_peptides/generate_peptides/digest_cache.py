@@ -0,0 +1,190 @@
+"""
+digest_cache.py
+
+Keeps the in silico digest (peptides, masses and PTM combinations) of
+each COL1 sequence on disk, so a library rebuilt from a new NCBI
+download only digests the sequences that are new or have changed.
+
+Each digest is saved as a NumPy .npz file named by the SHA-256 hash of
+the sequence and the digest settings (enzyme, missed cleavages, PTM
+residues and masses, residue masses and the cache version), so a
+changed sequence or setting is never read from an old digest:
+    <cache folder>/<first 2 characters of hash>/<hash>.npz
+The taxonomy is not part of the digest, so species with the same
+sequence share one file. The files contain:
+    * version - the cache version
+    * seq_start, seq_end, missed_cleaves, mass1, nhyd, ndeam - one value
+      for each row of cleave_and_mass (the peptide sequences are cut
+      from the COL1 sequence again when the digest is read)
+
+Files are written to a temporary file and then renamed, so runs that
+share a cache folder at the same time never read half a file. A file
+that cannot be read is digested again.
+"""
+
+import os
+import sys
+import json
+import hashlib
+import tempfile
+import zipfile
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from casi.theoretical_peptides.generate_peptides import cleave_mass
+
+DIGEST_CACHE_VERSION = 1
+INT_COLUMNS = ["seq_start", "seq_end", "missed_cleaves", "nhyd", "ndeam"]
+
+
+def digest_settings(rule: str, missed_cleavages: int) -> dict:
+    """
+    Everything apart from the sequence that changes a digest
+
+    args
+        rule (str): enzyme used for cutting e.g., trypsin
+        missed_cleavages (int): number of missed cleavages allowed
+
+    returns
+        settings (dict): the settings (JSON types)
+    """
+    return {
+        "version": DIGEST_CACHE_VERSION,
+        "rule": cleave_mass.rules()[rule],
+        "missed_cleavages": missed_cleavages,
+        "hyd_pattern": cleave_mass.HYD_PATTERN,
+        "deam_pattern": cleave_mass.DEAM_PATTERN,
+        "hyd_mass": cleave_mass.HYD_MASS,
+        "deam_mass": cleave_mass.DEAM_MASS,
+        "residue_mass": cleave_mass.RESIDUE_MASS,
+        "water_mass": cleave_mass.WATER_MASS,
+        "proton_mass": cleave_mass.PROTON_MASS,
+    }
+
+
+def digest_key(seq: str, rule: str, missed_cleavages: int) -> str:
+    """
+    The SHA-256 hash of the sequence and everything that changes its digest
+
+    args
+        seq (str): collagen peptide sequence
+        rule (str): enzyme used for cutting e.g., trypsin
+        missed_cleavages (int): number of missed cleavages allowed
+
+    returns
+        key (str): the hash as hex
+    """
+    settings = digest_settings(rule, missed_cleavages)
+    digest = hashlib.sha256(json.dumps(settings, sort_keys=True).encode("utf-8"))
+    digest.update(b"\n")
+    digest.update(seq.encode("utf-8"))
+    return digest.hexdigest()
+
+
+class DigestCache:
+    """
+    The digests of COL1 sequences saved in a folder.
+
+    args
+        cache_dir (Path): folder of the digest files (created if needed)
+    """
+
+    def __init__(self, cache_dir: Path):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.hits = 0
+        self.misses = 0
+
+    def path(self, key: str) -> Path:
+        """The digest file of a key"""
+        return self.cache_dir / key[:2] / "{0}.npz".format(key)
+
+    def load(self, key: str, seq: str) -> pd.DataFrame:
+        """
+        Reads a digest from the cache
+
+        args
+            key (str): the key from digest_key
+            seq (str): the sequence the digest is of
+
+        returns
+            peptide_df (pd.DataFrame): the same as cleave_and_mass,
+            None if the digest is not in the cache
+        """
+        try:
+            with np.load(self.path(key), allow_pickle=False) as npz:
+                arrays = {name: npz[name] for name in npz.files}
+        except (OSError, EOFError, ValueError, KeyError, zipfile.BadZipFile):
+            # not in the cache or not a complete digest file
+            return None
+        if int(arrays.pop("version", -1)) != DIGEST_CACHE_VERSION:
+            return None
+        starts = arrays["seq_start"].tolist()
+        ends = arrays["seq_end"].tolist()
+        peptide_df = pd.DataFrame({
+            "seq": pd.Series([seq[start - 1:end] for start, end in zip(starts, ends)], dtype=str),
+            "seq_start": arrays["seq_start"].astype(np.int64),
+            "seq_end": arrays["seq_end"].astype(np.int64),
+            "missed_cleaves": arrays["missed_cleaves"].astype(np.int64),
+            "mass1": arrays["mass1"],
+            "nhyd": arrays["nhyd"].astype(np.int64),
+            "ndeam": arrays["ndeam"].astype(np.int64),
+        })
+        return peptide_df
+
+    def save(self, key: str, peptide_df: pd.DataFrame) -> Path:
+        """Writes a digest to the cache, replacing the file in one step"""
+        path = self.path(key)
+        path.parent.mkdir(exist_ok=True)
+        arrays = {column: peptide_df[column].to_numpy(dtype=np.int32) for column in INT_COLUMNS}
+        temp_file = tempfile.NamedTemporaryFile(
+            dir=path.parent, prefix=key, suffix=".tmp", delete=False
+        )
+        try:
+            with temp_file:
+                np.savez_compressed(
+                    temp_file,
+                    version=np.array(DIGEST_CACHE_VERSION),
+                    mass1=peptide_df["mass1"].to_numpy(dtype=np.float64),
+                    **arrays,
+                )
+            os.replace(temp_file.name, path)
+        except BaseException:
+            Path(temp_file.name).unlink(missing_ok=True)
+            raise
+        return path
+
+    def cleave_and_mass(self,
+                        seq: str,
+                        rule: str = "trypsin",
+                        missed_cleavages: int = 0,
+                        memo: cleave_mass.PeptideMemo = None) -> pd.DataFrame:
+        """
+        cleave_and_mass that reads the digest from the cache
+        or digests the sequence and saves it to the cache
+
+        args
+            seq (str): collagen peptide sequence
+            rule (str): enzyme to use for cutting e.g., trypsin
+            missed_cleavages (int): number of missed cleavages allowed
+            memo (PeptideMemo): PTM rows of peptides already seen (optional)
+
+        returns
+            peptide_df (pd.DataFrame): dataframe with peptide sequence, mass,
+            number of hydroxylations and number of deamidations
+        """
+        key = digest_key(seq, rule, missed_cleavages)
+        peptide_df = self.load(key, seq)
+        if peptide_df is not None:
+            self.hits += 1
+            return peptide_df
+        self.misses += 1
+        peptide_df = cleave_mass.cleave_and_mass(seq, rule, missed_cleavages, memo)
+        self.save(key, peptide_df)
+        return peptide_df
+
+
+if __name__ == "__main__":
+    sys.exit()
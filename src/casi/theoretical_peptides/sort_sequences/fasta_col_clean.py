@@ -20,6 +20,8 @@ import re
 import sys
 from pathlib import Path
 
+from casi.run_manifest import add_count
+
 def read_fasta(file_name):
     """reads the fasta file and converts to dictionary.
 
@@ -228,6 +230,9 @@ def run_clean_col(file_name, output_dir, collagen_type, class_input=None):
             clean_sequence_dict = clean_a2_mammals(sequence_dict)
     convert_fasta(clean_sequence_dict, output_dir, collagen_type)
     print_outputs(clean_sequence_dict, collagen_type)
+    # sequences before and after cleaning for the run manifest
+    add_count(f"{collagen_type.lower()}_input_sequences", len(sequence_dict))
+    add_count(f"{collagen_type.lower()}_clean_sequences", len(clean_sequence_dict))
 
 
 if __name__ == "__main__":
@@ -14,7 +14,7 @@ import sys
 from pathlib import Path
 from collections import namedtuple
 
-import taxopy
+from casi.run_manifest import add_count
 
 RankLineage = namedtuple(
     "RankLineage",
@@ -115,6 +115,9 @@ def get_taxa(sequences: dict) -> dict:
         new_sequences (dict): Dictionary with RankLineage object as key and sequence as value
     """
     
+    # taxopy is only imported when the taxonomy is needed
+    import taxopy
+
     # get taxopy database
     print("\nGetting taxon information. Takes a while to dowmload NCBI taxon database")
     new_sequences: dict = {}
@@ -187,6 +190,28 @@ def create_fasta(sequences: dict, output_file: Path) -> None:
     print("Output is COL1A1A2_combined_seqs_NCBI.fasta")
     print("######################################")
 
+def read_combined_fasta(fasta_file: Path) -> dict:
+    """
+    Reads the combined fasta file made by create_fasta back into the
+    dictionary returned by col1a1a2_combine, without the NCBI taxon database.
+
+    Args:
+        fasta_file (Path): the COL1A1A2_combined_seqs_NCBI.fasta file
+
+    Returns:
+        sequences (dict): Dictionary with RankLineage object as key and sequence as value
+    """
+    sequences = {}
+    for header, sequence in read_col_fasta(fasta_file).items():
+        ranks = dict(rank.split("=", 1) for rank in header.split("|"))
+        # ranks that were not found are written as None
+        lineage = RankLineage(*[
+            None if ranks[rank.upper()] == "None" else ranks[rank.upper()]
+            for rank in RankLineage._fields
+        ])
+        sequences[lineage] = sequence
+    return sequences
+
 def col1a1a2_combine(output_dir: Path) -> dict:
     """
     The function reads the cleaned COl1A1 and COL1A2 sequences from the
@@ -211,6 +236,9 @@ def col1a1a2_combine(output_dir: Path) -> dict:
 
     # Merge COl1A1 and COL1A2 sequences by species
     col1a2_combined = merge_col(col1a1_dict, col1a2_dict)
+    add_count("col1a1_species", len(col1a1_dict))
+    add_count("col1a2_species", len(col1a2_dict))
+    add_count("combined_species", len(col1a2_combined))
 
     # Retrieve taxonomic information for the combined sequences
     col1a2_combined = get_taxa(col1a2_combined)
@@ -0,0 +1,59 @@
+"""
+Shared fixtures: a small synthetic theoretical library and peak lists
+made from it (see casi.compare_peptides.synthetic_data)
+"""
+
+import numpy as np
+import pytest
+
+from casi.compare_peptides.mass_index import build_mass_index
+from casi.compare_peptides.synthetic_data import (
+    synthetic_peak_list,
+    synthetic_species,
+    write_peak_list,
+)
+
+NUM_SPECIES = 12
+MASS_RANGE = (800.0, 3500.0)
+
+
+@pytest.fixture(scope="session")
+def theor_peaks_list():
+    """Theoretical peptides of each species, read as compare_score reads them"""
+    rng = np.random.default_rng(1)
+    species_list = []
+    for number in range(NUM_SPECIES):
+        species_df = synthetic_species(rng, number, mass_range=MASS_RANGE)
+        # the same m/z values in several species, as for conserved collagen peptides
+        if number > 0:
+            species_df.loc[:99, "mass1"] = species_list[0]["mass1"].iloc[:100].to_numpy()
+        species_df["mass1"] = species_df["mass1"].astype("float32")
+        species_list.append(species_df.reset_index(drop=True))
+    return species_list
+
+
+@pytest.fixture(scope="session")
+def mass_index(theor_peaks_list):
+    return build_mass_index(theor_peaks_list)
+
+
+@pytest.fixture(scope="session")
+def peaks_df(theor_peaks_list):
+    """A PMF with half its peaks from species 3"""
+    peaks_df = synthetic_peak_list(theor_peaks_list[3], 80, seed=2, mass_range=MASS_RANGE)
+    return peaks_df.astype("float32")
+
+
+@pytest.fixture(scope="session")
+def library_folder(theor_peaks_list, tmp_path_factory):
+    """The species written as a theoretical peptides csv folder"""
+    folder = tmp_path_factory.mktemp("filtered_peptides")
+    for number, species_df in enumerate(theor_peaks_list):
+        species_df.to_csv(folder / "Synthetic_species{0}_col1peptides_filt.csv".format(number))
+    return folder
+
+
+@pytest.fixture
+def pmf_file(peaks_df, tmp_path):
+    """The PMF saved as a peak list text file"""
+    return write_peak_list(peaks_df, tmp_path / "A1.txt")
@@ -0,0 +1,78 @@
+import numpy as np
+import pytest
+
+from casi.compare_peptides.bin_index import (
+    bin_match_counts,
+    build_bin_index,
+    load_bin_index,
+    read_bin_index,
+    species_bins,
+)
+from casi.compare_peptides.mass_index import species_match_counts
+from conftest import MASS_RANGE
+
+
+@pytest.fixture(scope="module")
+def bin_index(mass_index):
+    return build_bin_index(mass_index, 0.2, MASS_RANGE)
+
+
+def test_only_exact_bins(bin_index, mass_index):
+    # a peak equal to a theoretical m/z value is in an exact bin,
+    # so no peaks are checked with the mass index
+    exp_mz = mass_index.masses[[500]]
+    counts = bin_match_counts(bin_index, mass_index, exp_mz)
+    assert counts.tolist() == species_match_counts(mass_index, exp_mz, 0.2).tolist()
+    assert counts.sum() > 0
+
+
+def test_no_peaks(bin_index, mass_index):
+    counts = bin_match_counts(bin_index, mass_index, np.empty(0, dtype=np.float32))
+    assert counts.tolist() == [0] * mass_index.num_species
+
+
+def test_saved_and_reused(mass_index, tmp_path):
+    index_file = tmp_path / "bins.npz"
+    bin_index = load_bin_index(mass_index, 0.2, MASS_RANGE, index_file)
+    assert index_file.is_file()
+    # no temporary files are left behind
+    assert [path.name for path in tmp_path.iterdir()] == ["bins.npz"]
+    reused = load_bin_index(mass_index, 0.2, MASS_RANGE, index_file)
+    assert np.array_equal(reused.certain, bin_index.certain)
+    assert np.array_equal(reused.possible, bin_index.possible)
+
+
+def test_broken_file_is_rebuilt(mass_index, tmp_path):
+    index_file = tmp_path / "bins.npz"
+    index_file.write_bytes(b"not a npz file")
+    assert read_bin_index(index_file) is None
+    load_bin_index(mass_index, 0.2, MASS_RANGE, index_file)
+    assert read_bin_index(index_file) is not None
+
+
+def test_read_only_folder(mass_index, tmp_path, monkeypatch):
+    def read_only(bin_index, index_file):
+        raise PermissionError("Read-only file system")
+
+    monkeypatch.setattr("casi.compare_peptides.bin_index.save_bin_index", read_only)
+    bin_index = load_bin_index(mass_index, 0.2, MASS_RANGE, tmp_path / "bins.npz")
+    assert bin_index is not None
+    assert not (tmp_path / "bins.npz").exists()
+
+
+def test_species_bins_packed(mass_index):
+    # the bits are the same as packing the dense bins x species matrix
+    num_bins = 5000
+    rng = np.random.default_rng(0)
+    bin_start = rng.integers(-10, num_bins, size=len(mass_index.masses))
+    bin_end = bin_start + rng.integers(-1, 30, size=len(mass_index.masses))
+    covered = np.zeros((num_bins, mass_index.num_species), dtype=bool)
+    for mass_id in range(len(mass_index.masses)):
+        first, last = mass_index.indptr[mass_id], mass_index.indptr[mass_id + 1]
+        start, end = max(bin_start[mass_id], 0), min(bin_end[mass_id], num_bins - 1)
+        if end < start:
+            continue
+        for species in mass_index.species_ids[first:last]:
+            covered[start:end + 1, species] = True
+    bitsets = species_bins(mass_index, bin_start, bin_end, num_bins)
+    assert np.array_equal(bitsets, np.packbits(covered, axis=1))
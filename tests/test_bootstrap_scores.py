@@ -0,0 +1,30 @@
+import numpy as np
+
+from casi.compare_peptides.bootstrap_scores import BootstrapSettings, bootstrap_top, hit_matrix
+from casi.compare_peptides.mass_index import species_match_counts
+
+
+def test_hit_matrix_no_hits(mass_index):
+    exp_mz = np.array([100.0, 150.0], dtype=np.float32)
+    hits = hit_matrix(mass_index, exp_mz, 0.2)
+    assert hits.shape == (2, mass_index.num_species)
+    assert not hits.any()
+
+
+def test_hit_matrix_counts(mass_index, peaks_df):
+    exp_mz = np.unique(peaks_df["MZ"].to_numpy())
+    hits = hit_matrix(mass_index, exp_mz, 0.2)
+    assert hits.sum(axis=0).tolist() == species_match_counts(mass_index, exp_mz, 0.2).tolist()
+
+
+def test_no_hits_shares_top(mass_index):
+    # every species has 0 matches so each replicate is shared equally
+    exp_mz = np.array([100.0, 150.0], dtype=np.float32)
+    top = bootstrap_top(mass_index, exp_mz, 0.2, BootstrapSettings(10, 0))
+    assert np.allclose(top, 1 / mass_index.num_species)
+
+
+def test_top_species(mass_index, peaks_df):
+    top = bootstrap_top(mass_index, peaks_df["MZ"].to_numpy(), 0.2, BootstrapSettings(50, 0))
+    assert np.isclose(top.sum(), 1)
+    assert top.argmax() == 3
@@ -0,0 +1,125 @@
+"""
+The in silico digest of a tiny COL1 fasta file (two real sequence
+fragments, one with an X, lysine only and an empty sequence) against
+the digests saved by the pyteomics version of cleave_and_mass
+(tests/data/tiny_col1_digest.csv.gz)
+"""
+
+import gzip
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+from casi.theoretical_peptides.generate_peptides.cleave_all_sequences import (
+    collagen_peptide_mass,
+)
+from casi.theoretical_peptides.generate_peptides.cleave_mass import PeptideMemo, cleave_and_mass
+from casi.theoretical_peptides.generate_peptides.digest_cache import DigestCache, digest_key
+from casi.theoretical_peptides.sort_sequences.merge_cola1a2 import read_combined_fasta
+
+DATA = Path(__file__).parent / "data"
+TINY_FASTA = DATA / "tiny_col1.fasta"
+RULES = ["trypsin", "lysc"]
+MISSED_CLEAVAGES = [0, 1, 2]
+
+
+@pytest.fixture(scope="module")
+def sequences():
+    return list(read_combined_fasta(TINY_FASTA).values())
+
+
+@pytest.fixture(scope="module")
+def expected_csv():
+    with gzip.open(DATA / "tiny_col1_digest.csv.gz", "rt", encoding="utf-8") as file:
+        return file.read()
+
+
+def digest_csv(sequences: list, digest) -> str:
+    """The digests of every sequence, rule and missed cleavages as one csv"""
+    frames = []
+    for number, seq in enumerate(sequences):
+        for rule in RULES:
+            for missed in MISSED_CLEAVAGES:
+                peptide_df = digest(seq, rule, missed)
+                peptide_df.insert(0, "missed_setting", missed)
+                peptide_df.insert(0, "rule", rule)
+                peptide_df.insert(0, "entry", number)
+                frames.append(peptide_df)
+    return pd.concat(frames, ignore_index=True).to_csv(index=False)
+
+
+def test_cleave_and_mass(sequences, expected_csv):
+    assert digest_csv(sequences, cleave_and_mass) == expected_csv
+
+
+@pytest.mark.parametrize("max_peptides", [100000, 5, 1])
+def test_cleave_and_mass_memo(sequences, expected_csv, max_peptides):
+    # one memo shared by every digest, as in STEP 4
+    memo = PeptideMemo(max_peptides)
+    digest = lambda seq, rule, missed: cleave_and_mass(seq, rule, missed, memo)
+    assert digest_csv(sequences, digest) == expected_csv
+    assert memo.hits > 0
+    assert len(memo) <= max_peptides
+    assert memo.evictions == memo.misses - len(memo)
+
+
+def test_peptide_memo_counts():
+    memo = PeptideMemo(2)
+    cleave_and_mass("GPPGKGPAGRGPPGK", "trypsin", 0, memo)
+    assert (memo.hits, memo.misses, memo.evictions) == (0, 2, 0)
+    cleave_and_mass("GPAGRGMPGK", "trypsin", 0, memo)
+    assert (memo.hits, memo.misses, memo.evictions) == (1, 3, 1)
+    assert len(memo) == 2
+
+
+def test_digest_key():
+    key = digest_key("GPPGKGPAGR", "trypsin", 1)
+    assert key == digest_key("GPPGKGPAGR", "trypsin", 1)
+    assert key != digest_key("GPPGKGPAGK", "trypsin", 1)
+    assert key != digest_key("GPPGKGPAGR", "lysc", 1)
+    assert key != digest_key("GPPGKGPAGR", "trypsin", 0)
+
+
+def test_digest_cache(sequences, expected_csv, tmp_path):
+    cache = DigestCache(tmp_path / "cache")
+    # the first pass digests and saves, the second reads every digest
+    assert digest_csv(sequences, cache.cleave_and_mass) == expected_csv
+    misses = cache.misses
+    assert (cache.hits, misses) == (0, len(sequences) * len(RULES) * len(MISSED_CLEAVAGES))
+    assert digest_csv(sequences, cache.cleave_and_mass) == expected_csv
+    assert (cache.hits, cache.misses) == (misses, misses)
+    # the files are only renamed into place, no temporary files are left
+    assert not list(cache.cache_dir.rglob("*.tmp"))
+    assert len(list(cache.cache_dir.rglob("*.npz"))) == misses
+
+
+def test_digest_cache_bad_file(tmp_path):
+    seq = "GPPGKGPAGRGMPGK"
+    cache = DigestCache(tmp_path)
+    key = digest_key(seq, "trypsin", 1)
+    path = cache.path(key)
+    path.parent.mkdir()
+    # e.g., left by a run that was killed while writing the file
+    path.write_bytes(b"PK\x03\x04 not a digest")
+    assert cache.load(key, seq) is None
+    peptide_df = cache.cleave_and_mass(seq, "trypsin", 1)
+    assert cache.misses == 1
+    pd.testing.assert_frame_equal(cache.load(key, seq), peptide_df)
+
+
+@pytest.mark.parametrize("memo_size, use_cache", [(0, False), (100000, True)])
+def test_collagen_peptide_mass_workers(tmp_path, memo_size, use_cache):
+    col_dict = read_combined_fasta(TINY_FASTA)
+    outputs = {}
+    for workers in [1, 2]:
+        output_folder = tmp_path / "workers_{0}".format(workers)
+        output_folder.mkdir()
+        cache_dir = tmp_path / "cache" if use_cache else None
+        collagen_peptide_mass(col_dict, output_folder, workers, memo_size, cache_dir)
+        outputs[workers] = {
+            path.name: path.read_bytes()
+            for path in (output_folder / "unfiltered_peptides").iterdir()
+        }
+    assert len(outputs[1]) == len(col_dict)
+    assert outputs[1] == outputs[2]
@@ -0,0 +1,86 @@
+import pandas as pd
+import pytest
+
+from casi.compare_peptides.synthetic_data import write_peak_list
+from casi.scripts.compare_score import main
+
+
+def test_single_pmf(library_folder, pmf_file, tmp_path):
+    output = tmp_path / "results.csv"
+    main(["-it", str(library_folder), "-ip", str(pmf_file), "-o", str(output)])
+    results_df = pd.read_csv(output, index_col=0)
+    assert results_df.loc[0, "species"] == "Synthetic species3"
+
+
+def test_batch_of_one(library_folder, pmf_file, tmp_path):
+    # -ib is always batch mode, even if only one file is found
+    output = tmp_path / "summary.csv"
+    main(["-it", str(library_folder), "-ib", str(pmf_file.parent), "-o", str(output)])
+    summary_df = pd.read_csv(output, index_col=0)
+    assert summary_df["Sample"].tolist() == ["A1"]
+    assert "Second Match" in summary_df
+    assert (tmp_path / "A1_summary.csv").is_file()
+
+
+def test_sweep_batch_of_one(library_folder, pmf_file, tmp_path):
+    output = tmp_path / "summary.csv"
+    main([
+        "-it", str(library_folder), "-ib", str(pmf_file.parent), "-o", str(output),
+        "-ts", "0.1,0.2",
+    ])
+    summary_df = pd.read_csv(output, index_col=0)
+    assert summary_df["Sample"].tolist() == ["A1"]
+    assert (tmp_path / "A1_summary.csv").is_file()
+
+
+def test_batch_same_names(library_folder, peaks_df, tmp_path):
+    # A1.txt on two plates would save to the same results file
+    for plate in ("plate1", "plate2"):
+        (tmp_path / plate).mkdir()
+        write_peak_list(peaks_df, tmp_path / plate / "A1.txt")
+    output = tmp_path / "summary.csv"
+    with pytest.raises(Exception, match="same name"):
+        main([
+            "-it", str(library_folder), "-ib", str(tmp_path / "plate*" / "A1.txt"),
+            "-o", str(output),
+        ])
+    assert not output.exists()
+
+
+@pytest.mark.parametrize("option", [
+    ["-e", "index"], ["-bc", "."], ["-w", "2"], ["-d", "10"], ["-b", "10"], ["-mk", "3"], ["-m5", "1"],
+])
+def test_sweep_options(library_folder, pmf_file, tmp_path, option):
+    # options the tolerance sweep does not use are rejected, not ignored
+    with pytest.raises(SystemExit):
+        main([
+            "-it", str(library_folder), "-ip", str(pmf_file), "-o", str(tmp_path / "results.csv"),
+            "-ts", "0.1,0.2", *option,
+        ])
+    assert not (tmp_path / "results.csv").exists()
+
+
+def test_bitmap_bins_not_in_library(library_folder, pmf_file, tmp_path):
+    # without -bc the bins are only built for the run
+    before = sorted(library_folder.iterdir())
+    main([
+        "-it", str(library_folder), "-ip", str(pmf_file), "-o", str(tmp_path / "results.csv"),
+        "-e", "bitmap",
+    ])
+    assert sorted(library_folder.iterdir()) == before
+
+
+def test_bitmap_bin_cache(library_folder, pmf_file, tmp_path, capsys):
+    bin_cache = tmp_path / "bins"
+    bin_cache.mkdir()
+    arguments = [
+        "-it", str(library_folder), "-ip", str(pmf_file), "-o", str(tmp_path / "results.csv"),
+        "-e", "bitmap", "-bc", str(bin_cache),
+    ]
+    main(arguments)
+    bin_file = bin_cache / "{0}_bins_t0.2.npz".format(library_folder.name)
+    assert bin_file.is_file()
+    capsys.readouterr()
+    main(arguments)
+    # reused rather than built again
+    assert "Building bin index" not in capsys.readouterr().out
@@ -0,0 +1,39 @@
+import numpy as np
+
+from casi.compare_peptides.decoy_scores import (
+    DecoySettings,
+    decoy_match_counts,
+    decoy_significance,
+)
+from casi.compare_peptides.mass_index import species_match_counts
+from conftest import MASS_RANGE
+
+
+def test_no_hits(mass_index):
+    # decoys in a mass range without theoretical m/z values
+    settings = DecoySettings(20, "random", (100, 200), 0)
+    exp_mz = np.array([150.0], dtype=np.float32)
+    match_counts = species_match_counts(mass_index, exp_mz, 0.2)
+    significance = decoy_significance(mass_index, exp_mz, match_counts, 0.2, settings)
+    assert significance.decoy_mean.tolist() == [0] * mass_index.num_species
+    assert significance.p_value.tolist() == [1.0] * mass_index.num_species
+
+
+def test_no_peaks(mass_index):
+    settings = DecoySettings(20, "shift", MASS_RANGE, 0)
+    exp_mz = np.empty(0, dtype=np.float32)
+    match_counts = species_match_counts(mass_index, exp_mz, 0.2)
+    significance = decoy_significance(mass_index, exp_mz, match_counts, 0.2, settings)
+    assert significance.decoy_mean.tolist() == [0] * mass_index.num_species
+
+
+def test_counts_match_each_decoy(mass_index, peaks_df):
+    # all decoys looked up together give the same counts as one at a time
+    decoy_mz = np.stack([
+        peaks_df["MZ"].to_numpy(),
+        peaks_df["MZ"].to_numpy() + 37.5,
+        np.full(len(peaks_df), 150.0, dtype=np.float32),
+    ])
+    counts = decoy_match_counts(mass_index, decoy_mz, 0.2)
+    for decoy, decoy_counts in zip(decoy_mz, counts):
+        assert decoy_counts.tolist() == species_match_counts(mass_index, decoy, 0.2).tolist()
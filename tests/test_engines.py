@@ -0,0 +1,78 @@
+"""The search, index and bitmap engines give the same results"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from casi.compare_peptides.bin_index import build_bin_index
+from casi.scripts.compare_score import Engine, filter_mass_range, main, rank_species
+from conftest import MASS_RANGE
+
+
+def engines(mass_index, threshold):
+    bin_index = build_bin_index(mass_index, threshold, MASS_RANGE)
+    return [
+        Engine("search", mass_index=mass_index),
+        Engine("index", mass_index=mass_index),
+        Engine("bitmap", mass_index=mass_index, bin_index=bin_index),
+    ]
+
+
+def rank_all(theor_peaks_list, mass_index, act_peaks_df, threshold):
+    act_peaks_df, total_peaks = filter_mass_range(act_peaks_df, MASS_RANGE)
+    return [
+        rank_species(theor_peaks_list, act_peaks_df, threshold, total_peaks, engine)
+        for engine in engines(mass_index, threshold)
+    ]
+
+
+@pytest.mark.parametrize("threshold", [0.05, 0.2, 0.5])
+def test_same_results(theor_peaks_list, mass_index, peaks_df, threshold):
+    results = rank_all(theor_peaks_list, mass_index, peaks_df, threshold)
+    search_df, search_top = results[0]
+    assert search_df["Match"].max() > 0
+    for results_df, top_species in results[1:]:
+        pd.testing.assert_frame_equal(
+            results_df, search_df, check_dtype=False, check_index_type=False
+        )
+        assert top_species == search_top
+
+
+def test_peaks_on_theoretical_masses(theor_peaks_list, mass_index):
+    # peaks exactly on theoretical m/z values and at the edge of the threshold
+    masses = mass_index.masses[::50].astype(np.float64)
+    mz = np.concatenate([masses, masses + 0.2, masses - 0.2])
+    act_peaks_df = pd.DataFrame({"MZ": mz, "intensity": 1.0}).astype("float32")
+    results = rank_all(theor_peaks_list, mass_index, act_peaks_df, 0.2)
+    for results_df, _ in results[1:]:
+        assert results_df["Match"].tolist() == results[0][0]["Match"].tolist()
+        assert results_df["species"].tolist() == results[0][0]["species"].tolist()
+
+
+@pytest.mark.parametrize("mz", [[], [100.0, 5000.0], "gap"])
+def test_no_hits(theor_peaks_list, mass_index, mz):
+    # an empty PMF, no peaks in the mass range and no peak matching any species
+    if mz == "gap":
+        # the middle of the largest gap between theoretical m/z values
+        gap = np.diff(mass_index.masses).argmax()
+        mz = [(float(mass_index.masses[gap]) + float(mass_index.masses[gap + 1])) / 2]
+    act_peaks_df = pd.DataFrame({"MZ": mz, "intensity": 1.0}).astype("float32")
+    for results_df, top_species in rank_all(theor_peaks_list, mass_index, act_peaks_df, 0.2):
+        assert results_df["Match"].tolist() == [0] * len(theor_peaks_list)
+        assert len(top_species) == 5
+
+
+@pytest.mark.parametrize("engine", ["search", "index", "bitmap"])
+def test_blank_spot_in_batch(library_folder, pmf_file, tmp_path, engine):
+    # a blank spot (no peaks) does not stop the batch
+    (tmp_path / "A2.txt").write_text("")
+    (tmp_path / "A3.txt").write_text("5000.0\t10.0\n")
+    output = tmp_path / "summary.csv"
+    main([
+        "-it", str(library_folder), "-ib", str(tmp_path), "-o", str(output),
+        "-e", engine, "-d", "10", "-b", "10", "-mk", "2",
+    ])
+    summary_df = pd.read_csv(output, index_col=0)
+    assert summary_df["Sample"].tolist() == ["A1", "A2", "A3"]
+    assert summary_df["Match"].tolist()[1:] == [0, 0]
+    assert summary_df.loc[0, "species"] == "Synthetic species3"
@@ -0,0 +1,30 @@
+import numpy as np
+
+from casi.compare_peptides.mass_index import peak_species_hits, species_match_counts
+
+
+def test_no_peaks(mass_index):
+    exp_mz = np.empty(0, dtype=np.float32)
+    peak_ids, species_ids = peak_species_hits(mass_index, exp_mz, 0.2)
+    assert len(peak_ids) == 0 and len(species_ids) == 0
+    counts = species_match_counts(mass_index, exp_mz, 0.2)
+    assert counts.tolist() == [0] * mass_index.num_species
+
+
+def test_no_hits(mass_index):
+    # below the smallest theoretical m/z value
+    exp_mz = np.array([100.0, 200.0], dtype=np.float32)
+    peak_ids, species_ids = peak_species_hits(mass_index, exp_mz, 0.2)
+    assert len(peak_ids) == 0 and len(species_ids) == 0
+    counts = species_match_counts(mass_index, exp_mz, 0.2)
+    assert counts.tolist() == [0] * mass_index.num_species
+
+
+def test_pairs_are_unique(mass_index, theor_peaks_list):
+    # a peak within the threshold of two m/z values of a species is one hit
+    masses = np.sort(theor_peaks_list[0]["mass1"].to_numpy())
+    exp_mz = masses[:1]
+    peak_ids, species_ids = peak_species_hits(mass_index, exp_mz, 50.0)
+    pairs = list(zip(peak_ids.tolist(), species_ids.tolist()))
+    assert len(pairs) == len(set(pairs))
+    assert (0, 0) in pairs
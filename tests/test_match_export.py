@@ -0,0 +1,45 @@
+import json
+
+import pandas as pd
+import pytest
+
+from casi.compare_peptides.match_export import MatchExport, match_rows
+from casi.scripts.compare_score import compare
+
+
+@pytest.fixture
+def rows(theor_peaks_list, peaks_df):
+    matches_df = compare(theor_peaks_list[3], peaks_df, 0.2)[1]
+    return match_rows("A1", 1, matches_df)
+
+
+def test_float32_digits(rows, peaks_df):
+    # the m/z values are the same as in the peak list, not widened float32
+    peak_list = set(peaks_df["MZ"].astype(str).astype(float))
+    assert len(rows) > 0
+    assert set(rows["Exp MZ"]) <= peak_list
+    assert rows["Exp MZ"].dtype == "float64"
+
+
+@pytest.mark.parametrize("export_format", ["csv", "jsonl"])
+def test_written_digits(rows, peaks_df, tmp_path, export_format):
+    path = tmp_path / "matches.{0}".format(export_format)
+    with MatchExport(path, export_format, 1) as match_export:
+        match_export.write(rows)
+    if export_format == "csv":
+        written = pd.read_csv(path, dtype={"Exp MZ": str})["Exp MZ"].tolist()
+    else:
+        written = [
+            json.dumps(json.loads(line)["Exp MZ"]) for line in path.read_text().splitlines()
+        ]
+    peak_list = set(peaks_df["MZ"].astype(str))
+    assert set(written) <= peak_list
+
+
+def test_parquet_digits(rows, peaks_df, tmp_path):
+    pytest.importorskip("pyarrow")
+    path = tmp_path / "matches.parquet"
+    with MatchExport(path, "parquet", 1) as match_export:
+        match_export.write(rows)
+    written = pd.read_parquet(path)["Exp MZ"]
+    assert set(written) <= set(peaks_df["MZ"].astype(str).astype(float))
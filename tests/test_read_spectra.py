@@ -0,0 +1,43 @@
+import pytest
+
+from casi.compare_peptides.read_spectra import read_spectrum, scan_offsets
+from casi.scripts.compare_score import main
+
+EMPTY_FILES = {
+    "empty.mzXML": """<?xml version="1.0" encoding="ISO-8859-1"?>
+<mzXML xmlns="http://sashimi.sourceforge.net/schema_revision/mzXML_2.1">
+<msRun scanCount="0">
+</msRun>
+</mzXML>
+""",
+    "empty.mzML": """<?xml version="1.0" encoding="utf-8"?>
+<mzML xmlns="http://psi.hupo.org/ms/mzml">
+<run id="run1">
+<spectrumList count="0">
+</spectrumList>
+</run>
+</mzML>
+""",
+}
+
+
+@pytest.fixture(params=list(EMPTY_FILES))
+def empty_file(request, tmp_path):
+    path = tmp_path / request.param
+    path.write_text(EMPTY_FILES[request.param])
+    return path
+
+
+def test_no_scans(empty_file):
+    with pytest.raises(Exception, match="No scans found"):
+        scan_offsets(empty_file)
+    with pytest.raises(Exception, match="No scans found"):
+        read_spectrum(empty_file)
+
+
+def test_no_scans_compare_score(empty_file, library_folder, tmp_path):
+    with pytest.raises(Exception, match="No scans found in .*{0}".format(empty_file.name)):
+        main([
+            "-it", str(library_folder), "-ip", str(empty_file), "-o", str(tmp_path / "results.csv"),
+        ])
+
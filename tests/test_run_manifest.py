@@ -0,0 +1,33 @@
+import threading
+
+from casi.run_manifest import write_file
+
+
+def test_write_file(tmp_path):
+    path = tmp_path / "run.json"
+    write_file(path, "first")
+    write_file(path, "second")
+    assert path.read_text() == "second"
+    assert [file.name for file in tmp_path.iterdir()] == ["run.json"]
+
+
+def test_write_file_same_time(tmp_path):
+    # runs writing the same manifest at the same time never fail
+    path = tmp_path / "run.prom"
+    errors = []
+
+    def write(number):
+        try:
+            for _ in range(50):
+                write_file(path, "run {0}\n".format(number) * 1000)
+        except OSError as error:
+            errors.append(error)
+
+    threads = [threading.Thread(target=write, args=(number,)) for number in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not errors
+    assert len(set(path.read_text().splitlines())) == 1
+    assert [file.name for file in tmp_path.iterdir()] == ["run.prom"]
@@ -0,0 +1,100 @@
+import json
+import socket
+import threading
+import http.client
+
+import pandas as pd
+import pytest
+
+from casi.compare_peptides.score_service import create_server
+from casi.scripts.compare_score import Engine, filter_mass_range, rank_species
+from conftest import MASS_RANGE
+
+
+@pytest.fixture(scope="module")
+def service(theor_peaks_list, mass_index):
+    engine = Engine("index", mass_index=mass_index)
+
+    def score_peaks(mz, intensity, threshold):
+        if threshold is None:
+            threshold = 0.2
+        if threshold == 99:
+            raise RuntimeError("scoring broke")
+        act_peaks_df = pd.DataFrame({"MZ": mz, "intensity": intensity}).astype("float32")
+        act_peaks_df, total_peaks = filter_mass_range(act_peaks_df, MASS_RANGE)
+        return rank_species(theor_peaks_list, act_peaks_df, threshold, total_peaks, engine)[0]
+
+    server = create_server(score_peaks, len(theor_peaks_list), port=0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server.server_address[:2]
+    server.shutdown()
+    server.server_close()
+
+
+def post(address, body, path="/score"):
+    connection = http.client.HTTPConnection(*address, timeout=10)
+    connection.request("POST", path, body=json.dumps(body))
+    response = connection.getresponse()
+    content = json.loads(response.read())
+    connection.close()
+    return response.status, content
+
+
+def test_scores_peaks(service, peaks_df):
+    status, content = post(service, {"peaks": peaks_df.to_numpy().tolist(), "top": 3})
+    assert status == 200
+    assert len(content["results"]) == 3
+    assert content["results"][0]["species"] == "Synthetic species3"
+
+
+@pytest.mark.parametrize("peaks", [[], [[100.0, 5.0]], [[5000.0, 5.0]]])
+def test_no_hits(service, peaks):
+    # empty PMF, no peaks in the mass range and no peak matching any species
+    status, content = post(service, {"peaks": peaks})
+    assert status == 200
+    assert all(result["Match"] == 0 for result in content["results"])
+
+
+@pytest.mark.parametrize("body", [
+    {"peaks": {"a": 1}},
+    {"peaks": [[1000.0, "x"]]},
+    {"peaks": [1000.0, 5.0]},
+    {"peaks": [[1000.0, 5.0]], "threshold": -0.1},
+    {"peaks": [[1000.0, 5.0]], "threshold": "nan"},
+    {"peaks": [[1000.0, 5.0]], "threshold": "abc"},
+    {"peaks": [[1000.0, 5.0]], "top": -1},
+])
+def test_bad_request(service, body):
+    status, content = post(service, body)
+    assert status == 400
+    assert "error" in content
+
+
+def test_scoring_error(service):
+    status, content = post(service, {"peaks": [[1000.0, 5.0]], "threshold": 99})
+    assert status == 500
+    assert "scoring broke" in content["error"]
+    # the service keeps running
+    assert post(service, {"peaks": [[1000.0, 5.0]]})[0] == 200
+
+
+def test_unknown_path(service):
+    assert post(service, {}, path="/other")[0] == 404
+
+
+def test_socket_path_is_not_a_socket(tmp_path):
+    results = tmp_path / "results.csv"
+    results.write_text("keep me")
+    with pytest.raises(Exception, match="not a socket"):
+        create_server(None, 0, socket_path=results)
+    assert results.read_text() == "keep me"
+
+
+def test_old_socket_is_replaced(tmp_path):
+    socket_path = tmp_path / "score.sock"
+    old = socket.socket(socket.AF_UNIX)
+    old.bind(str(socket_path))
+    old.close()
+    server = create_server(None, 0, socket_path=socket_path)
+    server.server_close()
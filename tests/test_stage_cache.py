@@ -0,0 +1,148 @@
+from pathlib import Path
+
+import pytest
+
+from casi.scripts.theoretical_peps import STEP_4, run_step
+from casi.stage_cache import StageCache, fingerprint
+from casi.theoretical_peptides.generate_peptides import cleave_all_sequences, cleave_mass
+from casi.theoretical_peptides.generate_peptides.digest_cache import digest_settings
+from casi.theoretical_peptides.sort_sequences.merge_cola1a2 import read_combined_fasta
+
+
+@pytest.fixture
+def step_files(tmp_path):
+    """An input file and the output file a step writes from it"""
+    input_file = tmp_path / "input.fasta"
+    input_file.write_text(">a\nGPPGPQGAR\n")
+    output_folder = tmp_path / "output"
+    output_folder.mkdir()
+    return input_file, output_folder, output_folder / "output.csv"
+
+
+def run_counter(output_file):
+    """A step that writes its output and counts the times it was run"""
+    runs = []
+
+    def run(stage_fingerprint):
+        runs.append(stage_fingerprint)
+        output_file.write_text("peptides\n")
+
+    return run, runs
+
+
+def test_fingerprint(tmp_path):
+    input_file = tmp_path / "input.fasta"
+    input_file.write_text(">a\nGPPGPQGAR\n")
+    stage_fingerprint = fingerprint([input_file], {"species_class": "mammals"})
+    assert stage_fingerprint == fingerprint([input_file], {"species_class": "mammals"})
+    assert stage_fingerprint != fingerprint([input_file], {"species_class": "birds"})
+    # only the content of the file, not its name
+    renamed = tmp_path / "renamed.fasta"
+    input_file.rename(renamed)
+    assert stage_fingerprint == fingerprint([renamed], {"species_class": "mammals"})
+    renamed.write_text(">a\nGPPGPQGAK\n")
+    assert stage_fingerprint != fingerprint([renamed], {"species_class": "mammals"})
+
+
+def test_run_step(step_files):
+    input_file, output_folder, output_file = step_files
+    run, runs = run_counter(output_file)
+    settings = {"species_class": "mammals"}
+    assert run_step(StageCache(output_folder), "STEP 2", [input_file], [output_file], run, settings)
+    # up to date in a new run with the same inputs and settings
+    assert not run_step(StageCache(output_folder), "STEP 2", [input_file], [output_file], run, settings)
+    assert len(runs) == 1
+    # a changed option, input, output or --force runs the step again
+    settings = {"species_class": "birds"}
+    assert run_step(StageCache(output_folder), "STEP 2", [input_file], [output_file], run, settings)
+    input_file.write_text(">a\nGPPGPQGAK\n")
+    assert run_step(StageCache(output_folder), "STEP 2", [input_file], [output_file], run, settings)
+    output_file.write_text("changed\n")
+    assert run_step(StageCache(output_folder), "STEP 2", [input_file], [output_file], run, settings)
+    stage_cache = StageCache(output_folder, force=True)
+    assert run_step(stage_cache, "STEP 2", [input_file], [output_file], run, settings)
+    assert len(runs) == 5
+
+
+def test_run_step_digest_settings(step_files, monkeypatch):
+    # the digest settings are read when STEP 4 runs, so a changed
+    # PTM mass in cleave_mass gives a new fingerprint
+    input_file, output_folder, output_file = step_files
+    run, runs = run_counter(output_file)
+    settings = lambda: digest_settings("trypsin", 1)
+    assert run_step(StageCache(output_folder), STEP_4, [input_file], [output_file], run, settings)
+    assert not run_step(StageCache(output_folder), STEP_4, [input_file], [output_file], run, settings)
+    monkeypatch.setattr(cleave_mass, "HYD_MASS", cleave_mass.HYD_MASS + 0.001)
+    assert run_step(StageCache(output_folder), STEP_4, [input_file], [output_file], run, settings)
+    assert runs[0] != runs[1]
+
+
+def test_journal_resume(step_files):
+    input_file, output_folder, output_file = step_files
+    stage_cache = StageCache(output_folder)
+    stage_fingerprint = fingerprint([input_file], {"species_class": "mammals"})
+    output_file.write_text("peptides\n")
+    # the run stops after the first species
+    with stage_cache.journal(STEP_4, stage_fingerprint) as journal:
+        journal.add("0", [output_file], peptides=10)
+
+    with stage_cache.journal(STEP_4, stage_fingerprint, resume=True) as journal:
+        assert journal.resumed == 1
+        assert journal.done("0")["peptides"] == 10
+        assert journal.done("1") is None
+
+    # a changed option starts the step again
+    changed = fingerprint([input_file], {"species_class": "birds"})
+    with stage_cache.journal(STEP_4, changed, resume=True) as journal:
+        assert journal.done("0") is None
+    # the journal now has the new fingerprint, and --resume is needed
+    with stage_cache.journal(STEP_4, stage_fingerprint, resume=True) as journal:
+        assert journal.done("0") is None
+    with stage_cache.journal(STEP_4, stage_fingerprint) as journal:
+        journal.add("0", [output_file], peptides=10)
+    with stage_cache.journal(STEP_4, stage_fingerprint, resume=False) as journal:
+        assert journal.done("0") is None
+
+    # a species whose file changed is digested again
+    with stage_cache.journal(STEP_4, stage_fingerprint) as journal:
+        journal.add("0", [output_file], peptides=10)
+    output_file.write_text("half a file\n")
+    with stage_cache.journal(STEP_4, stage_fingerprint, resume=True) as journal:
+        assert journal.done("0") is None
+
+
+def test_record_removes_journal(step_files):
+    input_file, output_folder, output_file = step_files
+    stage_cache = StageCache(output_folder)
+    stage_fingerprint = fingerprint([input_file])
+    output_file.write_text("peptides\n")
+    with stage_cache.journal(STEP_4, stage_fingerprint) as journal:
+        journal.add("0", [output_file], peptides=10)
+    stage_cache.record(STEP_4, stage_fingerprint, [output_file])
+    assert not stage_cache.journal_path(STEP_4).exists()
+    assert StageCache(output_folder).up_to_date(STEP_4, stage_fingerprint)
+
+
+def test_collagen_peptide_mass_resume(tmp_path, monkeypatch):
+    col_dict = read_combined_fasta(Path(__file__).parent / "data" / "tiny_col1.fasta")
+    stage_cache = StageCache(tmp_path)
+    stage_fingerprint = fingerprint([], digest_settings("trypsin", 1))
+    with stage_cache.journal(STEP_4, stage_fingerprint) as journal:
+        cleave_all_sequences.collagen_peptide_mass(col_dict, tmp_path, journal=journal)
+    output_folder = tmp_path / "unfiltered_peptides"
+    outputs = {path.name: path.read_bytes() for path in output_folder.iterdir()}
+    # a species the run had not finished
+    (output_folder / "Homo_sapiens_col1_peptides.csv").unlink()
+    digested = []
+    digest_species = cleave_all_sequences.digest_species
+
+    def count_species(species_info, *args):
+        digested.append(species_info.species)
+        return digest_species(species_info, *args)
+
+    monkeypatch.setattr(cleave_all_sequences, "digest_species", count_species)
+    with stage_cache.journal(STEP_4, stage_fingerprint, resume=True) as journal:
+        cleave_all_sequences.collagen_peptide_mass(col_dict, tmp_path, journal=journal)
+    # only that species is digested again
+    assert digested == ["Homo sapiens"]
+    assert {path.name: path.read_bytes() for path in output_folder.iterdir()} == outputs
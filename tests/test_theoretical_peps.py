@@ -0,0 +1,15 @@
+import pytest
+
+from casi.scripts.theoretical_peps import parse_args
+
+
+@pytest.mark.parametrize("option", ["--manifest", "--prometheus"])
+def test_manifest_folder_missing(tmp_path, option):
+    # checked before the run starts, not when it is written at the end
+    fasta = tmp_path / "seqs.fasta"
+    fasta.write_text(">a\nGPP\n")
+    with pytest.raises(Exception, match="does not exist"):
+        parse_args([
+            "-ia1", str(fasta), "-ia2", str(fasta), "-o", str(tmp_path),
+            option, str(tmp_path / "missing" / "run.json"),
+        ])